@@ -0,0 +1,76 @@
+"""
+Micro-benchmark for file extension resolution, the per-URL cost of every rename pass.
+Resolves a fixed mix of URL shapes (real extensions, format names in path segments or
+query parameters, no hint at all) and reports the best time per URL over a few rounds.
+
+    python benchmarks/extensions.py                       100,000 URLs, 5 rounds
+    python benchmarks/extensions.py --count 10000 -o ext.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from downloader_core import DownloadManager
+
+URL_SHAPES = (
+    "https://cdn{n}.example.com/videos/2024/episode_{n}.mp4",
+    "https://media.example.org/files/{n}/Lecture%20{n}.PDF",
+    "https://stream.example.net/watch?v={n}&format=webm",
+    "https://example.com/download/mkv/{n}",
+    "https://subscriptions.example.com/subscribe/newsletter/{n}",
+    "https://images.example.com/thumbs/{n}/large?type=jpeg&w=640",
+    "https://api.example.com/v2/export/{n}?output=csv",
+    "https://example.com/get.php?id={n}&file=archive.zip",
+    "https://files.example.com/d/{n}",
+)
+
+def build_urls(count, seed=1):
+    rng = random.Random(seed)
+    return [rng.choice(URL_SHAPES).format(n=rng.randrange(10 ** 6)) for _ in range(count)]
+
+def best_time(function, urls, rounds):
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for url in urls:
+            function(url)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Extension resolution micro-benchmark")
+    parser.add_argument('--count', type=int, default=100000, help="URLs resolved per round")
+    parser.add_argument('--rounds', type=int, default=5, help="rounds; the fastest is reported")
+    parser.add_argument('-o', '--output', help="write the JSON results to this file instead of stdout")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    urls = build_urls(args.count)
+    manager = DownloadManager()
+    try:
+        results = {}
+        for name, function in (('get_proper_extension', manager.get_proper_extension),
+                               ('default_filename', manager.default_filename)):
+            elapsed = best_time(function, urls, args.rounds)
+            results[name] = {'seconds': round(elapsed, 4), 'ns_per_url': round(elapsed / len(urls) * 1e9)}
+    finally:
+        manager.shutdown()
+
+    report = {'count': len(urls), 'rounds': args.rounds, 'python': sys.version.split()[0], 'results': results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
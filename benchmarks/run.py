@@ -0,0 +1,258 @@
+"""
+Benchmark harness for DownloadManager. Each scenario downloads from in-process
+BenchmarkServers into a temporary directory and reports throughput, client CPU per GB,
+peak RSS and time-to-first-byte percentiles as JSON, so runs can be compared over time.
+
+    python benchmarks/run.py                              all scenarios, both engines
+    python benchmarks/run.py --scale 0.01 -o before.json  quick run, results to a file
+    python benchmarks/run.py --compare before.json        fail if anything regressed
+
+Every scenario runs in a fresh subprocess so peak RSS is measured per scenario.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from downloader_core import DownloadManager
+from server import BenchmarkServer, ServerOptions
+
+KB = 1024
+MB = 1024 * KB
+GB = 1024 * MB
+
+def scaled(value, scale, minimum=1):
+    return max(minimum, int(value * scale))
+
+def single_large(scale):
+    servers = [ServerOptions()]
+    files = [(0, 'large.bin', scaled(10 * GB, scale, MB))]
+    return servers, files
+
+def many_small(scale):
+    servers = [ServerOptions()]
+    files = [(0, f'small_{i:05d}.bin', 10 * KB) for i in range(scaled(10000, scale))]
+    return servers, files
+
+def mixed_hosts(scale):
+    servers = [
+        ServerOptions(seed=1),
+        ServerOptions(latency=0.05, seed=2),
+        ServerOptions(bandwidth=20 * MB, seed=3),
+        ServerOptions(chunked=True, error_rate=0.02, seed=4),
+    ]
+    files = []
+    for host in range(len(servers)):
+        files += [(host, f'h{host}_small_{i:03d}.bin', 10 * KB) for i in range(scaled(60, scale))]
+        files += [(host, f'h{host}_medium_{i:03d}.bin', MB) for i in range(scaled(30, scale))]
+        files += [(host, f'h{host}_large_{i:03d}.bin', scaled(20 * MB, scale, MB)) for i in range(scaled(10, scale))]
+    return servers, files
+
+SCENARIOS = {
+    'single_large': single_large,
+    'many_small': many_small,
+    'mixed_hosts': mixed_hosts,
+}
+
+class BenchmarkManager(DownloadManager):
+    """Records when each download is dispatched, to measure time-to-first-byte against the server."""
+    def __init__(self, *args, **kwargs):
+        self.dispatch_times = {}
+        super().__init__(*args, **kwargs)
+
+    def begin_progress(self, url, filename):
+        self.dispatch_times.setdefault(url, time.monotonic())
+        return super().begin_progress(url, filename)
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def run_scenario(name, engine, scale, concurrency, segments, workdir, verify):
+    server_options, files = SCENARIOS[name](scale)
+    servers = [BenchmarkServer(options).start() for options in server_options]
+    save_path = tempfile.mkdtemp(prefix=f'bench_{name}_', dir=workdir)
+    manager = BenchmarkManager(max_concurrent=concurrency, segments=segments, engine=engine)
+
+    jobs = [(servers[host].url_for(filename, size), filename, save_path) for host, filename, size in files]
+    sizes = {url: size for (url, _, _), (_, _, size) in zip(jobs, files)}
+    try:
+        cpu_before = cpu_seconds()
+        server_cpu_before = sum(server.cpu_seconds for server in servers)
+        started = time.monotonic()
+        manager.add_to_queue(jobs)
+        manager.start_downloads()
+        while manager.has_pending_work():
+            time.sleep(0.05)
+        elapsed = time.monotonic() - started
+        # Server threads share this process; their CPU time is not the downloader's.
+        client_cpu = (cpu_seconds() - cpu_before) - (sum(server.cpu_seconds for server in servers) - server_cpu_before)
+
+        completed = list(manager.completed_downloads)
+        failed = list(manager.failed_downloads)
+        retries = len(manager.telemetry.retrying)
+        total_bytes = sum(sizes[info['url']] for info in completed)
+
+        ttfb = []
+        for server in servers:
+            for url, first_byte in server.first_byte_times.items():
+                dispatched = manager.dispatch_times.get(url)
+                if dispatched is not None:
+                    ttfb.append(first_byte - dispatched)
+
+        corrupt = 0
+        for url, filename, _ in jobs:
+            path = os.path.join(save_path, filename)
+            if not os.path.exists(path) or os.path.getsize(path) != sizes[url]:
+                corrupt += 1 if os.path.exists(path) else 0
+                continue
+            if verify:
+                server = next(server for server in servers if url.startswith(server.base_url))
+                with open(path, 'rb') as f:
+                    if any(f.read(len(block)) != block for block in server.expected_content(sizes[url])):
+                        corrupt += 1
+    finally:
+        manager.shutdown()
+        for server in servers:
+            server.stop()
+        shutil.rmtree(save_path, ignore_errors=True)
+
+    return {
+        'scenario': name,
+        'engine': engine,
+        'scale': scale,
+        'files': len(jobs),
+        'completed': len(completed),
+        'failed': len(failed),
+        'corrupt': corrupt,
+        'retries': retries,
+        'bytes': total_bytes,
+        'seconds': round(elapsed, 3),
+        'throughput_mib_s': round(total_bytes / MB / elapsed, 2) if elapsed > 0 else None,
+        'files_per_second': round(len(completed) / elapsed, 1) if elapsed > 0 else None,
+        'cpu_seconds': round(client_cpu, 3),
+        'cpu_seconds_per_gb': round(client_cpu / (total_bytes / GB), 3) if total_bytes else None,
+        'peak_rss_mib': round(peak_rss_bytes() / MB, 1),
+        'ttfb_p50_ms': round(percentile(ttfb, 0.50) * 1000, 2) if ttfb else None,
+        'ttfb_p99_ms': round(percentile(ttfb, 0.99) * 1000, 2) if ttfb else None,
+    }
+
+def run_in_subprocess(name, engine, args):
+    command = [sys.executable, os.path.abspath(__file__), '--child', name, '--engine', engine,
+               '--scale', str(args.scale), '--concurrency', str(args.concurrency),
+               '--segments', str(args.segments), '--workdir', args.workdir]
+    if args.verify:
+        command.append('--verify')
+    completed = subprocess.run(command, stdout=subprocess.PIPE, check=True, text=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARK_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+# Metrics compared against a baseline: +1 means higher is better, -1 means lower is better.
+COMPARED_METRICS = {
+    'throughput_mib_s': 1,
+    'files_per_second': 1,
+    'cpu_seconds_per_gb': -1,
+    'peak_rss_mib': -1,
+    'ttfb_p50_ms': -1,
+    'ttfb_p99_ms': -1,
+}
+
+def compare(results, baseline, tolerance):
+    """Prints the change of every metric against the baseline. Returns the list of regressions."""
+    previous = {(r['scenario'], r['engine']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get((result['scenario'], result['engine']))
+        if old is None:
+            continue
+        for metric, direction in COMPARED_METRICS.items():
+            before, after = old.get(metric), result.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            regressed = change * direction < -tolerance
+            print(f"{result['scenario']:<14} {result['engine']:<9} {metric:<20} {before:>12} -> {after:<12} "
+                  f"{change:+.1%}{'  REGRESSION' if regressed else ''}", file=sys.stderr)
+            if regressed:
+                regressions.append((result['scenario'], result['engine'], metric, change))
+    return regressions
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="DownloadManager benchmarks")
+    parser.add_argument('--scenario', nargs='+', choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    parser.add_argument('--engine', nargs='+', choices=sorted(DownloadManager.ENGINES), default=sorted(DownloadManager.ENGINES))
+    parser.add_argument('--scale', type=float, default=1.0, help="multiplies file sizes and counts (e.g. 0.01 for a smoke run)")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--segments', type=int, default=4)
+    parser.add_argument('--workdir', default=tempfile.gettempdir(), help="where downloaded files are written")
+    parser.add_argument('--verify', action='store_true', help="check every downloaded byte against the server")
+    parser.add_argument('-o', '--output', help="write the JSON results to this file instead of stdout")
+    parser.add_argument('--compare', metavar='BASELINE', help="compare against an earlier results file")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="relative change counted as a regression")
+    parser.add_argument('--child', metavar='SCENARIO', help=argparse.SUPPRESS)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.child:
+        result = run_scenario(args.child, args.engine[0], args.scale, args.concurrency,
+                              args.segments, args.workdir, args.verify)
+        print(json.dumps(result))
+        return 0
+
+    results = []
+    for name in args.scenario:
+        for engine in args.engine:
+            print(f"Running {name} ({engine})...", file=sys.stderr)
+            results.append(run_in_subprocess(name, engine, args))
+
+    report = {'environment': environment(), 'results': results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
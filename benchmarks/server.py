@@ -0,0 +1,195 @@
+"""
+In-process HTTP server used as a stand-in for real download hosts by the benchmarks.
+
+Files are addressed as /files/<size>/<name> and their content is generated from a repeating
+pseudo-random block, so multi-gigabyte files cost no memory or disk on the server side.
+Latency, per-connection bandwidth, Range support, chunked transfer encoding and error
+injection are configured per server instance.
+"""
+import re
+import time
+import random
+import socket
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+
+BLOCK_SIZE = 1024 * 1024
+WRITE_SIZE = 64 * 1024
+
+class ServerOptions:
+    def __init__(self, latency=0.0, bandwidth=None, ranges=True, chunked=False,
+                 error_rate=0.0, reset_rate=0.0, seed=0):
+        # Seconds before the response head is sent.
+        self.latency = latency
+        # Bytes per second per connection; None means as fast as possible.
+        self.bandwidth = bandwidth
+        self.ranges = ranges
+        # Bodies are sent with Transfer-Encoding: chunked and without Content-Length (implies no ranges).
+        self.chunked = chunked
+        # Fraction of GET requests answered with 503, and of bodies cut off half way.
+        self.error_rate = error_rate
+        self.reset_rate = reset_rate
+        self.seed = seed
+
+class BenchmarkRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out as separate writes; without TCP_NODELAY small responses stall on delayed ACKs.
+    disable_nagle_algorithm = True
+    PATH_PATTERN = re.compile(r'^/files/(\d+)/')
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def _respond(self, send_body):
+        server = self.server
+        options = server.options
+        cpu_start = time.thread_time()
+        try:
+            match = self.PATH_PATTERN.match(self.path)
+            if not match:
+                self._send_empty(404)
+                return
+            size = int(match.group(1))
+
+            if options.latency:
+                time.sleep(options.latency)
+            if send_body and options.error_rate and server.random() < options.error_rate:
+                self._send_empty(503, {'Retry-After': '0'})
+                return
+
+            start, end = 0, size - 1
+            status = 200
+            range_header = self.headers.get('Range')
+            if range_header and options.ranges and not options.chunked:
+                range_match = re.match(r'bytes=(\d+)-(\d*)', range_header)
+                if range_match:
+                    start = int(range_match.group(1))
+                    end = min(int(range_match.group(2)), size - 1) if range_match.group(2) else size - 1
+                    if start >= size:
+                        self._send_empty(416, {'Content-Range': f'bytes */{size}'})
+                        return
+                    status = 206
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('ETag', f'"{size}-{options.seed}"')
+            self.send_header('Last-Modified', 'Thu, 01 Jan 2026 00:00:00 GMT')
+            if options.chunked:
+                self.send_header('Transfer-Encoding', 'chunked')
+            else:
+                self.send_header('Content-Length', str(end - start + 1))
+                if options.ranges:
+                    self.send_header('Accept-Ranges', 'bytes')
+                if status == 206:
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            self.end_headers()
+
+            if send_body:
+                server.record_first_byte(self.path)
+                cut_off = send_body and options.reset_rate and server.random() < options.reset_rate
+                self._send_body(start, end, cut_off)
+        except (BrokenPipeError, ConnectionResetError, socket.timeout):
+            self.close_connection = True
+        finally:
+            server.add_cpu_time(time.thread_time() - cpu_start)
+
+    def _send_empty(self, status, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _send_body(self, start, end, cut_off):
+        options = self.server.options
+        block = self.server.block
+        position = start
+        stop = end + 1
+        if cut_off:
+            stop = start + (stop - start) // 2
+        began = time.monotonic()
+
+        while position < stop:
+            offset = position % BLOCK_SIZE
+            count = min(WRITE_SIZE, stop - position, BLOCK_SIZE - offset)
+            data = block[offset:offset + count]
+            if options.chunked:
+                self.wfile.write(f"{count:x}\r\n".encode('ascii'))
+                self.wfile.write(data)
+                self.wfile.write(b"\r\n")
+            else:
+                self.wfile.write(data)
+            position += count
+
+            if options.bandwidth:
+                ahead = (position - start) / options.bandwidth - (time.monotonic() - began)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+        if cut_off:
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+        elif options.chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+class BenchmarkServer(ThreadingHTTPServer):
+    """A ThreadingHTTPServer on 127.0.0.1 that also records first-byte times and its own CPU use."""
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, options=None, host='127.0.0.1', port=0):
+        super().__init__((host, port), BenchmarkRequestHandler)
+        self.options = options or ServerOptions()
+        generator = random.Random(self.options.seed)
+        self.block = memoryview(generator.randbytes(BLOCK_SIZE))
+        self.random_lock = Lock()
+        self.random_source = random.Random(self.options.seed + 1)
+        self.stats_lock = Lock()
+        self.first_byte_times = {}
+        self.cpu_seconds = 0.0
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url_for(self, name, size):
+        return f"{self.base_url}/files/{size}/{name}"
+
+    def random(self):
+        with self.random_lock:
+            return self.random_source.random()
+
+    def record_first_byte(self, path):
+        now = time.monotonic()
+        with self.stats_lock:
+            self.first_byte_times.setdefault(self.base_url + path, now)
+
+    def add_cpu_time(self, seconds):
+        with self.stats_lock:
+            self.cpu_seconds += seconds
+
+    def expected_content(self, size):
+        """Yields the content of a file of the given size in blocks, to check a download against."""
+        position = 0
+        while position < size:
+            count = min(BLOCK_SIZE, size - position)
+            yield self.block[:count]
+            position += count
+
+    def start(self):
+        self.thread = Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
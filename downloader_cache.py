@@ -0,0 +1,235 @@
+import os
+import stat
+import time
+import shutil
+import sqlite3
+from threading import Lock
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+class DownloadCache:
+    """
+    Content-addressed store of finished downloads. Files live once under objects/, named by
+    their content digest, and an SQLite index maps each URL to its blob together with the
+    validators (ETag, Last-Modified, size) needed to revalidate it with a conditional request.
+    The store is bounded to max_bytes; the least recently used URLs are evicted first and a
+    blob is deleted when no URL refers to it any more.
+
+    Files are copied in and out by reflink (copy-on-write clone) where the filesystem supports
+    it, else by an in-kernel copy, so a download from the cache is an ordinary writable file
+    that shares nothing with the store. Blobs are stored read-only. The index records each
+    blob's modification time at ingest, and a blob whose size or mtime no longer match is
+    dropped instead of served.
+    """
+    FICLONE = 0x40049409
+    COPY_CHUNK = 64 * 1024 * 1024
+
+    def __init__(self, root, max_bytes=10 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects = os.path.join(root, 'objects')
+        os.makedirs(self.objects, exist_ok=True)
+
+        self.lock = Lock()
+        self.db = sqlite3.connect(os.path.join(root, 'index.sqlite3'), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                url TEXT PRIMARY KEY,
+                blob TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                stored REAL NOT NULL,
+                last_used REAL NOT NULL,
+                blob_mtime INTEGER
+            )""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_blob ON entries (blob)")
+        # Indexes from before the mtime stamp lack its column; their entries are never trusted.
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(entries)")]
+        if 'blob_mtime' not in columns:
+            self.db.execute("ALTER TABLE entries ADD COLUMN blob_mtime INTEGER")
+        self.db.commit()
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0, 'stored': 0, 'evicted': 0, 'bytes_saved': 0}
+
+    @staticmethod
+    def default_path():
+        return os.path.join(os.path.expanduser("~"), ".advanced_downloader", "cache")
+
+    def blob_path(self, blob):
+        return os.path.join(self.objects, blob[:2], blob)
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    def lookup(self, url):
+        """Returns the index entry for url as a dict, or None if it is not cached."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT blob, size, etag, last_modified, blob_mtime FROM entries WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            self._count('misses')
+            return None
+        blob, size, etag, last_modified, blob_mtime = row
+        path = self.blob_path(blob)
+        # Only SHA-256 addresses are collision-safe; a blob changed since ingest is not served.
+        if not blob.startswith('sha256-') or blob_mtime is None or self._stamp(path, size) != blob_mtime:
+            self.forget(url)
+            self._count('misses')
+            return None
+        return {'url': url, 'blob': blob, 'path': path, 'size': size, 'etag': etag, 'last_modified': last_modified}
+
+    @staticmethod
+    def _stamp(path, size):
+        """The mtime of the blob at path in nanoseconds, or None if it is missing or not size bytes long."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime_ns if st.st_size == size else None
+
+    def forget(self, url, stale=False):
+        with self.lock:
+            if stale:
+                self.stats['stale'] += 1
+            row = self.db.execute("SELECT blob FROM entries WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return
+            with self.db:
+                self.db.execute("DELETE FROM entries WHERE url = ?", (url,))
+            self._remove_unreferenced(row[0])
+
+    def materialize(self, entry, filepath):
+        """Creates filepath from a cached blob. Returns False if the blob could not be used."""
+        temp_path = filepath + '.cache-tmp'
+        try:
+            self._clone(entry['path'], temp_path)
+            os.replace(temp_path, filepath)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+
+        with self.lock:
+            with self.db:
+                self.db.execute("UPDATE entries SET last_used = ? WHERE url = ?", (time.time(), entry['url']))
+            self.stats['hits'] += 1
+            self.stats['bytes_saved'] += entry['size']
+        return True
+
+    def store(self, url, filepath, blob, etag=None, last_modified=None):
+        """Adds a finished download under its content digest blob, then evicts down to max_bytes."""
+        size = os.path.getsize(filepath)
+        if size > self.max_bytes:
+            return False
+        path = self.blob_path(blob)
+        with self.lock:
+            row = self.db.execute("SELECT blob_mtime FROM entries WHERE blob = ? AND blob_mtime IS NOT NULL LIMIT 1",
+                                  (blob,)).fetchone()
+        stamp = self._stamp(path, size)
+        if row is None or stamp != row[0]:
+            # A new blob, or one changed since ingest: (re)ingest it.
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = path + '.tmp'
+            try:
+                self._clone(filepath, temp_path)
+                os.chmod(temp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+                os.replace(temp_path, path)
+                stamp = os.stat(path).st_mtime_ns
+            except OSError:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                return False
+
+        now = time.time()
+        with self.lock:
+            old = self.db.execute("SELECT blob FROM entries WHERE url = ?", (url,)).fetchone()
+            with self.db:
+                # A re-ingested blob has a new mtime, which every entry sharing it must agree on.
+                self.db.execute("UPDATE entries SET blob_mtime = ? WHERE blob = ?", (stamp, blob))
+                self.db.execute(
+                    "INSERT OR REPLACE INTO entries (url, blob, size, etag, last_modified, stored, last_used, "
+                    "blob_mtime) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (url, blob, size, etag, last_modified, now, now, stamp))
+            if old is not None and old[0] != blob:
+                self._remove_unreferenced(old[0])
+            self.stats['stored'] += 1
+            self._evict()
+        return True
+
+    def total_size(self):
+        with self.lock:
+            return self._total_size()
+
+    def _total_size(self):
+        row = self.db.execute("SELECT SUM(size) FROM (SELECT MAX(size) AS size FROM entries GROUP BY blob)").fetchone()
+        return row[0] or 0
+
+    def _evict(self):
+        total = self._total_size()
+        while total > self.max_bytes:
+            row = self.db.execute("SELECT url, blob FROM entries ORDER BY last_used LIMIT 1").fetchone()
+            if row is None:
+                break
+            url, blob = row
+            with self.db:
+                self.db.execute("DELETE FROM entries WHERE url = ?", (url,))
+            if self._remove_unreferenced(blob):
+                total = self._total_size()
+            self.stats['evicted'] += 1
+
+    def _remove_unreferenced(self, blob):
+        if self.db.execute("SELECT 1 FROM entries WHERE blob = ? LIMIT 1", (blob,)).fetchone():
+            return False
+        path = self.blob_path(blob)
+        try:
+            os.remove(path)
+        except PermissionError:
+            # Windows refuses to delete read-only files.
+            try:
+                os.chmod(path, stat.S_IRUSR | stat.S_IWUSR)
+                os.remove(path)
+            except OSError:
+                pass
+        except OSError:
+            pass
+        return True
+
+    def clear(self):
+        with self.lock:
+            with self.db:
+                self.db.execute("DELETE FROM entries")
+            shutil.rmtree(self.objects, ignore_errors=True)
+            os.makedirs(self.objects, exist_ok=True)
+
+    @classmethod
+    def _clone(cls, source, destination):
+        """Reflink, else in-kernel copy of source to a new file at destination."""
+        if fcntl is not None:
+            try:
+                with open(source, 'rb') as src, open(destination, 'wb') as dst:
+                    fcntl.ioctl(dst.fileno(), cls.FICLONE, src.fileno())
+                return
+            except OSError:
+                os.remove(destination)
+
+        with open(source, 'rb') as src, open(destination, 'wb') as dst:
+            if hasattr(os, 'copy_file_range'):
+                try:
+                    while os.copy_file_range(src.fileno(), dst.fileno(), cls.COPY_CHUNK):
+                        pass
+                    return
+                except OSError:
+                    src.seek(0)
+                    dst.seek(0)
+                    dst.truncate()
+            shutil.copyfileobj(src, dst, cls.COPY_CHUNK)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
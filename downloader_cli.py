@@ -0,0 +1,456 @@
+"""
+Headless entry point for the download manager. Progress is written to stdout as JSON lines.
+
+    python downloader_cli.py urls.txt -o ~/Downloads          download a URL list
+    cat urls.txt | python downloader_cli.py -o ~/Downloads    read the URLs from stdin
+    python downloader_cli.py --daemon --listen 127.0.0.1:8765 run as a long-lived service
+    python downloader_cli.py urls.txt --journal               keep the queue on disk and resume it next run
+    python downloader_cli.py urls.txt --checksums SHA256SUMS  verify every file while it downloads
+    python downloader_cli.py urls.txt --cache                 reuse unchanged files from earlier runs
+    python downloader_cli.py --metalink release.meta4         fetch every file from all of its mirrors at once
+    python downloader_cli.py urls.txt --order shortest        start the smallest files first
+    python downloader_cli.py --template 'https://x/img{0001-50000}.jpg'  queue a numbered series lazily
+    python downloader_cli.py urls.txt --sync finish --max-dirty 256M  fsync files before they are renamed into place
+    python downloader_cli.py urls.txt --metrics-listen 127.0.0.1:9464  serve Prometheus metrics while downloading
+    python downloader_cli.py urls.txt --metrics-file m.jsonl --trace   log metrics and per-phase trace events
+    python downloader_cli.py --gui                            start the Tk application
+
+A line of the URL list may name mirrors of the same file as "https://a/f.iso | https://b/f.iso";
+the file is then striped across all of them.
+
+The daemon accepts one JSON command per line on its control socket, e.g.
+{"cmd": "add", "urls": ["https://..."], "save_path": "/data"} (optionally with
+"checksums": {"https://...": "sha256:<hex>"}, "manifest": "/path/SHA256SUMS" or
+"metalink": "/path/file.meta4"), {"cmd": "pause"},
+{"cmd": "resume"}, {"cmd": "stop"}, {"cmd": "status"} or {"cmd": "shutdown"}. Rate limits are
+changed with {"cmd": "limit", "global": "2M", "host": "500K", "hosts": {"example.com": "1M"},
+"urls": {"https://...": "100K"}}; a limit of 0 or null removes it. Waiting jobs are reordered with
+{"cmd": "priority", "urls": {"https://...": "high"}, "order": ["https://...", ...], "policy": "shortest"}
+(priorities are high/normal/low or a number, higher first; every field is optional).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import socketserver
+from threading import Thread, Lock, Event
+from xml.etree import ElementTree
+
+from downloader_core import DownloadManager, IntegrityCheck, UrlTemplate, WriteScheduler
+from downloader_journal import JobJournal
+from downloader_cache import DownloadCache
+from downloader_metrics import MetricsRegistry, PrometheusExporter, JsonLinesExporter
+
+CHECKSUM_SUFFIXES = ('.sha256', '.md5', '.sfv')
+CHECKSUM_MANIFESTS = ('SHA256SUMS', 'MD5SUMS')
+
+def find_checksum_manifest(url_file):
+    """Looks for urls.txt.sha256 (or .md5/.sfv), then SHA256SUMS/MD5SUMS next to the URL list."""
+    candidates = [url_file + suffix for suffix in CHECKSUM_SUFFIXES]
+    candidates += [os.path.join(os.path.dirname(os.path.abspath(url_file)), name) for name in CHECKSUM_MANIFESTS]
+    return next((path for path in candidates if os.path.isfile(path)), None)
+
+def read_urls(stream):
+    for line in stream:
+        url = line.strip()
+        if url and not url.startswith('#'):
+            yield url
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+def parse_size(value):
+    """Parses a byte count such as 500K, 2M, 10GiB or 1048576. 0 or None gives None."""
+    if value is None or isinstance(value, (int, float)):
+        return int(value) if value else None
+    text = value.strip().upper()
+    for suffix in ('/S', 'B', 'I'):
+        text = text[:-len(suffix)] if text.endswith(suffix) else text
+    unit = text[-1:] if text[-1:] in SIZE_UNITS else ''
+    try:
+        size = float(text[:len(text) - len(unit)]) * SIZE_UNITS[unit]
+    except ValueError:
+        raise ValueError(f"Invalid size: {value!r}") from None
+    if size < 0:
+        raise ValueError(f"Invalid size: {value!r}")
+    return int(size) or None
+
+def parse_template(value):
+    """Parses a --template pattern; only {start-end} ranges work here, as there are no start/end options for '#'."""
+    try:
+        return UrlTemplate(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def parse_rate(value):
+    """Parses a rate such as 500K, 2M/s or 1048576 (bytes per second). 0 or None means unlimited."""
+    return parse_size(value)
+
+def parse_buffer_size(value):
+    """Parses a buffer size such as 4M; unlike a rate it cannot be 0."""
+    size = parse_size(value)
+    if size is None:
+        raise argparse.ArgumentTypeError(f"Buffer size must be positive: {value!r}")
+    return size
+
+def create_manager(args):
+    engine_options = {}
+    if args.engine == 'asyncio':
+        engine_options['pipeline_depth'] = args.pipeline_depth
+    journal = JobJournal(args.journal) if args.journal else None
+    cache = DownloadCache(os.path.expanduser(args.cache), args.cache_size) if args.cache else None
+    writer = WriteScheduler(max_dirty=args.max_dirty, flush_size=args.write_buffer,
+                            sync_policy=args.sync, direct=args.direct)
+    metrics = None
+    if args.metrics_listen or args.metrics_file:
+        metrics = MetricsRegistry()
+        if args.metrics_listen:
+            metrics.add_exporter(PrometheusExporter(metrics, args.metrics_listen))
+        if args.metrics_file:
+            metrics.add_exporter(JsonLinesExporter(metrics, os.path.expanduser(args.metrics_file),
+                                                   interval=args.metrics_interval, trace=args.trace))
+    manager = DownloadManager(max_concurrent=args.concurrency, per_host_limit=args.per_host,
+                              segments=args.segments, journal=journal, adaptive=args.adaptive,
+                              cache=cache, writer=writer, metrics=metrics, engine=args.engine,
+                              **engine_options)
+    manager.scheduling_policy = args.order
+    manager.rate_limiter.set_global_limit(args.limit)
+    manager.rate_limiter.set_host_limit(args.host_limit)
+    return manager
+
+def recover_jobs(manager, reporter):
+    """Re-queues unfinished jobs from the manager's journal. Returns their URLs."""
+    if manager.journal is None:
+        return set()
+    jobs = manager.journal.load_pending()
+    for job in jobs:
+        manager.set_mirrors(job['url'], job['mirrors'])
+    manager.add_to_queue([(job['url'], job['filename'], job['save_path']) for job in jobs])
+    if jobs:
+        reporter.emit('recovered', count=len(jobs))
+    return {job['url'] for job in jobs}
+
+def announce_metrics(manager, reporter):
+    """Reports where the manager's metrics are exported, if anywhere."""
+    if manager.metrics is None:
+        return
+    for exporter in manager.metrics.exporters:
+        if isinstance(exporter, PrometheusExporter):
+            reporter.emit('metrics', address=exporter.address)
+        elif isinstance(exporter, JsonLinesExporter):
+            reporter.emit('metrics', path=exporter.path, trace=exporter.trace)
+
+def close_manager(manager):
+    manager.shutdown()
+    if manager.metrics is not None:
+        manager.metrics.close()
+    if manager.journal is not None:
+        manager.journal.close()
+    if manager.cache is not None:
+        manager.cache.close()
+
+class JsonLinesReporter:
+    """Drains a DownloadManager's telemetry and writes it to a stream as JSON lines."""
+    def __init__(self, manager, stream=None):
+        self.manager = manager
+        self.stream = stream or sys.stdout
+        self.lock = Lock()
+        self.completed = 0
+        self.failed = 0
+        self.fed = 0
+
+    def emit(self, event, **fields):
+        fields['event'] = event
+        fields['time'] = round(time.time(), 3)
+        line = json.dumps(fields)
+        with self.lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+    def poll(self):
+        # Jobs fed from a template are only counted; one line each would swamp the output.
+        queued = self.manager.telemetry.queued
+        while queued:
+            queued.popleft()
+            self.fed += 1
+
+        for record in self.manager.telemetry.drain_updates():
+            if self.manager.active_downloads.get(record.url) is not record:
+                continue
+            self.emit('progress', url=record.url, filename=record.filename,
+                      downloaded_bytes=record.downloaded_bytes, size=record.size,
+                      progress=round(record.progress, 1), speed=round(record.speed))
+
+        while self.manager.completed_downloads:
+            info = self.manager.completed_downloads.popleft()
+            self.completed += 1
+            self.emit(info['status'], **info)
+
+        while self.manager.failed_downloads:
+            info = self.manager.failed_downloads.popleft()
+            self.failed += 1
+            self.emit(info['status'], **info)
+
+        while self.manager.telemetry.retrying:
+            info = self.manager.telemetry.retrying.popleft()
+            self.emit(info['status'], **dict(info, delay=round(info['delay'], 2)))
+
+def run_batch(args):
+    if args.url_file and args.url_file != '-':
+        with open(args.url_file, 'r', encoding='utf-8') as f:
+            lines = list(read_urls(f))
+    elif args.metalink or args.template:
+        lines = []
+    else:
+        lines = list(read_urls(sys.stdin))
+
+    save_path = os.path.expanduser(args.output)
+    os.makedirs(save_path, exist_ok=True)
+
+    manager = create_manager(args)
+    reporter = JsonLinesReporter(manager)
+    announce_metrics(manager, reporter)
+    recovered = recover_jobs(manager, reporter)
+    urls = manager.add_url_lines(lines)
+    filenames = {}
+    if args.metalink:
+        for url, mirrors, filename in manager.load_metalink(args.metalink):
+            urls.append(url)
+            filenames[url] = filename
+        reporter.emit('metalink', metalink=args.metalink, files=len(filenames))
+    urls = [url for url in dict.fromkeys(urls) if url not in recovered]
+    manager.add_to_queue([(url, filenames.get(url) or manager.default_filename(url), save_path) for url in urls])
+    reporter.emit('queued', count=len(urls), save_path=save_path)
+    for template in args.template:
+        manager.add_job_source((url, manager.default_filename(url), save_path) for url in template)
+        reporter.emit('template', template=template.template, count=len(template))
+
+    manifest = args.checksums
+    if manifest is None and args.url_file and args.url_file != '-':
+        manifest = find_checksum_manifest(args.url_file)
+    if manifest:
+        matched = manager.load_checksum_manifest(manifest, list(recovered) + urls)
+        reporter.emit('checksums', manifest=manifest, matched=matched)
+
+    start_time = time.time()
+    manager.start_downloads()
+    try:
+        while manager.has_pending_work():
+            reporter.poll()
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        # Partial files are kept, so running the same list again resumes them.
+        manager.stop_all_downloads()
+        deadline = time.time() + 5
+        while manager.has_pending_work() and time.time() < deadline:
+            time.sleep(0.1)
+        reporter.poll()
+        reporter.emit('interrupted')
+        close_manager(manager)
+        return 130
+
+    reporter.poll()
+    summary = {}
+    if manager.cache is not None:
+        summary['cache'] = dict(manager.cache.stats)
+    summary['writes'] = manager.get_write_stats()
+    reporter.emit('summary', completed=reporter.completed, failed=reporter.failed,
+                  elapsed=round(time.time() - start_time, 3), **summary)
+    close_manager(manager)
+    return 0 if reporter.failed == 0 else 1
+
+class DownloadDaemon:
+    """Keeps one DownloadManager alive and feeds it from JSON commands on a local control socket."""
+    def __init__(self, manager, save_path, reporter):
+        self.manager = manager
+        self.save_path = save_path
+        self.reporter = reporter
+        self.stopped = Event()
+
+    def handle_command(self, command):
+        cmd = command.get('cmd')
+        if cmd == 'add':
+            urls = self.manager.add_url_lines(command.get('urls', []))
+            filenames = {}
+            if command.get('metalink'):
+                for url, _, filename in self.manager.load_metalink(os.path.expanduser(command['metalink'])):
+                    urls.append(url)
+                    filenames[url] = filename
+            save_path = os.path.expanduser(command.get('save_path') or self.save_path)
+            os.makedirs(save_path, exist_ok=True)
+            for url, checksum in command.get('checksums', {}).items():
+                algorithm, _, digest = checksum.rpartition(':')
+                algorithm = algorithm or IntegrityCheck.guess_algorithm(digest)
+                if not algorithm:
+                    raise ValueError(f"Cannot tell the checksum algorithm of {checksum!r}")
+                self.manager.set_expected_checksum(url, algorithm, digest)
+            if command.get('manifest'):
+                self.manager.load_checksum_manifest(os.path.expanduser(command['manifest']), urls)
+            self.manager.add_to_queue([(url, filenames.get(url) or self.manager.default_filename(url), save_path)
+                                       for url in urls])
+            # A previous 'stop' only cancels what was queued at that time.
+            self.manager.stop_flag = False
+            self.manager.submit_queued()
+            self.reporter.emit('queued', count=len(urls), save_path=save_path)
+            return {'ok': True, 'queued': len(urls)}
+        if cmd == 'pause':
+            self.manager.pause_downloads()
+            return {'ok': True}
+        if cmd == 'resume':
+            self.manager.resume_downloads()
+            return {'ok': True}
+        if cmd == 'stop':
+            self.manager.stop_all_downloads()
+            return {'ok': True}
+        if cmd == 'limit':
+            limiter = self.manager.rate_limiter
+            if 'global' in command:
+                limiter.set_global_limit(parse_rate(command['global']))
+            if 'host' in command:
+                limiter.set_host_limit(parse_rate(command['host']))
+            for host, rate in command.get('hosts', {}).items():
+                limiter.set_host_limit(parse_rate(rate), host=host)
+            for url, rate in command.get('urls', {}).items():
+                limiter.set_job_limit(url, parse_rate(rate))
+            return {'ok': True, 'limits': limiter.limits()}
+        if cmd == 'priority':
+            for url, priority in command.get('urls', {}).items():
+                self.manager.set_priority([url], priority)
+            if command.get('order'):
+                self.manager.set_queue_order(command['order'])
+            if command.get('policy'):
+                self.manager.set_scheduling_policy(command['policy'])
+            return {'ok': True, 'policy': self.manager.scheduling_policy,
+                    'waiting': sorted(self.manager.engine.pending_urls(), key=self.manager.job_key)}
+        if cmd == 'status':
+            return {
+                'ok': True,
+                'active': len(self.manager.active_downloads),
+                'busy': self.manager.has_pending_work(),
+                'paused': self.manager.pause_flag,
+                'completed': self.reporter.completed,
+                'failed': self.reporter.failed,
+                'limits': self.manager.rate_limiter.limits(),
+                'host_concurrency': self.manager.concurrency.limits(),
+                'cache': dict(self.manager.cache.stats) if self.manager.cache is not None else None,
+                'writes': self.manager.get_write_stats()
+            }
+        if cmd == 'shutdown':
+            self.stopped.set()
+            return {'ok': True}
+        return {'ok': False, 'error': f"Unknown command: {cmd!r}"}
+
+class ControlRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                command = json.loads(line)
+                reply = self.server.daemon.handle_command(command)
+            except (ValueError, KeyError, AttributeError, OSError, ElementTree.ParseError) as e:
+                reply = {'ok': False, 'error': str(e)}
+            self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+
+class ControlServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def run_daemon(args):
+    host, _, port = args.listen.rpartition(':')
+    manager = create_manager(args)
+    reporter = JsonLinesReporter(manager)
+    daemon = DownloadDaemon(manager, args.output, reporter)
+    announce_metrics(manager, reporter)
+    recover_jobs(manager, reporter)
+    manager.submit_queued()
+
+    server = ControlServer((host or '127.0.0.1', int(port)), ControlRequestHandler)
+    server.daemon = daemon
+    Thread(target=server.serve_forever, daemon=True).start()
+    reporter.emit('listening', address=f"{server.server_address[0]}:{server.server_address[1]}")
+
+    try:
+        while not daemon.stopped.is_set():
+            reporter.poll()
+            daemon.stopped.wait(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        close_manager(manager)
+        reporter.poll()
+        reporter.emit('shutdown')
+    return 0
+
+def launch_gui():
+    # Imported only on demand so headless use never loads tkinter.
+    import runpy
+    gui_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main-downloader.py')
+    runpy.run_path(gui_path, run_name='__main__')
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Advanced Download Manager (headless)")
+    parser.add_argument('url_file', nargs='?', help="file with one URL per line ('-' or omitted reads stdin)")
+    parser.add_argument('--metalink', metavar='FILE', default=None,
+                        help="metalink (.meta4/.metalink) file listing downloads with their mirrors and checksums")
+    parser.add_argument('--template', type=parse_template, action='append', default=[], metavar='PATTERN',
+                        help="queue a URL series such as 'https://x/{001-500}.jpg' without expanding it first (repeatable)")
+    parser.add_argument('-o', '--output', default=os.path.expanduser("~/Downloads"), help="directory to save files to")
+    parser.add_argument('--engine', choices=sorted(DownloadManager.ENGINES), default='threaded')
+    parser.add_argument('--concurrency', type=int, default=8, help="maximum simultaneous downloads")
+    parser.add_argument('--per-host', type=int, default=2, help="maximum simultaneous downloads per host")
+    parser.add_argument('--adaptive', action='store_true',
+                        help="tune each server's concurrency from throughput and errors, starting at --per-host")
+    parser.add_argument('--segments', type=int, default=4, help="parallel ranges per large file (threaded engine)")
+    parser.add_argument('--order', choices=DownloadManager.SCHEDULING_POLICIES, default='fifo',
+                        help="start downloads in list order (fifo) or smallest first (shortest, probes sizes)")
+    parser.add_argument('--pipeline-depth', type=int, default=1, help="requests pipelined per connection (asyncio engine)")
+    parser.add_argument('--limit', type=parse_rate, default=None,
+                        help="total bandwidth cap in bytes per second, e.g. 500K or 2M")
+    parser.add_argument('--host-limit', type=parse_rate, default=None,
+                        help="bandwidth cap for each server in bytes per second")
+    parser.add_argument('--checksums', metavar='MANIFEST', default=None,
+                        help="sha256sum/md5sum/SFV manifest to verify downloads against "
+                             "(default: URL_FILE.sha256, .md5, .sfv or SHA256SUMS/MD5SUMS next to it)")
+    parser.add_argument('--cache', nargs='?', const=DownloadCache.default_path(), default=None, metavar='DIR',
+                        help="reuse unchanged files from a local download cache, revalidated with conditional requests")
+    parser.add_argument('--cache-size', type=parse_size, default=10 * 1024 ** 3,
+                        help="maximum size of the download cache, e.g. 500M or 20G (default 10G)")
+    parser.add_argument('--write-buffer', type=parse_buffer_size, default=4 * 1024 ** 2, metavar='SIZE',
+                        help="coalesce writes to each file range into blocks of this size (default 4M)")
+    parser.add_argument('--max-dirty', type=parse_buffer_size, default=64 * 1024 ** 2, metavar='SIZE',
+                        help="cap on data received but not yet written, across all downloads (default 64M)")
+    parser.add_argument('--sync', choices=WriteScheduler.SYNC_POLICIES, default='none',
+                        help="fdatasync files before they are renamed into place (finish) or after every block (always)")
+    parser.add_argument('--direct', action='store_true',
+                        help="write with O_DIRECT where the filesystem supports it, bypassing the page cache")
+    parser.add_argument('--metrics-listen', default=None, metavar='ADDR',
+                        help="serve Prometheus metrics at http://ADDR/metrics (e.g. 127.0.0.1:9464)")
+    parser.add_argument('--metrics-file', default=None, metavar='FILE',
+                        help="append a JSON line with all metrics to FILE every --metrics-interval seconds")
+    parser.add_argument('--metrics-interval', type=float, default=10.0, help="seconds between --metrics-file snapshots")
+    parser.add_argument('--trace', action='store_true',
+                        help="also write per-download trace events (phases, retries, completions) to --metrics-file")
+    parser.add_argument('--journal', nargs='?', const=JobJournal.default_path(), default=None,
+                        help="persist the queue in a job journal and resume unfinished jobs from it")
+    parser.add_argument('--interval', type=float, default=0.5, help="seconds between progress reports")
+    parser.add_argument('--daemon', action='store_true', help="run as a long-lived service controlled over --listen")
+    parser.add_argument('--listen', default='127.0.0.1:8765', help="control socket address for --daemon")
+    parser.add_argument('--gui', action='store_true', help="start the graphical application instead")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.trace and not args.metrics_file:
+        parser.error("--trace needs --metrics-file")
+    if args.gui:
+        return launch_gui()
+    if args.daemon:
+        return run_daemon(args)
+    return run_batch(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
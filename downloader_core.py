@@ -0,0 +1,3739 @@
+import os
+import re
+import ssl
+import json
+import socket
+import asyncio
+import requests
+import time
+import math
+import zlib
+import heapq
+import mmap
+import bisect
+import random
+import hashlib
+import itertools
+import sqlite3
+import http.client
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse, unquote, urljoin
+from threading import Thread, Lock, Event, Condition, local
+from queue import Queue
+from collections import deque, OrderedDict
+from xml.etree import ElementTree
+
+class SegmentedDownloadUnsupported(Exception):
+    """Raised when a server ignores a Range request, so the download must fall back to a single stream."""
+    pass
+
+class ResumeState:
+    """
+    Sidecar metadata stored next to a .part file (URL, validators and bytes received)
+    so an interrupted download can continue with a Range request instead of starting over.
+    """
+    PART_SUFFIX = '.part'
+    STATE_SUFFIX = '.json'
+    SAVE_INTERVAL = 1.0
+
+    def __init__(self, part_path, url):
+        self.part_path = part_path
+        self.path = part_path + self.STATE_SUFFIX
+        self.url = url
+        self.lock = Lock()
+        self.last_save = 0
+        self.reset()
+
+    @classmethod
+    def load(cls, part_path, url):
+        state = cls(part_path, url)
+        if not os.path.exists(part_path):
+            return state
+        try:
+            with open(state.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return state
+        if data.get('url') == url:
+            state.data.update(data)
+        return state
+
+    def reset(self):
+        self.data = {'url': self.url, 'etag': None, 'last_modified': None, 'size': 0, 'bytes_received': 0, 'segments': None}
+
+    def set_validators(self, headers):
+        self.data['etag'] = headers.get('ETag')
+        self.data['last_modified'] = headers.get('Last-Modified')
+
+    def validator(self):
+        # Weak ETags are not allowed in If-Range, so fall back to Last-Modified for those.
+        etag = self.data['etag']
+        if etag and not etag.startswith('W/'):
+            return etag
+        return self.data['last_modified']
+
+    def matches(self, probe):
+        if self.data['etag'] and probe.get('etag'):
+            return self.data['etag'] == probe['etag']
+        if self.data['last_modified'] and probe.get('last_modified'):
+            return self.data['last_modified'] == probe['last_modified']
+        return False
+
+    def save(self, force=False):
+        now = time.time()
+        if not force and now - self.last_save < self.SAVE_INTERVAL:
+            return
+        with self.lock:
+            self.last_save = now
+            temp_path = self.path + '.tmp'
+            try:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.data, f)
+                os.replace(temp_path, self.path)
+            except OSError:
+                pass
+
+    def discard(self):
+        for path in (self.path, self.part_path):
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def keep_or_discard(self):
+        """Persists the sidecar if anything resumable was received, otherwise removes the leftovers."""
+        if self.data['bytes_received'] > 0 and self.validator():
+            self.save(force=True)
+        else:
+            self.discard()
+
+class WriteStream:
+    """
+    Writes one byte range of a file sequentially, starting at a given offset. Returned by
+    WriteScheduler.open. Writes are gathered in a pooled buffer and handed to the scheduler's
+    flush threads flush_size bytes at a time, one buffer in flight per stream, so the download
+    loop only waits on the disk when the scheduler's dirty memory cap is reached. committed
+    counts the bytes of the range already handed to the OS, in order; resume state must not
+    claim more.
+    """
+    def __init__(self, scheduler, fd, direct_fd, offset):
+        self.scheduler = scheduler
+        self.fd = fd
+        self.direct_fd = direct_fd
+        self.position = offset
+        self.buffer = None
+        self.filled = 0
+        # Dirty bytes held for the view handed out by buffer_view until advance() settles them.
+        self.reserved = 0
+        self.committed = 0
+        self.pending = None
+        # After a failed write nothing more is written, or committed would skip over the gap.
+        self.error = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, data):
+        view = memoryview(data)
+        flush_size = self.scheduler.flush_size
+        for start in range(0, len(view), flush_size):
+            self._write_piece(view[start:start + flush_size])
+        return len(view)
+
+    def buffer_view(self, size):
+        """
+        Returns a writable view of up to size bytes at the end of the stream's buffer, so a
+        response can be read straight into it; advance(count) then adds the bytes actually
+        read. None means the dirty memory cap leaves no room and the data has to go through
+        write() instead.
+        """
+        size = min(size, self.scheduler.flush_size)
+        if self.filled + size > self.scheduler.flush_size:
+            self._submit()
+        if not self.scheduler._reserve(self, size):
+            self._wait()
+            return None
+        if self.buffer is None:
+            self.buffer = self.scheduler._take_buffer()
+        self.reserved = size
+        return memoryview(self.buffer)[self.filled:self.filled + size]
+
+    def advance(self, count):
+        self.scheduler._release(self.reserved - count)
+        self.reserved = 0
+        self.filled += count
+
+    def flush(self):
+        """Writes the buffered tail and waits until committed covers every write."""
+        self._wait()
+        if self.filled:
+            # The caller waits either way, so the tail is written here instead of on a flush thread.
+            buffer, count = self.buffer, self.filled
+            self.buffer, self.filled = None, 0
+            try:
+                self._write_through(memoryview(buffer)[:count])
+            finally:
+                self.scheduler._release(count, buffer)
+
+    def close(self):
+        if self.fd is None:
+            return
+        try:
+            if self.error is None:
+                self.flush()
+        finally:
+            if self.buffer is not None or self.reserved:
+                self.scheduler._release(self.filled + self.reserved, self.buffer)
+                self.buffer, self.filled, self.reserved = None, 0, 0
+            self.scheduler._close(self)
+            self.fd = self.direct_fd = None
+
+    def _write_piece(self, view):
+        count = len(view)
+        if self.filled + count > self.scheduler.flush_size:
+            self._submit()
+        if not self.scheduler._reserve(self, count):
+            # Dirty memory is full and nothing is being written out that would free it.
+            self._wait()
+            self._write_through(view)
+            return
+        if self.buffer is None:
+            self.buffer = self.scheduler._take_buffer()
+        self.buffer[self.filled:self.filled + count] = view
+        self.filled += count
+
+    def _write_through(self, view):
+        if self.error is not None:
+            raise self.error
+        try:
+            self.scheduler._write(self, self.position, view)
+        except Exception as e:
+            self.error = e
+            raise
+        self.position += len(view)
+        self.committed += len(view)
+
+    def _submit(self):
+        if self.error is not None:
+            raise self.error
+        if not self.filled:
+            return
+        # Waiting for the previous buffer keeps committed a contiguous prefix of the range.
+        self._wait()
+        buffer, count = self.buffer, self.filled
+        self.buffer, self.filled = None, 0
+        self.pending = self.scheduler._submit(self, self.position, buffer, count)
+        self.position += count
+
+    def _wait(self):
+        if self.error is not None:
+            raise self.error
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            try:
+                pending.result()
+            except Exception as e:
+                self.error = e
+                raise
+
+class WriteScheduler:
+    """
+    Write-back layer between the download loops and the disk. Each file range is written
+    through a WriteStream that coalesces the loop's reads into flush_size writes, performed by
+    a few flush threads with positioned writes. All streams share a cap of max_dirty buffered
+    bytes; a writer over the cap hands its own buffer off and waits for the flushes to catch up.
+
+    sync_policy 'none' leaves durability to the OS, 'finish' fdatasyncs a file (and fsyncs
+    its directory) around the atomic rename into place, and 'always' also fdatasyncs every
+    flushed buffer. With direct set, the page-aligned middle of each buffer is written with
+    O_DIRECT where the platform and filesystem allow it, bypassing the page cache.
+    """
+    SYNC_POLICIES = ('none', 'finish', 'always')
+    DIRECT_ALIGNMENT = 4096
+    # Upper bounds in seconds of the write latency histogram; the last bucket is unbounded.
+    LATENCY_BUCKETS = (0.001, 0.005, 0.025, 0.1, 0.5, 2.5)
+    # Directory listings answer "does the target exist" for this many seconds.
+    LISTING_TTL = 30
+
+    def __init__(self, max_dirty=64 * 1024 * 1024, flush_size=4 * 1024 * 1024, sync_policy='none',
+                 direct=False, flush_workers=2):
+        if sync_policy not in self.SYNC_POLICIES:
+            raise ValueError(f"Unknown sync policy: {sync_policy!r}")
+        self.max_dirty = max_dirty
+        self.flush_size = min(flush_size, max_dirty)
+        self.sync_policy = sync_policy
+        self.direct = direct and hasattr(os, 'O_DIRECT')
+        self.executor = ThreadPoolExecutor(max_workers=flush_workers, thread_name_prefix='write-back')
+        self.condition = Condition()
+        self.dirty = 0
+        self.in_flight = 0
+        self.open_streams = 0
+        # Spare flush_size buffers; reusing them saves faulting in fresh pages for every flush.
+        self.free_buffers = []
+        self.stats = {'writes': 0, 'bytes_written': 0, 'write_seconds': 0.0, 'max_write_seconds': 0.0,
+                      'latency_buckets': [0] * (len(self.LATENCY_BUCKETS) + 1), 'peak_dirty_bytes': 0,
+                      'stalls': 0, 'stall_seconds': 0.0, 'write_through': 0, 'syncs': 0, 'sync_seconds': 0.0,
+                      'direct_fallbacks': 0}
+        # O_DIRECT needs page-aligned memory; each writing thread keeps one mmap to copy into.
+        self.scratch = local()
+        self.listings = {}
+        self.listing_lock = Lock()
+
+    @staticmethod
+    def preallocate(fd, offset, length):
+        """Reserves disk space up front so the file does not fragment while it grows."""
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(fd, offset, length)
+                return
+            except OSError:
+                pass
+        os.ftruncate(fd, offset + length)
+
+    def open(self, path, offset=0, truncate=False, size=0):
+        """
+        Returns a WriteStream writing path from offset. truncate cuts the file at offset first,
+        and a size past offset is preallocated.
+        """
+        flags = os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        if truncate and not offset:
+            flags |= os.O_TRUNC
+        fd = os.open(path, flags, 0o666)
+        try:
+            if truncate and offset:
+                os.ftruncate(fd, offset)
+            if size > offset:
+                self.preallocate(fd, offset, size - offset)
+            direct_fd = None
+            if self.direct:
+                try:
+                    direct_fd = os.open(path, os.O_WRONLY | os.O_DIRECT)
+                except OSError:
+                    # tmpfs and some network filesystems refuse O_DIRECT.
+                    with self.condition:
+                        self.stats['direct_fallbacks'] += 1
+        except BaseException:
+            os.close(fd)
+            raise
+        with self.condition:
+            self.open_streams += 1
+        return WriteStream(self, fd, direct_fd, offset)
+
+    def create(self, path, size):
+        """Creates (or empties) path and preallocates size bytes for ranges written later."""
+        self.open(path, truncate=True, size=size).close()
+
+    def finalize(self, part_path, filepath):
+        """
+        Moves a completed .part file into place atomically, syncing it first if the policy asks.
+        An existing filepath is never replaced: exists() may have answered from a listing taken
+        before another process created the file. Returns False, leaving the .part file, if so.
+        """
+        if self.sync_policy != 'none':
+            fd = os.open(part_path, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+            try:
+                self._sync(fd)
+            finally:
+                os.close(fd)
+        if not self._place(part_path, filepath):
+            self.add_existing(filepath)
+            return False
+        if self.sync_policy != 'none' and hasattr(os, 'O_DIRECTORY'):
+            # The rename itself is only durable once the directory entry is.
+            fd = os.open(os.path.dirname(filepath) or '.', os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                self._sync(fd, metadata=True)
+            finally:
+                os.close(fd)
+        self.add_existing(filepath)
+        return True
+
+    @staticmethod
+    def _place(part_path, filepath):
+        """Renames part_path to filepath unless that exists. A hardlink fails atomically if it does."""
+        try:
+            os.link(part_path, filepath)
+        except FileExistsError:
+            return False
+        except OSError:
+            # No hardlinks on this filesystem (FAT, some network shares): check, then rename.
+            if os.path.exists(filepath):
+                return False
+            os.replace(part_path, filepath)
+            return True
+        os.remove(part_path)
+        return True
+
+    def exists(self, path):
+        """
+        Checks for path with one directory listing per LISTING_TTL instead of a stat per file,
+        which matters for long batches on network filesystems. Listed names are confirmed with a
+        real stat, so a file deleted since the listing is not mistaken for a finished one. A file
+        created since the listing is missed here, and caught by finalize() instead.
+        """
+        directory, name = os.path.split(path)
+        name = os.path.normcase(name)
+        now = time.time()
+        with self.listing_lock:
+            listing = self.listings.get(directory)
+            if listing is None or listing[0] < now:
+                try:
+                    names = {os.path.normcase(entry.name) for entry in os.scandir(directory or '.')}
+                except OSError:
+                    names = set()
+                listing = self.listings[directory] = (now + self.LISTING_TTL, names)
+        return name in listing[1] and os.path.exists(path)
+
+    def add_existing(self, path):
+        directory, name = os.path.split(path)
+        with self.listing_lock:
+            listing = self.listings.get(directory)
+            if listing is not None:
+                listing[1].add(os.path.normcase(name))
+
+    def snapshot(self):
+        """Current counters plus buffer occupancy."""
+        with self.condition:
+            stats = dict(self.stats, latency_buckets=list(self.stats['latency_buckets']))
+            stats.update(dirty_bytes=self.dirty, max_dirty=self.max_dirty, in_flight=self.in_flight,
+                         open_streams=self.open_streams, sync_policy=self.sync_policy, direct=self.direct)
+        return stats
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def _reserve(self, stream, count):
+        """Accounts count more dirty bytes, waiting while over the cap. False means write through."""
+        with self.condition:
+            if self.dirty + count <= self.max_dirty:
+                self._add_dirty(count)
+                return True
+        stream._submit()
+        began = time.perf_counter()
+        with self.condition:
+            self.stats['stalls'] += 1
+            while self.dirty + count > self.max_dirty and self.in_flight:
+                self.condition.wait()
+            self.stats['stall_seconds'] += time.perf_counter() - began
+            if self.dirty + count <= self.max_dirty:
+                self._add_dirty(count)
+                return True
+            self.stats['write_through'] += 1
+            return False
+
+    def _add_dirty(self, count):
+        self.dirty += count
+        self.stats['peak_dirty_bytes'] = max(self.stats['peak_dirty_bytes'], self.dirty)
+
+    def _take_buffer(self):
+        with self.condition:
+            if self.free_buffers:
+                return self.free_buffers.pop()
+        return bytearray(self.flush_size)
+
+    def _release(self, count, buffer=None, flushed=False):
+        with self.condition:
+            if flushed:
+                self.in_flight -= 1
+            self.dirty -= count
+            if buffer is not None and len(self.free_buffers) <= self.max_dirty // self.flush_size:
+                self.free_buffers.append(buffer)
+            self.condition.notify_all()
+
+    def _submit(self, stream, offset, buffer, count):
+        with self.condition:
+            self.in_flight += 1
+        try:
+            return self.executor.submit(self._flush, stream, offset, buffer, count)
+        except BaseException:
+            self._release(count, buffer, flushed=True)
+            raise
+
+    def _flush(self, stream, offset, buffer, count):
+        try:
+            self._write(stream, offset, memoryview(buffer)[:count])
+            stream.committed += count
+        finally:
+            self._release(count, buffer, flushed=True)
+
+    def _write(self, stream, offset, view):
+        began = time.perf_counter()
+        if stream.direct_fd is not None:
+            # Only whole pages can go through O_DIRECT; the partial pages at either end cannot.
+            head = min(len(view), -offset % self.DIRECT_ALIGNMENT)
+            body = (len(view) - head) // self.DIRECT_ALIGNMENT * self.DIRECT_ALIGNMENT
+            if body:
+                self._pwrite(stream.fd, view[:head], offset)
+                self._pwrite(stream.direct_fd, self._aligned_copy(view[head:head + body]), offset + head)
+                self._pwrite(stream.fd, view[head + body:], offset + head + body)
+            else:
+                self._pwrite(stream.fd, view, offset)
+        else:
+            self._pwrite(stream.fd, view, offset)
+        if self.sync_policy == 'always':
+            self._sync(stream.fd)
+        elapsed = time.perf_counter() - began
+        with self.condition:
+            stats = self.stats
+            stats['writes'] += 1
+            stats['bytes_written'] += len(view)
+            stats['write_seconds'] += elapsed
+            stats['max_write_seconds'] = max(stats['max_write_seconds'], elapsed)
+            stats['latency_buckets'][bisect.bisect_left(self.LATENCY_BUCKETS, elapsed)] += 1
+
+    def _aligned_copy(self, view):
+        scratch = getattr(self.scratch, 'buffer', None)
+        if scratch is None or len(scratch) < len(view):
+            size = -(-max(len(view), self.flush_size) // mmap.PAGESIZE) * mmap.PAGESIZE
+            scratch = self.scratch.buffer = mmap.mmap(-1, size)
+        aligned = memoryview(scratch)[:len(view)]
+        aligned[:] = view
+        return aligned
+
+    @staticmethod
+    def _pwrite(fd, view, offset):
+        while view:
+            if hasattr(os, 'pwrite'):
+                written = os.pwrite(fd, view, offset)
+            else:
+                # Each stream has at most one buffer in flight, so seeking its own fd is safe.
+                os.lseek(fd, offset, os.SEEK_SET)
+                written = os.write(fd, view)
+            view = view[written:]
+            offset += written
+
+    def _sync(self, fd, metadata=False):
+        began = time.perf_counter()
+        if metadata or not hasattr(os, 'fdatasync'):
+            os.fsync(fd)
+        else:
+            os.fdatasync(fd)
+        with self.condition:
+            self.stats['syncs'] += 1
+            self.stats['sync_seconds'] += time.perf_counter() - began
+
+    def _close(self, stream):
+        for fd in (stream.fd, stream.direct_fd):
+            if fd is not None:
+                os.close(fd)
+        with self.condition:
+            self.open_streams -= 1
+
+class StripePlan:
+    """
+    Work list for one file fetched from several mirrors at once. The file is cut into
+    pieces that workers bound to each mirror claim one at a time, so every mirror's share
+    of the file follows its speed. A piece whose mirror fails or stalls goes back on the list
+    with the bytes it already got, and a mirror that fails MAX_FAILURES times in a row is
+    dropped. Once nothing is left to claim, an idle worker takes over the tail of the in-flight
+    piece that would finish last, split in proportion to the two mirrors' speeds.
+
+    Pieces are the [start, end, done] lists persisted in the ResumeState, and the plan guards
+    them with the state's lock so a save never sees a half-made split. A split can land just
+    behind bytes the owner has read but not reported yet; the owner then rewrites the same
+    content the new piece fetches, which costs a little bandwidth and nothing else.
+    """
+    MAX_FAILURES = 3
+    SPEED_SMOOTHING = 0.5
+    WAIT_INTERVAL = 0.5
+
+    def __init__(self, pieces, sources, lock, min_steal):
+        self.pieces = pieces
+        self.changed = Condition(lock)
+        # Tails smaller than this are not worth another request; the owner keeps at least as much.
+        self.min_steal = min_steal
+        self.unclaimed = deque(i for i, piece in enumerate(pieces) if self.remaining(piece) > 0)
+        # index -> [source, claimed_at, done_at_claim]
+        self.claims = {}
+        self.speeds = dict.fromkeys(sources, 0.0)
+        self.failures = dict.fromkeys(sources, 0)
+        self.dropped = set()
+        self.last_error = None
+
+    @staticmethod
+    def remaining(piece):
+        return piece[1] - piece[0] + 1 - piece[2]
+
+    def complete(self):
+        return all(self.remaining(piece) <= 0 for piece in self.pieces)
+
+    def claim(self, source, abort):
+        """Returns the index of the next piece for source, or None when it has nothing left to do."""
+        with self.changed:
+            while not abort['flag'] and source not in self.dropped:
+                if self.unclaimed:
+                    index = self.unclaimed.popleft()
+                elif not self.claims:
+                    return None
+                else:
+                    index = self._steal(source)
+                if index is not None:
+                    self.claims[index] = [source, time.time(), self.pieces[index][2]]
+                    return index
+                self.changed.wait(self.WAIT_INTERVAL)
+            return None
+
+    def _speed(self, source):
+        known = [speed for speed in self.speeds.values() if speed]
+        return self.speeds[source] or (sum(known) / len(known) if known else 1.0)
+
+    def _current_speed(self, index, now):
+        """Speed of an in-flight piece: its own progress once it has run a while, else its mirror's average."""
+        source, claimed_at, done_at_claim = self.claims[index]
+        elapsed = now - claimed_at
+        if elapsed < self.WAIT_INTERVAL:
+            return self._speed(source)
+        return max(1.0, (self.pieces[index][2] - done_at_claim) / elapsed)
+
+    def _steal(self, source):
+        now = time.time()
+        own_speed = self._speed(source)
+        victim, victim_speed, finish_time = None, 0.0, 0.0
+        for index, (owner, _, _) in self.claims.items():
+            if owner == source:
+                continue
+            speed = self._current_speed(index, now)
+            eta = self.remaining(self.pieces[index]) / speed
+            if eta > finish_time:
+                victim, victim_speed, finish_time = index, speed, eta
+        if victim is None:
+            return None
+
+        piece = self.pieces[victim]
+        remaining = self.remaining(piece) - self.min_steal
+        tail = int(remaining * own_speed / (own_speed + victim_speed))
+        # Only worth it if this mirror gets the tail done before the owner would have.
+        if tail < self.min_steal or tail / own_speed >= finish_time:
+            return None
+
+        new_end = piece[1] - tail
+        self.pieces.append([new_end + 1, piece[1], 0])
+        piece[1] = new_end
+        return len(self.pieces) - 1
+
+    def finish(self, index, source, transferred, elapsed):
+        with self.changed:
+            del self.claims[index]
+            if transferred and elapsed > 0:
+                speed = transferred / elapsed
+                previous = self.speeds[source]
+                self.speeds[source] = speed if not previous else (
+                    previous + self.SPEED_SMOOTHING * (speed - previous))
+            self.failures[source] = 0
+            self.changed.notify_all()
+
+    def release(self, index, source, error, fatal=False):
+        """Puts an unfinished piece back on the list after error. Returns False if source is dropped."""
+        with self.changed:
+            del self.claims[index]
+            if self.remaining(self.pieces[index]) > 0:
+                self.unclaimed.appendleft(index)
+            self.failures[source] += 1
+            self.last_error = error
+            if fatal or self.failures[source] >= self.MAX_FAILURES:
+                self.dropped.add(source)
+            self.changed.notify_all()
+            return source not in self.dropped
+
+class IntegrityError(Exception):
+    """Raised when a finished download does not match its expected checksum."""
+    def __init__(self, algorithm, expected, actual):
+        super().__init__(f"Checksum mismatch ({algorithm}): expected {expected[:12]}..., got {actual[:12]}...")
+        self.algorithm = algorithm
+        self.expected = expected
+        self.actual = actual
+
+class Crc32:
+    """CRC32 with the hashlib update/hexdigest interface, plus combine() to join the CRCs of adjacent ranges."""
+    name = 'crc32'
+
+    def __init__(self):
+        self.value = 0
+        self.length = 0
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+        self.length += len(data)
+
+    def hexdigest(self):
+        return f"{self.value:08x}"
+
+    @staticmethod
+    def _gf2_times(matrix, vector):
+        total = 0
+        index = 0
+        while vector:
+            if vector & 1:
+                total ^= matrix[index]
+            vector >>= 1
+            index += 1
+        return total
+
+    @classmethod
+    def _gf2_square(cls, matrix):
+        return [cls._gf2_times(matrix, row) for row in matrix]
+
+    @classmethod
+    def combine(cls, crc1, crc2, length2):
+        """CRC32 of A+B from crc(A), crc(B) and len(B), as zlib's crc32_combine, in O(log len(B))."""
+        if length2 <= 0:
+            return crc1
+        odd = [0xedb88320] + [1 << n for n in range(31)]
+        even = cls._gf2_square(odd)
+        odd = cls._gf2_square(even)
+        while True:
+            even = cls._gf2_square(odd)
+            if length2 & 1:
+                crc1 = cls._gf2_times(even, crc1)
+            length2 >>= 1
+            if not length2:
+                break
+            odd = cls._gf2_square(even)
+            if length2 & 1:
+                crc1 = cls._gf2_times(odd, crc1)
+            length2 >>= 1
+            if not length2:
+                break
+        return crc1 ^ crc2
+
+class IntegrityCheck:
+    """
+    Checksum of one download computed from the chunks as they are written, so verifying
+    a finished file needs no second read pass.
+
+    SHA-256 and MD5 are hashed in file order: data arriving at the hashed frontier is fed
+    straight in, and whatever arrived out of order (the later ranges of a segmented
+    download) is read back once at the end, usually from the page cache. CRC32 keeps one
+    CRC per contiguous range instead and merges them with Crc32.combine, so segmented
+    downloads are verified without reading anything back. With no expected digest the check
+    only computes one, which the download cache uses as the content address. The address is
+    always SHA-256: with address set, a CRC32 or MD5 check runs a SHA-256 check alongside.
+    """
+    ALGORITHMS = ('sha256', 'md5', 'crc32')
+    DIGEST_LENGTHS = {64: 'sha256', 32: 'md5', 8: 'crc32'}
+    BSD_LINE = re.compile(r'^([\w-]+) \((.+)\) = ([0-9A-Fa-f]+)$')
+    READ_SIZE = 1024 * 1024
+
+    def __init__(self, algorithm, expected=None, address=False):
+        self.algorithm = algorithm.lower()
+        if self.algorithm not in self.ALGORITHMS:
+            raise ValueError(f"Unsupported checksum algorithm: {algorithm}")
+        self.expected = expected.strip().lower() if expected else None
+        self.lock = Lock()
+        self.position = 0
+        self.hasher = self.new_hasher(self.algorithm)
+        self.ranges = {}
+        # Weak digests collide, so they only verify; the content address comes from this check.
+        self.address_check = IntegrityCheck('sha256') if address and self.algorithm != 'sha256' else None
+
+    @staticmethod
+    def new_hasher(algorithm):
+        return Crc32() if algorithm == 'crc32' else hashlib.new(algorithm)
+
+    def feed(self, offset, data, start=0):
+        """Adds data written at offset by a transfer whose contiguous run began at start."""
+        if self.address_check is not None:
+            self.address_check.feed(offset, data, start)
+        with self.lock:
+            if self.algorithm == 'crc32':
+                crc = self.ranges.get(start)
+                if crc is None and offset == start:
+                    crc = self.ranges[start] = Crc32()
+                if crc is not None and start + crc.length == offset:
+                    crc.update(data)
+            elif offset == self.position:
+                self.hasher.update(data)
+                self.position += len(data)
+
+    def _hash_file_range(self, f, hasher, start, end):
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            data = f.read(min(self.READ_SIZE, remaining))
+            if not data:
+                break
+            hasher.update(data)
+            remaining -= len(data)
+
+    def prime(self, path, length):
+        """Hashes the first length bytes already on disk, for a transfer resuming at that offset."""
+        if self.address_check is not None:
+            self.address_check.prime(path, length)
+        with open(path, 'rb') as f, self.lock:
+            if self.algorithm == 'crc32':
+                crc = self.ranges[0] = Crc32()
+                self._hash_file_range(f, crc, 0, length)
+            elif self.position < length:
+                self._hash_file_range(f, self.hasher, self.position, length)
+                self.position = length
+
+    def content_address(self, path, size, digest):
+        """The cache address ("sha256-<hex>") of the file whose finish() returned digest."""
+        if self.address_check is not None:
+            return f"sha256-{self.address_check.finish(path, size)}"
+        return f"{self.algorithm}-{digest}"
+
+    def finish(self, path, size):
+        """Completes the checksum over a file of size bytes and returns its hex digest."""
+        with open(path, 'rb') as f, self.lock:
+            if self.algorithm != 'crc32':
+                self._hash_file_range(f, self.hasher, self.position, size)
+                self.position = size
+                return self.hasher.hexdigest()
+
+            value = 0
+            position = 0
+            for start in sorted(self.ranges):
+                crc = self.ranges[start]
+                if start < position or start + crc.length > size:
+                    # Overlapping or oversized runs cannot be merged; checksum the file instead.
+                    whole = Crc32()
+                    self._hash_file_range(f, whole, 0, size)
+                    return whole.hexdigest()
+                if start > position:
+                    gap = Crc32()
+                    self._hash_file_range(f, gap, position, start)
+                    value = Crc32.combine(value, gap.value, gap.length)
+                value = Crc32.combine(value, crc.value, crc.length)
+                position = start + crc.length
+            if position < size:
+                gap = Crc32()
+                self._hash_file_range(f, gap, position, size)
+                value = Crc32.combine(value, gap.value, gap.length)
+            return f"{value:08x}"
+
+    @classmethod
+    def guess_algorithm(cls, digest, hint=None):
+        hint = (hint or '').lower().lstrip('.').replace('-', '')
+        if hint in ('sfv', 'crc'):
+            hint = 'crc32'
+        if hint.endswith('sums'):
+            hint = hint[:-4]
+        if hint in cls.ALGORITHMS:
+            return hint
+        return cls.DIGEST_LENGTHS.get(len(digest))
+
+    @classmethod
+    def parse_manifest(cls, path):
+        """
+        Reads a checksum manifest into {name: (algorithm, digest)}. Understands the
+        sha256sum/md5sum format ("<digest>  <name>"), BSD tags ("SHA256 (name) = <digest>")
+        and SFV ("<name> <crc32>"); the algorithm comes from the tag, the file extension
+        or the digest length.
+        """
+        base = os.path.basename(path)
+        hint = os.path.splitext(base)[1] or base
+        entries = {}
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith(('#', ';')):
+                    continue
+                bsd = cls.BSD_LINE.match(line)
+                if bsd:
+                    tag, name, digest = bsd.groups()
+                    algorithm = cls.guess_algorithm(digest, tag)
+                elif len(line.split(None, 1)) != 2:
+                    continue
+                elif hint.lower() == '.sfv':
+                    name, digest = line.rsplit(None, 1)
+                    algorithm = 'crc32'
+                else:
+                    digest, name = line.split(None, 1)
+                    name = name.lstrip('*')
+                    algorithm = cls.guess_algorithm(digest, hint)
+                digest = digest.lower()
+                if algorithm and re.fullmatch(r'[0-9a-f]+', digest):
+                    entries[name.strip()] = (algorithm, digest)
+        return entries
+
+class InstrumentedHTTPConnection(HTTPConnection):
+    """
+    urllib3 connection that tells its adapter (a class attribute, set on a subclass made per
+    adapter) about every socket it opens, and with metrics enabled times connection setup and
+    the wait for each response's head.
+    """
+    adapter = None
+
+    def label(self):
+        return self.host if self.port in (None, 80, 443) else f"{self.host}:{self.port}"
+
+    def connect(self):
+        began = time.perf_counter()
+        super().connect()
+        self.adapter._count(self.host, 'new_connections')
+        if self.adapter.metrics is not None:
+            # DNS, TCP and TLS happen inside urllib3 here, so they are reported as one phase.
+            self.adapter.metrics.phase('setup', time.perf_counter() - began, self.label())
+
+    def getresponse(self, *args, **kwargs):
+        metrics = self.adapter.metrics
+        if metrics is None:
+            return super().getresponse(*args, **kwargs)
+        began = time.perf_counter()
+        response = super().getresponse(*args, **kwargs)
+        metrics.phase('ttfb', time.perf_counter() - began, self.label())
+        return response
+
+class InstrumentedHTTPSConnection(InstrumentedHTTPConnection, HTTPSConnection):
+    pass
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that records, per host, how many requests were sent and how many new
+    connections had to be opened for them, so keep-alive reuse can be observed. Its pools
+    use InstrumentedHTTPConnection, so with a MetricsRegistry in metrics, new connections
+    also report their setup time and every response its time to first byte.
+    """
+    def __init__(self, *args, **kwargs):
+        self.stats_lock = Lock()
+        self.host_stats = {}
+        self.metrics = None
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        pool_classes = {}
+        for scheme, pool_class, connection_class in (
+                ('http', HTTPConnectionPool, InstrumentedHTTPConnection),
+                ('https', HTTPSConnectionPool, InstrumentedHTTPSConnection)):
+            connection_class = type(connection_class.__name__, (connection_class,), {'adapter': self})
+            pool_classes[scheme] = type(pool_class.__name__, (pool_class,), {'ConnectionCls': connection_class})
+        self.poolmanager.pool_classes_by_scheme = pool_classes
+
+    def _count(self, host, key):
+        with self.stats_lock:
+            stats = self.host_stats.setdefault((host or '').lower(), {'requests': 0, 'new_connections': 0})
+            stats[key] += 1
+
+    def send(self, request, **kwargs):
+        self._count(urlparse(request.url).hostname, 'requests')
+        return super().send(request, **kwargs)
+
+    def get_stats(self):
+        with self.stats_lock:
+            hosts = {host: dict(stats) for host, stats in self.host_stats.items()}
+        for stats in hosts.values():
+            stats['reused_connections'] = max(0, stats['requests'] - stats['new_connections'])
+        return {
+            'requests': sum(stats['requests'] for stats in hosts.values()),
+            'new_connections': sum(stats['new_connections'] for stats in hosts.values()),
+            'reused_connections': sum(stats['reused_connections'] for stats in hosts.values()),
+            'hosts': hosts
+        }
+
+class ProgressRecord:
+    """Fixed-slot progress state for one active download. Only its worker writes to it."""
+    __slots__ = ('url', 'filename', 'size', 'downloaded_bytes', 'progress', 'speed', 'resumed_bytes', 'segments',
+                 'sources', 'dirty', 'window')
+    # speed is the rate over about the last SPEED_WINDOW seconds, from samples taken at most
+    # every SPEED_SAMPLE_INTERVAL.
+    SPEED_WINDOW = 5.0
+    SPEED_SAMPLE_INTERVAL = 0.25
+
+    def __init__(self, url, filename):
+        self.url = url
+        self.filename = filename
+        self.size = 0
+        self.downloaded_bytes = 0
+        self.progress = 0
+        self.speed = 0
+        self.resumed_bytes = 0
+        self.segments = 0
+        self.sources = 1
+        self.dirty = False
+        self.window = ()
+
+    def measure_speed(self, now, downloaded_bytes):
+        """
+        Adds a sample and updates speed. The window is replaced by a new tuple rather than
+        changed in place, so segment threads reporting for the same record never see it half-built.
+        """
+        window = self.window
+        if now - window[-1][0] >= self.SPEED_SAMPLE_INTERVAL:
+            start = 0
+            while start + 1 < len(window) and now - window[start + 1][0] >= self.SPEED_WINDOW:
+                start += 1
+            window = self.window = window[start:] + ((now, downloaded_bytes),)
+        then, bytes_then = window[0]
+        if now > then:
+            self.speed = (downloaded_bytes - bytes_then) / (now - then)
+
+class TelemetryChannel:
+    """
+    Hand-off from download workers to the UI without locks. Workers update their own
+    ProgressRecord and publish it once per change; finished downloads go into the completed
+    and failed deques. The UI drains everything in bulk with O(1) pops, relying on deque
+    append/popleft being atomic.
+    """
+    def __init__(self):
+        self.updates = deque()
+        self.completed = deque()
+        self.failed = deque()
+        self.retrying = deque()
+        # Jobs taken from DownloadManager job sources, for the UI to add rows for.
+        self.queued = deque()
+
+    def publish(self, record):
+        if not record.dirty:
+            record.dirty = True
+            self.updates.append(record)
+
+    def drain_updates(self):
+        records = []
+        while self.updates:
+            record = self.updates.popleft()
+            # Clear the flag before the caller reads the fields, so a concurrent change re-publishes.
+            record.dirty = False
+            records.append(record)
+        return records
+
+class ProbeCache:
+    """
+    Thread-safe LRU cache with a time-to-live for HEAD metadata, keyed by URL, so naming
+    passes and the downloader can reuse a probe instead of another round trip.
+    """
+    def __init__(self, max_entries=4096, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = Lock()
+        self.entries = OrderedDict()
+
+    def get(self, url):
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return None
+            stored_at, metadata = entry
+            if time.time() - stored_at > self.ttl:
+                del self.entries[url]
+                return None
+            self.entries.move_to_end(url)
+            return metadata
+
+    def put(self, url, metadata):
+        with self.lock:
+            self.entries[url] = (time.time(), metadata)
+            self.entries.move_to_end(url)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, url=None):
+        with self.lock:
+            if url is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(url, None)
+
+class ExtensionResolver:
+    """
+    Picks a file extension for a URL in one pass. An extension on the last path segment wins
+    unless it is a server script's (.php, .aspx, ...). Otherwise one precompiled regex scans
+    the path and query for whole format tokens, such as 'mp4' in '/video/mp4/12' or 'webm' in
+    '?format=webm'. Parts of words ('subscribe') and parameter names ('sub=1') do not count,
+    and when several formats appear the one listed first wins. Probed content types map
+    through the MIME table: the exact type first, then its major type ('video/*'). register()
+    extends both tables of one resolver.
+    """
+    FORMAT_TOKENS = (
+        ('mp4', '.mp4'), ('avi', '.avi'), ('mov', '.mov'), ('mkv', '.mkv'), ('webm', '.webm'),
+        ('mp3', '.mp3'), ('srt', '.srt'), ('sub', '.sub'), ('vtt', '.vtt'), ('pdf', '.pdf'),
+        ('zip', '.zip'), ('jpg', '.jpg'), ('jpeg', '.jpg'), ('png', '.png'), ('gif', '.gif'),
+        ('csv', '.csv'), ('json', '.json'),
+    )
+    MIME_TYPES = {
+        'video/mp4': '.mp4', 'video/webm': '.webm', 'video/x-matroska': '.mkv', 'video/quicktime': '.mov',
+        'video/*': '.mp4',
+        'audio/mpeg': '.mp3', 'audio/*': '.mp3',
+        'text/vtt': '.vtt', 'application/x-subrip': '.srt', 'text/srt': '.srt',
+        'image/jpeg': '.jpg', 'image/png': '.png', 'image/gif': '.gif', 'image/webp': '.webp',
+        'application/pdf': '.pdf', 'application/zip': '.zip', 'application/x-zip-compressed': '.zip',
+        'application/json': '.json', 'text/html': '.html', 'text/csv': '.csv',
+    }
+    SCRIPT_EXTENSIONS = frozenset(('.php', '.asp', '.aspx', '.jsp', '.cgi', '.pl'))
+    MAX_EXTENSION_LENGTH = 5
+    # scheme://authority, then the path and the query; several times cheaper than urlsplit.
+    URL_PARTS = re.compile(r'(?:[A-Za-z][A-Za-z0-9+.-]*:)?(?://[^/?#]*)?([^?#]*)(?:\?([^#]*))?')
+
+    def __init__(self):
+        # Insertion order is precedence.
+        self.tokens = dict(self.FORMAT_TOKENS)
+        self.mime_types = dict(self.MIME_TYPES)
+        self._compile()
+
+    def _compile(self):
+        self.rank = {token: rank for rank, token in enumerate(self.tokens)}
+        alternatives = '|'.join(re.escape(token) for token in sorted(self.tokens, key=len, reverse=True))
+        self.pattern = re.compile(rf'(?<![a-z0-9])(?:{alternatives})(?![a-z0-9=])')
+
+    def register(self, extension, tokens=(), mime_types=()):
+        """Maps URL tokens and content types to extension ('.mkv' or 'mkv'). New tokens rank after existing ones."""
+        extension = '.' + extension.lower().lstrip('.')
+        for token in tokens:
+            self.tokens[token.lower()] = extension
+        for mime_type in mime_types:
+            self.mime_types[mime_type.lower()] = extension
+        self._compile()
+
+    @classmethod
+    def split_url(cls, url):
+        """Returns the (path, query) of a URL; query is '' when there is none."""
+        path, query = cls.URL_PARTS.match(url).groups()
+        return path, query or ''
+
+    def from_url(self, url):
+        """Returns the extension the URL names, or None."""
+        path, query = self.split_url(url)
+        segment = path.rpartition('/')[2]
+        dot = segment.rfind('.')
+        # Like os.path.splitext, a leading dot ('.htaccess') does not start an extension.
+        if dot > 0 and 1 < len(segment) - dot <= self.MAX_EXTENSION_LENGTH:
+            ext = segment[dot:].lower()
+            if ext not in self.SCRIPT_EXTENSIONS:
+                return ext
+        matches = self.pattern.findall(f"{path}?{query}".lower())
+        if matches:
+            return self.tokens[min(matches, key=self.rank.__getitem__)]
+        return None
+
+    def from_content_type(self, content_type):
+        """Returns the extension for a Content-Type header value, or None."""
+        mime_type = content_type.split(';', 1)[0].strip().lower()
+        return self.mime_types.get(mime_type) or self.mime_types.get(mime_type.partition('/')[0] + '/*')
+
+class TokenBucket:
+    """
+    Token bucket refilled at rate bytes per second up to burst bytes. consume() may drive the
+    balance negative and returns how long the caller has to sleep to pay the debt back, so a
+    whole read is throttled by one sleep instead of being split into smaller reads.
+    """
+    def __init__(self, rate, burst=None):
+        self.lock = Lock()
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate, burst=None):
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+            self.burst = burst or rate
+            self.tokens = min(self.tokens, self.burst)
+
+    def consume(self, amount):
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+class RateLimiter:
+    """
+    Bandwidth shaping shared by every worker: a global bucket, a bucket per host (a default
+    cap with optional per-host overrides) and a bucket per job. Rates are in bytes per second;
+    None or 0 means unlimited. Limits can be changed at any time and apply to running downloads.
+    """
+    def __init__(self, global_rate=None, host_rate=None):
+        self.lock = Lock()
+        self.global_bucket = None
+        self.host_rate = None
+        self.host_rates = {}
+        self.host_buckets = {}
+        self.job_buckets = {}
+        self.active = False
+        self.set_global_limit(global_rate)
+        self.set_host_limit(host_rate)
+
+    @staticmethod
+    def _update_bucket(bucket, rate):
+        if not rate:
+            return None
+        if bucket is None:
+            return TokenBucket(rate)
+        bucket.set_rate(rate)
+        return bucket
+
+    def _refresh_active(self):
+        self.active = bool(self.global_bucket or self.host_rate or self.host_rates or self.job_buckets)
+
+    def set_global_limit(self, rate):
+        with self.lock:
+            self.global_bucket = self._update_bucket(self.global_bucket, rate)
+            self._refresh_active()
+
+    def set_host_limit(self, rate, host=None):
+        """Sets the default cap for every host, or the cap of one host if host is given."""
+        with self.lock:
+            if host is None:
+                self.host_rate = rate or None
+            elif rate:
+                self.host_rates[host] = rate
+            else:
+                self.host_rates.pop(host, None)
+
+            for name in list(self.host_buckets):
+                bucket = self._update_bucket(self.host_buckets[name], self.host_rates.get(name, self.host_rate))
+                if bucket is None:
+                    del self.host_buckets[name]
+            self._refresh_active()
+
+    def set_job_limit(self, url, rate):
+        with self.lock:
+            bucket = self._update_bucket(self.job_buckets.get(url), rate)
+            if bucket is None:
+                self.job_buckets.pop(url, None)
+            else:
+                self.job_buckets[url] = bucket
+            self._refresh_active()
+
+    def clear_job_limits(self):
+        with self.lock:
+            self.job_buckets.clear()
+            self._refresh_active()
+
+    def limits(self):
+        with self.lock:
+            return {
+                'global': self.global_bucket.rate if self.global_bucket else None,
+                'host': self.host_rate,
+                'hosts': dict(self.host_rates),
+                'jobs': {url: bucket.rate for url, bucket in self.job_buckets.items()}
+            }
+
+    def consume(self, url, amount, source=None):
+        """
+        Charges amount bytes of url's transfer to its buckets. Returns the seconds to sleep.
+        Bytes fetched from a mirror are charged to the source URL's host instead of url's.
+        """
+        if not self.active:
+            return 0.0
+        host = urlparse(source or url).netloc
+        with self.lock:
+            buckets = [self.global_bucket, self.job_buckets.get(url)]
+            rate = self.host_rates.get(host, self.host_rate)
+            if rate:
+                bucket = self.host_buckets.get(host)
+                if bucket is None:
+                    bucket = self.host_buckets[host] = TokenBucket(rate)
+                buckets.append(bucket)
+        return max((bucket.consume(amount) for bucket in buckets if bucket is not None), default=0.0)
+
+class HostConcurrency:
+    __slots__ = ('limit', 'window_start', 'window_bytes', 'window_urls', 'errors',
+                 'probing', 'base_throughput', 'last_per_connection', 'hold')
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+        self.window_urls = set()
+        self.errors = 0
+        self.probing = False
+        self.base_throughput = 0.0
+        self.last_per_connection = 0.0
+        self.hold = 0
+
+class ConcurrencyController:
+    """
+    AIMD tuning of the per-host download limit from observed throughput and errors.
+
+    Every WINDOW seconds a host's aggregate throughput is measured from the progress reports.
+    While the host uses all of its slots the limit is raised by one (a probe); the probe is kept
+    if aggregate throughput grew by at least GAIN, and undone otherwise, after which the host is
+    left alone for HOLD windows. 429/503 responses, timeouts and connection errors, or a collapse
+    of per-connection speed without any aggregate gain, halve the limit.
+    """
+    WINDOW = 2.0
+    GAIN = 0.05
+    COLLAPSE = 0.5
+    HOLD = 5
+    BACKOFF_STATUSES = (429, 503)
+
+    def __init__(self, initial_limit=2, max_limit=8, min_limit=1, on_change=None):
+        self.initial_limit = initial_limit
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.on_change = on_change
+        self.enabled = True
+        self.lock = Lock()
+        self.hosts = {}
+
+    @staticmethod
+    def host_key(url):
+        return urlparse(url).netloc.lower()
+
+    def _host(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = HostConcurrency(self.initial_limit)
+        return state
+
+    @classmethod
+    def is_backoff_error(cls, error):
+        status_code = RetryPolicy.status_of(error)
+        if status_code is not None:
+            return status_code in cls.BACKOFF_STATUSES
+        return RetryPolicy.classify(error) in ('timeout', 'connection')
+
+    def observe(self, url, transferred):
+        """Adds transferred bytes of url to its host's window and re-evaluates the limit when the window ends."""
+        if not self.enabled or transferred <= 0:
+            return
+        host = self.host_key(url)
+        with self.lock:
+            state = self._host(host)
+            state.window_bytes += transferred
+            state.window_urls.add(url)
+            now = time.monotonic()
+            if now - state.window_start < self.WINDOW:
+                return
+            limit = self._evaluate(state, now)
+        if limit is not None and self.on_change is not None:
+            self.on_change(host, limit)
+
+    def observe_error(self, url, error):
+        if not self.enabled or not self.is_backoff_error(error):
+            return
+        host = self.host_key(url)
+        with self.lock:
+            state = self._host(host)
+            now = time.monotonic()
+            if state.errors and not state.window_bytes and now - state.window_start >= self.WINDOW:
+                # No bytes moved, so no progress report will end this window; a host that only
+                # answers with errors keeps backing off one window at a time.
+                self._start_window(state, now)
+            state.errors += 1
+            # One decrease per window, however many downloads fail at once.
+            if state.errors > 1:
+                return
+            limit = self._set_limit(state, state.limit // 2)
+            state.probing = False
+            state.hold = self.HOLD
+        if limit is not None and self.on_change is not None:
+            self.on_change(host, limit)
+
+    def _evaluate(self, state, now):
+        throughput = state.window_bytes / (now - state.window_start)
+        per_connection = throughput / len(state.window_urls)
+        saturated = len(state.window_urls) >= state.limit
+        gained = throughput >= state.base_throughput * (1 + self.GAIN)
+        limit = None
+
+        if state.errors:
+            pass
+        elif (state.last_per_connection and per_connection < state.last_per_connection * self.COLLAPSE
+              and not gained):
+            limit = self._set_limit(state, state.limit // 2)
+            state.probing = False
+            state.hold = self.HOLD
+        elif state.probing:
+            if gained and saturated:
+                limit = self._set_limit(state, state.limit + 1)
+                state.base_throughput = throughput
+            elif not gained:
+                limit = self._set_limit(state, state.limit - 1)
+                state.probing = False
+                state.hold = self.HOLD
+        elif state.hold:
+            state.hold -= 1
+        elif saturated:
+            limit = self._set_limit(state, state.limit + 1)
+            state.probing = limit is not None
+            state.base_throughput = throughput
+
+        state.last_per_connection = per_connection
+        self._start_window(state, now)
+        return limit
+
+    @staticmethod
+    def _start_window(state, now):
+        state.window_start = now
+        state.window_bytes = 0
+        state.window_urls = set()
+        state.errors = 0
+
+    def _set_limit(self, state, limit):
+        limit = max(self.min_limit, min(limit, self.max_limit))
+        if limit == state.limit:
+            return None
+        state.limit = limit
+        return limit
+
+    def limits(self):
+        with self.lock:
+            return {host: state.limit for host, state in self.hosts.items()}
+
+class RetryPolicy:
+    """
+    Decides whether a failed download is worth another attempt and how long to wait first.
+    Each error class has its own (max_attempts, base_delay, max_delay) rule; the delay is
+    drawn uniformly from [0, min(max_delay, base_delay * 2 ** (attempt - 1))] ("full jitter")
+    so many downloads failing together do not retry in lockstep. A Retry-After header is
+    honoured as a lower bound unless it asks for more than MAX_RETRY_AFTER seconds.
+    """
+    RULES = {
+        'connection': (5, 1.0, 60.0),
+        'timeout': (5, 2.0, 60.0),
+        'server': (4, 2.0, 120.0),
+        'throttled': (6, 5.0, 300.0),
+        'corrupt': (3, 1.0, 30.0),
+    }
+    MAX_RETRY_AFTER = 3600
+
+    def __init__(self, rules=None):
+        self.rules = dict(self.RULES)
+        if rules:
+            self.rules.update(rules)
+
+    @staticmethod
+    def status_of(error):
+        status_code = getattr(error, 'status_code', None)
+        response = getattr(error, 'response', None)
+        if status_code is None and response is not None:
+            status_code = response.status_code
+        return status_code
+
+    @classmethod
+    def classify(cls, error):
+        """Returns 'throttled', 'server', 'timeout', 'connection', 'corrupt', or None if the error is permanent."""
+        if isinstance(error, IntegrityError):
+            return 'corrupt'
+        status_code = cls.status_of(error)
+        if status_code is not None:
+            if status_code == 429:
+                return 'throttled'
+            return 'server' if 500 <= status_code < 600 else None
+        if isinstance(error, (requests.exceptions.Timeout, ReadTimeoutError, asyncio.TimeoutError, TimeoutError)):
+            return 'timeout'
+        if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                              ProtocolError, http.client.IncompleteRead, asyncio.IncompleteReadError,
+                              ConnectionError)):
+            return 'connection'
+        return None
+
+    @staticmethod
+    def retry_after(error):
+        """Seconds requested by the response's Retry-After header, or None."""
+        headers = getattr(error, 'headers', None)
+        response = getattr(error, 'response', None)
+        if headers is None and response is not None:
+            headers = response.headers
+        value = (headers or {}).get('Retry-After') or (headers or {}).get('retry-after')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def next_delay(self, error, attempt):
+        """Delay before retry number attempt (1-based), or None if the download should fail now."""
+        kind = self.classify(error)
+        if kind is None:
+            return None
+        max_attempts, base_delay, max_delay = self.rules[kind]
+        if attempt > max_attempts:
+            return None
+
+        delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+        retry_after = self.retry_after(error)
+        if retry_after is not None:
+            if retry_after > self.MAX_RETRY_AFTER:
+                return None
+            delay = max(delay, retry_after)
+        return delay
+
+    def max_attempts(self, error):
+        kind = self.classify(error)
+        return self.rules[kind][0] if kind is not None else 0
+
+class RetryQueue:
+    """
+    Delayed queue of jobs waiting for their retry. One timer thread sleeps until the earliest
+    job is due and hands it to submit(job), so waiting never occupies a download worker.
+    If submit raises, the job is passed to on_error(job, error) and the timer keeps running.
+    """
+    def __init__(self, submit, on_error=None):
+        self.submit = submit
+        self.on_error = on_error
+        self.condition = Condition()
+        self.heap = []
+        self.sequence = 0
+        # Jobs taken off the heap but not yet handed to submit still count as waiting.
+        self.dispatching = 0
+        self.thread = None
+        self.closed = False
+
+    def schedule(self, delay, job):
+        with self.condition:
+            heapq.heappush(self.heap, (time.monotonic() + delay, self.sequence, job))
+            self.sequence += 1
+            if self.thread is None:
+                self.thread = Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if self.closed:
+                        return
+                    if self.heap and self.heap[0][0] <= time.monotonic():
+                        break
+                    self.condition.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                _, _, job = heapq.heappop(self.heap)
+                self.dispatching += 1
+            try:
+                self.submit(job)
+            except Exception as e:
+                # A job that cannot be resubmitted must not take the timer down with it, or
+                # every later retry would wait forever.
+                if self.on_error is not None:
+                    self.on_error(job, e)
+            finally:
+                with self.condition:
+                    self.dispatching -= 1
+
+    def __len__(self):
+        with self.condition:
+            return len(self.heap) + self.dispatching
+
+    def clear(self):
+        """Drops every waiting job and returns them."""
+        with self.condition:
+            jobs = [job for _, _, job in sorted(self.heap)]
+            self.heap.clear()
+            self.condition.notify()
+        return jobs
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.heap.clear()
+            self.condition.notify()
+
+class PriorityJobQueue:
+    """
+    Waiting jobs ordered by key(url), smallest first and first-in-first-out among equal keys.
+    Keys are computed when a job is pushed; reorder() recomputes them all after priorities
+    change. Queues that share a sequence counter also order ties consistently with each other.
+    """
+    def __init__(self, key=None, sequence=None):
+        self.key = key or (lambda url: 0)
+        self.sequence = sequence or itertools.count()
+        self.heap = []
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, url, item):
+        heapq.heappush(self.heap, (self.key(url), next(self.sequence), url, item))
+
+    def head(self):
+        """Sort key of the next job, comparable across queues sharing a sequence counter."""
+        key, seq, _, _ = self.heap[0]
+        return key, seq
+
+    def pop(self):
+        return heapq.heappop(self.heap)[3]
+
+    def items(self):
+        return [item for _, _, _, item in sorted(self.heap)]
+
+    def urls(self):
+        return [url for _, _, url, _ in self.heap]
+
+    def reorder(self):
+        self.heap = [(self.key(url), seq, url, item) for _, seq, url, item in self.heap]
+        heapq.heapify(self.heap)
+
+class HostScheduler:
+    """
+    Dispatches downloads to a shared thread pool while enforcing a global concurrency
+    limit and a per-host limit (keyed on the URL's netloc). Items queued for an idle host
+    overtake items waiting behind a saturated one. Among the hosts with a free slot, the
+    job that sorts first by key(url) goes next (queue order when no key is given).
+    """
+    def __init__(self, max_workers=8, per_host_limit=2, key=None):
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.pool_size = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = Lock()
+        self.key = key
+        self.sequence = itertools.count()
+        self.pending = {}
+        self.host_active = {}
+        self.host_limits = {}
+        self.active_count = 0
+
+    @staticmethod
+    def host_key(url):
+        return urlparse(url).netloc.lower()
+
+    def submit(self, url, fn, *args):
+        self.submit_many([(url, fn, args)])
+
+    def submit_many(self, jobs):
+        """Queues (url, fn, args) jobs before dispatching any, so the first one does not jump the order."""
+        with self.lock:
+            for url, fn, args in jobs:
+                host = self.host_key(url)
+                items = self.pending.get(host)
+                if items is None:
+                    items = self.pending[host] = PriorityJobQueue(self.key, self.sequence)
+                items.push(url, (fn, args))
+        self._dispatch()
+
+    def _dispatch(self):
+        ready = []
+        with self.lock:
+            while self.active_count < self.max_workers:
+                heads = [(items.head(), h) for h, items in self.pending.items()
+                         if self.host_active.get(h, 0) < self.host_limits.get(h, self.per_host_limit)]
+                if not heads:
+                    break
+
+                host = min(heads)[1]
+                items = self.pending[host]
+                fn, args = items.pop()
+                if not items:
+                    del self.pending[host]
+
+                self.host_active[host] = self.host_active.get(host, 0) + 1
+                self.active_count += 1
+                ready.append((host, fn, args))
+
+        for host, fn, args in ready:
+            future = self.executor.submit(fn, *args)
+            future.add_done_callback(lambda _, host=host: self._release(host))
+
+    def _release(self, host):
+        with self.lock:
+            self.active_count -= 1
+            remaining = self.host_active.get(host, 0) - 1
+            if remaining > 0:
+                self.host_active[host] = remaining
+            else:
+                self.host_active.pop(host, None)
+        self._dispatch()
+
+    def set_limits(self, max_workers=None, per_host_limit=None):
+        with self.lock:
+            if per_host_limit is not None:
+                self.per_host_limit = max(1, per_host_limit)
+            if max_workers is not None:
+                self.max_workers = max(1, min(max_workers, self.pool_size))
+        self._dispatch()
+
+    def set_host_limit(self, host, limit):
+        """Overrides per_host_limit for one host; None restores the default."""
+        with self.lock:
+            if limit is None:
+                self.host_limits.pop(host, None)
+            else:
+                self.host_limits[host] = max(1, limit)
+        self._dispatch()
+
+    def reprioritize(self):
+        """Re-sorts waiting items after their keys changed."""
+        with self.lock:
+            for items in self.pending.values():
+                items.reorder()
+        self._dispatch()
+
+    def pending_urls(self):
+        with self.lock:
+            return [url for items in self.pending.values() for url in items.urls()]
+
+    def pending_count(self):
+        with self.lock:
+            return sum(len(items) for items in self.pending.values())
+
+    def busy(self):
+        with self.lock:
+            return self.active_count > 0 or bool(self.pending)
+
+    def clear_pending(self):
+        with self.lock:
+            self.pending.clear()
+
+class DownloadEngine:
+    """
+    Backend that executes queued downloads for a DownloadManager. The manager owns the
+    queue, flags and bookkeeping; an engine only decides how transfers are run.
+    """
+    name = None
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    def submit(self, url, filename, save_path):
+        raise NotImplementedError
+
+    def submit_many(self, jobs):
+        for job in jobs:
+            self.submit(*job)
+
+    def busy(self):
+        raise NotImplementedError
+
+    def notify(self):
+        """Called whenever the manager's pause/stop state changes."""
+        pass
+
+    def set_host_limit(self, host, limit):
+        """Changes how many downloads may run at once against one host (netloc)."""
+        pass
+
+    def reprioritize(self):
+        """Called when the manager's job_key order changed, so waiting jobs are re-sorted."""
+        pass
+
+    def pending_urls(self):
+        """URLs submitted but not started yet."""
+        return []
+
+    def pending_count(self):
+        return len(self.pending_urls())
+
+    def stop(self):
+        """Drops pending jobs and interrupts running ones."""
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+class ThreadedEngine(DownloadEngine):
+    """Runs each download as a blocking requests loop on a worker thread, scheduled per host."""
+    name = 'threaded'
+
+    def __init__(self, manager):
+        super().__init__(manager)
+        # Downloads to different hosts run in parallel, while each host only sees
+        # per_host_limit concurrent downloads to prevent server errors.
+        self.scheduler = HostScheduler(max_workers=manager.max_concurrent, per_host_limit=manager.per_host_limit,
+                                       key=manager.job_key)
+
+    def submit(self, url, filename, save_path):
+        self.scheduler.submit(url, self.manager.download_file, url, filename, save_path)
+
+    def submit_many(self, jobs):
+        self.scheduler.submit_many([(job[0], self.manager.download_file, job) for job in jobs])
+
+    def busy(self):
+        return self.scheduler.busy()
+
+    def set_host_limit(self, host, limit):
+        self.scheduler.set_host_limit(host, limit)
+
+    def reprioritize(self):
+        self.scheduler.reprioritize()
+
+    def pending_urls(self):
+        return self.scheduler.pending_urls()
+
+    def pending_count(self):
+        return self.scheduler.pending_count()
+
+    def stop(self):
+        # Running workers notice the manager's stop flag at their next chunk.
+        self.scheduler.clear_pending()
+
+    def shutdown(self):
+        self.scheduler.clear_pending()
+        self.scheduler.executor.shutdown(wait=False)
+
+class AsyncHttpError(Exception):
+    def __init__(self, status_code, reason='', headers=None):
+        super().__init__(f"HTTP {status_code} {reason}".strip())
+        self.status_code = status_code
+        self.headers = headers or {}
+
+class AsyncHttpConnection:
+    """A single HTTP/1.1 keep-alive connection on top of asyncio streams."""
+    def __init__(self, origin, reader, writer):
+        self.origin = origin
+        self.reader = reader
+        self.writer = writer
+        self.reusable = True
+        self.last_used = time.time()
+
+    @classmethod
+    async def open(cls, origin, timeout, metrics=None):
+        scheme, host, port = origin
+        ssl_context = ssl.create_default_context() if scheme == 'https' else None
+        if metrics is not None:
+            return await asyncio.wait_for(cls._open_timed(origin, ssl_context, metrics), timeout)
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=ssl_context, server_hostname=host if ssl_context else None),
+            timeout)
+        return cls(origin, reader, writer)
+
+    @classmethod
+    async def _open_timed(cls, origin, ssl_context, metrics):
+        """Opens the connection step by step so DNS, connect and TLS can be timed separately."""
+        scheme, host, port = origin
+        label = host if port in (80, 443) else f"{host}:{port}"
+        loop = asyncio.get_running_loop()
+        began = time.perf_counter()
+        addresses = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        resolved = time.perf_counter()
+        metrics.phase('dns', resolved - began, label)
+
+        error = None
+        for family, kind, proto, _, address in addresses:
+            sock = socket.socket(family, kind, proto)
+            sock.setblocking(False)
+            try:
+                await loop.sock_connect(sock, address)
+                break
+            except OSError as e:
+                sock.close()
+                error = e
+        else:
+            raise error or OSError(f"Could not resolve {host}")
+        connected = time.perf_counter()
+        metrics.phase('connect', connected - resolved, label)
+
+        reader, writer = await asyncio.open_connection(sock=sock, ssl=ssl_context,
+                                                       server_hostname=host if ssl_context else None)
+        finished = time.perf_counter()
+        if ssl_context is not None:
+            metrics.phase('tls', finished - connected, label)
+        metrics.phase('setup', finished - began, label)
+        return cls(origin, reader, writer)
+
+    def send_request(self, method, target, host_header, headers):
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {host_header}"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+
+    async def read_response_head(self, timeout):
+        head = await asyncio.wait_for(self.reader.readuntil(b'\r\n\r\n'), timeout)
+        lines = head.decode('latin-1').split('\r\n')
+        status_parts = lines[0].split(' ', 2)
+        version, status = status_parts[0], int(status_parts[1])
+        reason = status_parts[2] if len(status_parts) > 2 else ''
+
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get('connection', '').lower()
+        if connection == 'close' or (version == 'HTTP/1.0' and connection != 'keep-alive'):
+            self.reusable = False
+        return status, reason, headers
+
+    async def iter_body(self, method, status, headers, timeout, chunk_size):
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            return
+
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            while True:
+                size_line = await asyncio.wait_for(self.reader.readline(), timeout)
+                if not size_line:
+                    raise ConnectionError("Connection closed inside a chunked body")
+                remaining = int(size_line.split(b';')[0].strip(), 16)
+                if remaining == 0:
+                    while (await asyncio.wait_for(self.reader.readline(), timeout)) not in (b'\r\n', b'\n', b''):
+                        pass
+                    return
+                while remaining:
+                    data = await asyncio.wait_for(self.reader.read(min(chunk_size, remaining)), timeout)
+                    if not data:
+                        raise ConnectionError("Connection closed inside a chunked body")
+                    remaining -= len(data)
+                    yield data
+                await asyncio.wait_for(self.reader.readexactly(2), timeout)
+        elif 'content-length' in headers:
+            remaining = int(headers['content-length'])
+            while remaining > 0:
+                data = await asyncio.wait_for(self.reader.read(min(chunk_size, remaining)), timeout)
+                if not data:
+                    raise ConnectionError(f"Connection closed with {remaining} bytes outstanding")
+                remaining -= len(data)
+                yield data
+        else:
+            # Body delimited by connection close.
+            self.reusable = False
+            while True:
+                data = await asyncio.wait_for(self.reader.read(chunk_size), timeout)
+                if not data:
+                    return
+                yield data
+
+    def close(self):
+        self.reusable = False
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+class AsyncioEngine(DownloadEngine):
+    """
+    Runs every transfer on a single event loop with non-blocking sockets instead of a
+    thread per download. Connections are kept alive and reused per origin, and with
+    pipeline_depth > 1 several small-file requests are written back to back on one
+    connection before their responses are read in order.
+    """
+    name = 'asyncio'
+    CHUNK_SIZE = 65536
+    IDLE_TIMEOUT = 30
+    MAX_REDIRECTS = 5
+
+    def __init__(self, manager, pipeline_depth=1, timeout=30):
+        super().__init__(manager)
+        self.pipeline_depth = max(1, pipeline_depth)
+        self.timeout = timeout
+        self.lock = Lock()
+        self.loop = None
+        self.thread = None
+        self.outstanding = 0
+        # Waiting jobs per origin, in the manager's job_key order.
+        self.pending = {}
+        self.sequence = itertools.count()
+        self.workers = {}
+        self.idle = {}
+        # Per-host limits are keyed on netloc like HostScheduler; origin_hosts maps origins to them.
+        self.host_limits = {}
+        self.origin_hosts = {}
+        # Mirrored jobs run on executor threads; their tasks are referenced here until they finish.
+        self.thread_tasks = set()
+        self.stats = {'connections_opened': 0, 'connections_reused': 0, 'requests_sent': 0, 'pipelined_requests': 0}
+
+    @staticmethod
+    def origin_of(url):
+        parsed = urlparse(url)
+        scheme = parsed.scheme.lower()
+        port = parsed.port or (443 if scheme == 'https' else 80)
+        return scheme, parsed.hostname, port
+
+    def _ensure_loop(self):
+        with self.lock:
+            if self.loop is not None:
+                return
+            ready = Event()
+            self.loop = asyncio.new_event_loop()
+
+            def run():
+                asyncio.set_event_loop(self.loop)
+                self.resume_event = asyncio.Event()
+                self.global_slots = asyncio.Semaphore(self.manager.max_concurrent)
+                self._sync_pause_state()
+                ready.set()
+                self.loop.run_forever()
+
+            self.thread = Thread(target=run, daemon=True)
+            self.thread.start()
+            ready.wait()
+
+    def submit(self, url, filename, save_path):
+        self._ensure_loop()
+        with self.lock:
+            self.outstanding += 1
+        self.loop.call_soon_threadsafe(self._enqueue, (url, filename, save_path))
+
+    def busy(self):
+        with self.lock:
+            return self.outstanding > 0
+
+    def notify(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._sync_pause_state)
+
+    def set_host_limit(self, host, limit):
+        self._ensure_loop()
+        self.loop.call_soon_threadsafe(self._apply_host_limit, host, limit)
+
+    def reprioritize(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._reorder_pending)
+
+    def pending_urls(self):
+        return [url for jobs in list(self.pending.values()) for url in jobs.urls()]
+
+    def pending_count(self):
+        # Includes running jobs, which is close enough for deciding when to feed more.
+        with self.lock:
+            return self.outstanding
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._cancel_all)
+
+    def shutdown(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._cancel_all)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def _finish_job(self, count=1):
+        with self.lock:
+            self.outstanding -= count
+
+    def _sync_pause_state(self):
+        # Stopping also releases paused transfers so they can unwind.
+        if self.manager.pause_flag and not self.manager.stop_flag:
+            self.resume_event.clear()
+        else:
+            self.resume_event.set()
+
+    def _cancel_all(self):
+        dropped = sum(len(jobs) for jobs in self.pending.values())
+        self.pending.clear()
+        self._finish_job(dropped)
+        for tasks in self.workers.values():
+            for task in tasks:
+                task.cancel()
+
+    def _reorder_pending(self):
+        for jobs in self.pending.values():
+            jobs.reorder()
+
+    def _limit_for(self, origin):
+        return self.host_limits.get(self.origin_hosts.get(origin), self.manager.per_host_limit)
+
+    def _apply_host_limit(self, host, limit):
+        if limit is None:
+            self.host_limits.pop(host, None)
+        else:
+            self.host_limits[host] = max(1, limit)
+        # Raised limits take effect at once; lowered ones as workers finish their current batch.
+        for origin, origin_host in self.origin_hosts.items():
+            if origin_host == host:
+                self._spawn_workers(origin)
+
+    def _spawn_workers(self, origin):
+        workers = self.workers.setdefault(origin, set())
+        wanted = min(self._limit_for(origin), len(workers) + len(self.pending.get(origin, ())))
+        while len(workers) < wanted:
+            task = self.loop.create_task(self._worker(origin))
+            workers.add(task)
+            task.add_done_callback(workers.discard)
+
+    def _enqueue(self, job):
+        if job[0] in self.manager.mirrors:
+            # Striping across mirrors needs ranged requests to several hosts; the threaded path does that.
+            task = self.loop.create_task(self._download_in_thread(job))
+            self.thread_tasks.add(task)
+            task.add_done_callback(self.thread_tasks.discard)
+            return
+        origin = self.origin_of(job[0])
+        self.origin_hosts[origin] = HostScheduler.host_key(job[0])
+        jobs = self.pending.get(origin)
+        if jobs is None:
+            jobs = self.pending[origin] = PriorityJobQueue(self.manager.job_key, self.sequence)
+        jobs.push(job[0], job)
+        self._spawn_workers(origin)
+
+    async def _acquire(self, origin):
+        idle = self.idle.get(origin, [])
+        while idle:
+            connection = idle.pop()
+            if connection.reader.at_eof() or time.time() - connection.last_used > self.IDLE_TIMEOUT:
+                connection.close()
+                continue
+            self.stats['connections_reused'] += 1
+            return connection
+        connection = await AsyncHttpConnection.open(origin, self.timeout, self.manager.metrics)
+        self.stats['connections_opened'] += 1
+        return connection
+
+    def _release(self, connection):
+        if connection.reusable and not connection.reader.at_eof():
+            connection.last_used = time.time()
+            self.idle.setdefault(connection.origin, []).append(connection)
+        else:
+            connection.close()
+
+    async def _worker(self, origin):
+        async with self.global_slots:
+            connection = None
+            try:
+                while self.pending.get(origin):
+                    if not self.resume_event.is_set():
+                        await self.resume_event.wait()
+                    if connection is None:
+                        connection = await self._acquire(origin)
+                    jobs = self.pending.get(origin)
+                    if not jobs:
+                        break
+                    batch = [jobs.pop() for _ in range(min(self.pipeline_depth, len(jobs)))]
+                    leftovers = await self._run_batch(connection, batch)
+                    for job in leftovers:
+                        self._enqueue(job)
+                    if not connection.reusable:
+                        connection.close()
+                        connection = None
+                    workers = self.workers.get(origin, set())
+                    if len(workers) > self._limit_for(origin):
+                        workers.discard(asyncio.current_task())
+                        break
+            except asyncio.CancelledError:
+                if connection is not None:
+                    connection.close()
+                    connection = None
+                raise
+            except Exception as e:
+                # Connecting to the origin failed; fail whatever is still waiting for it.
+                jobs = self.pending.pop(origin, None)
+                for job in (jobs.items() if jobs is not None else ()):
+                    self._record_failure(job, e)
+            finally:
+                if connection is not None:
+                    self._release(connection)
+                if not self.pending.get(origin):
+                    self.pending.pop(origin, None)
+
+    async def _download_in_thread(self, job):
+        try:
+            async with self.global_slots:
+                await self.loop.run_in_executor(None, self.manager.download_file, *job)
+        finally:
+            self._finish_job()
+
+    def _record_failure(self, job, error):
+        self.manager.handle_failure(*job, error)
+        self._finish_job()
+
+    async def _serve_from_cache(self, batch):
+        """Completes the jobs the download cache can serve and returns the rest. Revalidation blocks, so it runs in the executor."""
+        remaining = []
+        for position, job in enumerate(batch):
+            url, filename, save_path = job
+            filepath = os.path.join(save_path, filename)
+            try:
+                served = not self.manager.writer.exists(filepath) and await self.loop.run_in_executor(
+                    None, self.manager.fetch_from_cache, url, filename, filepath)
+            except asyncio.CancelledError:
+                unfinished = remaining + batch[position:]
+                for url, filename, _ in unfinished:
+                    self.manager.record_stopped(url, filename)
+                self._finish_job(len(unfinished))
+                raise
+            if served:
+                self._finish_job()
+            else:
+                remaining.append(job)
+        return remaining
+
+    def _prepare(self, job):
+        url, filename, save_path = job
+        filepath = os.path.join(save_path, filename)
+        if self.manager.writer.exists(filepath):
+            self.manager.record_exists(url, filename)
+            self._finish_job()
+            return None
+
+        part_path = filepath + ResumeState.PART_SUFFIX
+        state = ResumeState.load(part_path, url)
+        offset = 0
+        validator = state.validator()
+        if not state.data['segments'] and validator and os.path.exists(part_path):
+            offset = min(state.data['bytes_received'], os.path.getsize(part_path))
+
+        self.manager.begin_progress(url, filename)
+        return {'job': job, 'url': url, 'request_url': url, 'filepath': filepath, 'part_path': part_path,
+                'state': state, 'offset': offset, 'validator': validator, 'started': False, 'start_time': time.time()}
+
+    def _send(self, connection, item):
+        parsed = urlparse(item['request_url'])
+        target = parsed.path or '/'
+        if parsed.query:
+            target += '?' + parsed.query
+        headers = dict(self.manager.DEFAULT_HEADERS)
+        headers['Accept-Encoding'] = 'identity'
+        headers['Connection'] = 'keep-alive'
+        if item['offset']:
+            headers['Range'] = f"bytes={item['offset']}-"
+            headers['If-Range'] = item['validator']
+        connection.send_request('GET', target, parsed.netloc, headers)
+        self.stats['requests_sent'] += 1
+
+    async def _run_batch(self, connection, batch):
+        """Sends a (possibly pipelined) batch of requests and handles the responses in order. Returns jobs to retry."""
+        if self.manager.cache is not None:
+            batch = await self._serve_from_cache(batch)
+        items = [item for item in (self._prepare(job) for job in batch) if item is not None]
+        if not items:
+            return []
+
+        index = 0
+        try:
+            for item in items:
+                self._send(connection, item)
+            if len(items) > 1:
+                self.stats['pipelined_requests'] += len(items) - 1
+            await connection.writer.drain()
+
+            for index, item in enumerate(items):
+                await self._receive(connection, item)
+                if not connection.reusable:
+                    index += 1
+                    break
+            else:
+                return []
+        except asyncio.CancelledError:
+            connection.reusable = False
+            for other in items[index:]:
+                other['state'].keep_or_discard()
+                self.manager.record_stopped(other['url'], other['job'][1])
+            self._finish_job(len(items) - index)
+            raise
+        except Exception as e:
+            connection.reusable = False
+            item = items[index]
+            if index > 0 and not item['started'] and isinstance(e, (ConnectionError, asyncio.IncompleteReadError)):
+                # The server dropped the pipeline before answering this request; retry it unpipelined.
+                self.manager.active_downloads.pop(item['url'], None)
+            else:
+                item['state'].keep_or_discard()
+                self._record_failure(item['job'], e)
+                index += 1
+
+        # The connection cannot carry the rest of the pipeline; hand those jobs back.
+        for other in items[index:]:
+            self.manager.active_downloads.pop(other['url'], None)
+        return [other['job'] for other in items[index:]]
+
+    async def _receive(self, connection, item, redirects=0):
+        metrics = self.manager.metrics
+        began = time.perf_counter()
+        status, reason, headers = await connection.read_response_head(self.timeout)
+        item['started'] = True
+        if metrics is not None:
+            # For a pipelined request this is the wait after the previous response ended.
+            metrics.phase('ttfb', time.perf_counter() - began, self.manager.host_label(item['request_url']))
+
+        if status in (301, 302, 303, 307, 308) and 'location' in headers and redirects < self.MAX_REDIRECTS:
+            async for _ in connection.iter_body('GET', status, headers, self.timeout, self.CHUNK_SIZE):
+                pass
+            item['request_url'] = urljoin(item['request_url'], headers['location'])
+            await self._refetch(item, redirects + 1)
+            return
+
+        if status == 416 and item['offset']:
+            connection.reusable = False
+            item['state'].reset()
+            item['offset'] = 0
+            await self._refetch(item, redirects)
+            return
+
+        if status >= 400:
+            connection.reusable = False
+            raise AsyncHttpError(status, reason, headers)
+
+        url = item['url']
+        state = item['state']
+        content_length = int(headers.get('content-length', 0) or 0)
+        offset = item['offset'] if status == 206 else 0
+        if offset:
+            total_size = offset + content_length if content_length else 0
+        else:
+            total_size = content_length
+            state.reset()
+        state.set_validators({'ETag': headers.get('etag'), 'Last-Modified': headers.get('last-modified')})
+        state.data['size'] = total_size
+        self.manager.record_validators(url, state)
+
+        record = self.manager.active_downloads[url]
+        record.size = total_size
+        record.resumed_bytes = record.downloaded_bytes = offset
+        downloaded_bytes = offset
+
+        check = self.manager.integrity_check(url)
+        if check is not None and offset:
+            check.prime(item['part_path'], offset)
+
+        reported_bytes = downloaded_bytes
+        began = time.perf_counter()
+        f = self.manager.writer.open(item['part_path'], offset, truncate=True, size=total_size)
+        try:
+            with f:
+                async for chunk in connection.iter_body('GET', status, headers, self.timeout, self.CHUNK_SIZE):
+                    if not self.resume_event.is_set():
+                        f.flush()
+                        await self.resume_event.wait()
+                    f.write(chunk)
+                    if check is not None:
+                        check.feed(downloaded_bytes, chunk, start=offset)
+                    downloaded_bytes += len(chunk)
+                    delay = self.manager.rate_limiter.consume(url, len(chunk))
+                    if delay:
+                        await asyncio.sleep(delay)
+                    if downloaded_bytes - reported_bytes >= self.manager.PROGRESS_STEP:
+                        reported_bytes = downloaded_bytes
+                        state.data['bytes_received'] = offset + f.committed
+                        state.save()
+                        self.manager._update_progress(url, downloaded_bytes, total_size, item['start_time'])
+        except asyncio.CancelledError:
+            connection.reusable = False
+            raise
+        finally:
+            # Closing the stream flushed it, so committed now covers everything that was written.
+            state.data['bytes_received'] = offset + f.committed
+            if metrics is not None:
+                metrics.phase('transfer', time.perf_counter() - began, self.manager.host_label(item['request_url']), url)
+
+        blob = self.manager.verify_download(check, item['part_path'], downloaded_bytes, state)
+        placed = self.manager.finalize_file(url, item['part_path'], item['filepath'])
+        state.discard()
+        if not placed:
+            self.manager.active_downloads.pop(url, None)
+            self.manager.record_exists(url, item['job'][1])
+            self._finish_job()
+            return
+        self.manager.store_in_cache(url, item['filepath'], blob, state)
+        self.manager.record_completed(url, item['job'][1], total_size, downloaded_bytes, item['start_time'])
+        self._finish_job()
+
+    async def _refetch(self, item, redirects):
+        connection = await self._acquire(self.origin_of(item['request_url']))
+        try:
+            self._send(connection, item)
+            await connection.writer.drain()
+            await self._receive(connection, item, redirects)
+        finally:
+            self._release(connection)
+
+class UrlTemplate:
+    """
+    Lazily expanded URL pattern. {1-100}, {001-120} or {0-500:10} is a range, zero-padded to
+    the width of a start written with a leading zero and with an optional :step; every run of
+    '#' stands for one shared counter from start to end (given separately), padded to the run's
+    length. Several ranges multiply out with the leftmost outermost, so 's{1-3}e{01-12}' gives
+    36 URLs in season order. len() is computed, not counted, and iteration builds one URL at a
+    time, so a million-URL series costs no memory until it is consumed.
+    """
+    PLACEHOLDER = re.compile(r'\{(\d+)-(\d+)(?::(\d+))?\}|(#+)')
+
+    def __init__(self, template, start=None, end=None, step=1):
+        self.template = template
+        # Literal strings and (dimension, width) placeholders, in template order.
+        self.parts = []
+        self.dimensions = []
+        counter = None
+        position = 0
+        for match in self.PLACEHOLDER.finditer(template):
+            self.parts.append(template[position:match.start()])
+            if match.group(4):
+                if start is None or end is None:
+                    raise ValueError("The template uses '#' but no start and end numbers were given.")
+                if counter is None:
+                    counter = len(self.dimensions)
+                    self.dimensions.append(self.number_range(int(start), int(end), int(step)))
+                self.parts.append((counter, len(match.group(4))))
+            else:
+                first, last, range_step = match.groups()[:3]
+                width = len(first) if len(first) > 1 and first.startswith('0') else 0
+                self.parts.append((len(self.dimensions), width))
+                self.dimensions.append(self.number_range(int(first), int(last), int(range_step or 1)))
+            position = match.end()
+        self.parts.append(template[position:])
+        if not self.dimensions:
+            raise ValueError("The template needs a '#' placeholder or a {start-end} range.")
+
+    @staticmethod
+    def number_range(start, end, step):
+        """Inclusive range from start to end; counts down when end is below start."""
+        if step <= 0:
+            raise ValueError("The step must be a positive number.")
+        return range(start, end + 1, step) if start <= end else range(start, end - 1, -step)
+
+    def __len__(self):
+        return math.prod(len(dimension) for dimension in self.dimensions)
+
+    def __iter__(self):
+        for numbers in self._numbers(0):
+            yield ''.join(part if isinstance(part, str) else str(numbers[part[0]]).zfill(part[1])
+                          for part in self.parts)
+
+    def _numbers(self, depth):
+        # itertools.product would copy every range into a tuple first.
+        if depth == len(self.dimensions):
+            yield ()
+            return
+        for number in self.dimensions[depth]:
+            for rest in self._numbers(depth + 1):
+                yield (number,) + rest
+
+class PlannedJob:
+    """A FilenamePlan entry. numbered is set while the job's name follows the prefix and counter rule."""
+    __slots__ = ('sequence', 'extension', 'name', 'fixed', 'numbered')
+
+    def __init__(self, sequence, extension, name=None, fixed=False):
+        self.sequence = sequence
+        self.extension = extension
+        self.name = name
+        self.fixed = fixed
+        self.numbered = False
+
+class FilenamePlan:
+    """
+    Thread-safe model of the listed jobs and their planned file names, updated incrementally.
+    A name comes from the first rule that applies: the name a job was added with (add_named),
+    the URL's entry in manager.custom_filenames, '<prefix>_NNN<ext>' numbered per extension in
+    list order while manager.batch_filename_prefix is set, or the URL's default name. Each
+    change recomputes only the rows it affects: adding URLs names just the new ones, and a
+    per-URL name or a removal renumbers only the later rows of the same extension. Changes
+    return {url: new name} for the existing rows whose name changed, so the queue and the
+    list can be patched in place.
+    """
+    def __init__(self, manager):
+        self.manager = manager
+        self.lock = Lock()
+        self.sequence = itertools.count()
+        self.jobs = {}
+        # Per extension, the sequence numbers and URLs of the numbered jobs, in list order.
+        self.numbered = {}
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def __contains__(self, url):
+        return url in self.jobs
+
+    def name(self, url):
+        job = self.jobs.get(url)
+        return job.name if job else None
+
+    def add(self, urls):
+        """Appends the URLs not planned yet and returns their (url, filename) in order."""
+        manager = self.manager
+        added = []
+        with self.lock:
+            for url in urls:
+                if url in self.jobs:
+                    continue
+                job = self.jobs[url] = PlannedJob(next(self.sequence), manager.get_proper_extension(url, check_online=False))
+                if url in manager.custom_filenames:
+                    job.name = manager.custom_filenames[url]
+                else:
+                    # Appending keeps the lists sorted, and the number is simply the new length.
+                    sequences, members = self.numbered.setdefault(job.extension, ([], []))
+                    sequences.append(job.sequence)
+                    members.append(url)
+                    job.numbered = True
+                    job.name = self._rule_name(url, job.extension, len(members))
+                added.append((url, job.name))
+        return added
+
+    def add_named(self, jobs):
+        """Appends (url, filename, save_path) jobs whose names are fixed, such as a fed template series."""
+        with self.lock:
+            for url, filename, _ in jobs:
+                if url not in self.jobs:
+                    self.jobs[url] = PlannedJob(next(self.sequence), None, filename, fixed=True)
+
+    def remove(self, urls):
+        with self.lock:
+            starts = {}
+            for url in urls:
+                job = self.jobs.pop(url, None)
+                if job is not None and job.numbered:
+                    self._unnumber(url, job, starts)
+            return self._renumber(starts, {})
+
+    def set_names(self, names):
+        """Gives URLs their own names ({url: filename}); a None filename returns the URL to the rules."""
+        custom_filenames = self.manager.custom_filenames
+        with self.lock:
+            starts, changes = {}, {}
+            for url, filename in names.items():
+                if filename is None:
+                    custom_filenames.pop(url, None)
+                else:
+                    custom_filenames[url] = filename
+                job = self.jobs.get(url)
+                if job is None or job.fixed:
+                    continue
+                if filename is None:
+                    if not job.numbered:
+                        self._number(url, job, starts, changes)
+                else:
+                    if job.numbered:
+                        self._unnumber(url, job, starts)
+                    self._rename(url, job, filename, changes)
+            return self._renumber(starts, changes)
+
+    def set_prefix(self, prefix, keep_names=True):
+        """
+        Sets manager.batch_filename_prefix (None for default names) and renames the numbered jobs.
+        With keep_names false, per-URL names are dropped and those jobs are numbered again too.
+        """
+        with self.lock:
+            changes = {}
+            self.manager.batch_filename_prefix = prefix
+            if not keep_names:
+                self.manager.custom_filenames.clear()
+                for url, job in self.jobs.items():
+                    if not job.fixed and not job.numbered:
+                        self._number(url, job, {}, changes)
+            if prefix:
+                return self._renumber(dict.fromkeys(self.numbered, 0), changes)
+            for _, members in self.numbered.values():
+                for url in members:
+                    self._rename(url, self.jobs[url], self.manager.default_filename(url), changes)
+            return changes
+
+    def clear(self):
+        with self.lock:
+            self.jobs.clear()
+            self.numbered.clear()
+
+    def _rule_name(self, url, ext, number):
+        prefix = self.manager.batch_filename_prefix
+        if prefix:
+            return f"{prefix}_{number:03d}{ext}"
+        return self.manager.default_filename(url)
+
+    @staticmethod
+    def _rename(url, job, name, changes):
+        if job.name != name:
+            job.name = changes[url] = name
+
+    def _number(self, url, job, starts, changes):
+        sequences, members = self.numbered.setdefault(job.extension, ([], []))
+        position = bisect.bisect_left(sequences, job.sequence)
+        sequences.insert(position, job.sequence)
+        members.insert(position, url)
+        job.numbered = True
+        starts[job.extension] = min(position, starts.get(job.extension, position))
+        # Default names do not depend on the position, so _renumber leaves them alone.
+        if not self.manager.batch_filename_prefix:
+            self._rename(url, job, self.manager.default_filename(url), changes)
+
+    def _unnumber(self, url, job, starts):
+        sequences, members = self.numbered[job.extension]
+        position = bisect.bisect_left(sequences, job.sequence)
+        del sequences[position]
+        del members[position]
+        job.numbered = False
+        starts[job.extension] = min(position, starts.get(job.extension, position))
+
+    def _renumber(self, starts, changes):
+        """Renames the numbered jobs from each extension's first changed position on."""
+        if not self.manager.batch_filename_prefix:
+            return changes
+        for ext, start in starts.items():
+            members = self.numbered[ext][1]
+            for number, url in enumerate(members[start:], start + 1):
+                self._rename(url, self.jobs[url], self._rule_name(url, ext, number), changes)
+        return changes
+
+class DownloadManager:
+    DEFAULT_HEADERS = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+    }
+    PROBE_TIMEOUT = 3
+    READ_BUFFER_MIN = 64 * 1024
+    READ_BUFFER_MAX = 1024 * 1024
+    PROGRESS_STEP = 512 * 1024
+    # Mirrored downloads hand out pieces of at most this size, and give up on a mirror
+    # connection that sends nothing for STALL_TIMEOUT seconds.
+    MIRROR_PIECE_MAX = 8 * 1024 * 1024
+    STALL_TIMEOUT = 10
+    # "url | mirror | mirror": a '|' only separates sources when another URL follows it.
+    MIRROR_SEPARATOR = re.compile(r'\s*\|\s*(?=[A-Za-z][A-Za-z0-9+.-]*://)')
+    METALINK_HASHES = {'sha-256': 'sha256', 'sha256': 'sha256', 'md5': 'md5'}
+    PRIORITIES = {'high': 1, 'normal': 0, 'low': -1}
+    # 'fifo' keeps queue order; 'shortest' starts the smallest files first, which minimizes
+    # the mean completion time of a batch. Priorities come before either.
+    SCHEDULING_POLICIES = ('fifo', 'shortest')
+    # Job sources are drawn from FEED_BATCH jobs at a time, whenever fewer than half a
+    # batch is left waiting.
+    FEED_BATCH = 1000
+
+    ENGINES = {
+        ThreadedEngine.name: ThreadedEngine,
+        AsyncioEngine.name: AsyncioEngine
+    }
+
+    def __init__(self, max_concurrent=8, per_host_limit=2, segments=4, min_segment_size=1024 * 1024,
+                 pool_maxsize=None, journal=None, rate_limiter=None, adaptive=False, cache=None,
+                 writer=None, metrics=None, engine='threaded', **engine_options):
+        self.download_queue = Queue()
+        # New names for jobs still in download_queue, applied as they are handed to the engine.
+        self.queued_renames = {}
+        self.active_downloads = {}
+        self.telemetry = TelemetryChannel()
+        self.completed_downloads = self.telemetry.completed
+        self.failed_downloads = self.telemetry.failed
+        # Pause and stop are events so waiting workers wake up immediately instead of polling.
+        self.resume_event = Event()
+        self.stop_event = Event()
+        self.stop_flag = False
+        self.pause_flag = False
+        self.custom_filenames = {}
+        self.batch_filename_prefix = None
+        self.max_concurrent = max_concurrent
+        self.per_host_limit = per_host_limit
+        # Large files are split into byte ranges fetched over parallel connections
+        # when the server advertises 'Accept-Ranges: bytes'. Set segments to 1 to disable.
+        self.segments = segments
+        self.min_segment_size = min_segment_size
+        # One pooled session is shared by the downloader and the extension probe, so
+        # requests to the same host reuse kept-alive connections instead of new handshakes.
+        self.pool_maxsize = pool_maxsize or max(10, per_host_limit * max(1, segments))
+        self.session = self.create_session(self.pool_maxsize)
+        self.probe_cache = ProbeCache()
+        # URL and content-type to extension tables; extend with extensions.register().
+        self.extensions = ExtensionResolver()
+        # Optional JobJournal that persists job state so the queue survives restarts.
+        self.journal = journal
+        # Token buckets shared by all workers; unlimited until a limit is set.
+        self.rate_limiter = rate_limiter or RateLimiter()
+        # Every .part file is written through one write-back scheduler, which coalesces writes,
+        # caps buffered memory and renames finished files into place.
+        self.writer = writer or WriteScheduler()
+        # Optional MetricsRegistry (see downloader_metrics). Every hook checks for None first,
+        # so without one the download path does no timing at all.
+        self.metrics = metrics
+        # url -> time it was queued, kept only while metrics are collected.
+        self.queued_at = {}
+        # With adaptive set, per_host_limit is only the starting point and each host's
+        # limit follows its measured throughput and errors, up to max_concurrent.
+        self.concurrency = ConcurrencyController(initial_limit=per_host_limit, max_limit=max_concurrent,
+                                                 on_change=self.set_host_concurrency)
+        self.concurrency.enabled = adaptive
+        # Transient failures wait in the retry queue and are resubmitted to the engine.
+        self.retry_policy = RetryPolicy()
+        self.retry_queue = RetryQueue(self._resubmit, on_error=self._resubmit_failed)
+        self.retry_attempts = {}
+        # url -> (algorithm, digest) for downloads that are verified while they stream.
+        self.expected_checksums = {}
+        # Optional DownloadCache; hits are revalidated and materialized instead of downloaded.
+        self.cache = cache
+        # url -> alternate URLs serving the same file; their ranges are fetched in parallel.
+        self.mirrors = {}
+        # Waiting jobs start in job_key order: priority, then size under the 'shortest'
+        # policy, then queue position. All three can change while a batch runs.
+        self.priorities = {}
+        self.queue_positions = {}
+        self.next_position = 0
+        self.job_sizes = {}
+        self.scheduling_policy = 'fifo'
+        # Iterators of (url, filename, save_path) jobs (e.g. from a UrlTemplate) not consumed yet.
+        self.job_sources = deque()
+        self.feed_lock = Lock()
+        self.engine = self.ENGINES[engine](self, **engine_options)
+        if metrics is not None:
+            self.session.get_adapter('https://').metrics = metrics
+            metrics.add_collector(self.collect_metrics)
+
+    def create_session(self, pool_maxsize):
+        session = requests.Session()
+        adapter = PooledHTTPAdapter(pool_connections=max(10, self.max_concurrent), pool_maxsize=pool_maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update(self.DEFAULT_HEADERS)
+        return session
+
+    def get_write_stats(self):
+        return self.writer.snapshot()
+
+    @staticmethod
+    def host_label(url):
+        return urlparse(url).netloc.lower()
+
+    def collect_metrics(self):
+        """Samples for the metrics registry that are read from existing state when it is exported."""
+        throughput = {}
+        for record in list(self.active_downloads.values()):
+            host = self.host_label(record.url)
+            throughput[host] = throughput.get(host, 0) + record.speed
+        samples = [('downloads_active', 'gauge', {}, len(self.active_downloads)),
+                   ('downloads_waiting', 'gauge', {}, self.download_queue.qsize() + self.engine.pending_count()),
+                   ('downloads_retry_waiting', 'gauge', {}, len(self.retry_queue))]
+        samples += [('download_throughput_bytes_per_second', 'gauge', {'host': host}, round(speed, 1))
+                    for host, speed in throughput.items()]
+        for host, stats in self.get_pool_stats()['hosts'].items():
+            samples.append(('http_requests_total', 'counter', {'host': host}, stats['requests']))
+            samples.append(('http_new_connections_total', 'counter', {'host': host}, stats['new_connections']))
+
+        writes = self.writer.snapshot()
+        samples += [('disk_write_seconds', 'histogram', {},
+                     (WriteScheduler.LATENCY_BUCKETS, writes['latency_buckets'], writes['write_seconds'], writes['writes'])),
+                    ('disk_written_bytes_total', 'counter', {}, writes['bytes_written']),
+                    ('disk_dirty_bytes', 'gauge', {}, writes['dirty_bytes']),
+                    ('disk_dirty_bytes_limit', 'gauge', {}, writes['max_dirty']),
+                    ('disk_write_stalls_total', 'counter', {}, writes['stalls']),
+                    ('disk_write_stall_seconds_total', 'counter', {}, writes['stall_seconds']),
+                    ('disk_syncs_total', 'counter', {}, writes['syncs']),
+                    ('disk_sync_seconds_total', 'counter', {}, writes['sync_seconds'])]
+        if self.cache is not None:
+            samples += [(f'cache_{name}_total', 'counter', {}, value) for name, value in self.cache.stats.items()]
+        return samples
+
+    def get_pool_stats(self):
+        return self.session.get_adapter('https://').get_stats()
+
+    @property
+    def pause_flag(self):
+        return not self.resume_event.is_set()
+
+    @pause_flag.setter
+    def pause_flag(self, value):
+        if value:
+            self.resume_event.clear()
+        else:
+            self.resume_event.set()
+        if getattr(self, 'engine', None) is not None:
+            self.engine.notify()
+
+    @property
+    def stop_flag(self):
+        return self.stop_event.is_set()
+
+    @stop_flag.setter
+    def stop_flag(self, value):
+        if value:
+            self.stop_event.set()
+            self.resume_event.set()
+        else:
+            self.stop_event.clear()
+        if getattr(self, 'engine', None) is not None:
+            self.engine.notify()
+
+    def set_engine(self, name, **engine_options):
+        if self.has_pending_work():
+            raise RuntimeError("Cannot switch download engines while downloads are running.")
+        self.engine.shutdown()
+        self.engine = self.ENGINES[name](self, **engine_options)
+        for host, limit in self.concurrency.limits().items():
+            self.engine.set_host_limit(host, limit)
+
+    def set_host_concurrency(self, host, limit):
+        self.engine.set_host_limit(host, limit)
+
+    def set_adaptive_concurrency(self, enabled):
+        """Turns the AIMD controller on or off; turning it off restores per_host_limit everywhere."""
+        self.concurrency.enabled = enabled
+        if not enabled:
+            for host in self.concurrency.limits():
+                self.engine.set_host_limit(host, None)
+            self.concurrency = ConcurrencyController(initial_limit=self.per_host_limit, max_limit=self.max_concurrent,
+                                                     on_change=self.set_host_concurrency)
+            self.concurrency.enabled = False
+
+    def shutdown(self):
+        self.stop_all_downloads()
+        self.retry_queue.close()
+        self.engine.shutdown()
+        self.writer.shutdown()
+        self.session.close()
+        if self.journal is not None:
+            self.journal.flush()
+
+    def set_custom_filename(self, url, filename):
+        self.custom_filenames[url] = filename
+
+    def set_batch_filename_prefix(self, prefix):
+        self.batch_filename_prefix = prefix
+
+    def set_expected_checksum(self, url, algorithm, digest):
+        if algorithm is None:
+            self.expected_checksums.pop(url, None)
+            return
+        IntegrityCheck(algorithm, digest)
+        self.expected_checksums[url] = (algorithm.lower(), digest.strip().lower())
+
+    def load_checksum_manifest(self, path, urls):
+        """
+        Assigns checksums from a manifest to the given URLs, matching entries by the full URL
+        or by the file name in the URL path. Returns how many URLs got a checksum.
+        """
+        entries = IntegrityCheck.parse_manifest(path)
+        matched = 0
+        for url in urls:
+            entry = entries.get(url) or entries.get(os.path.basename(unquote(urlparse(url).path)))
+            if entry is not None:
+                self.expected_checksums[url] = entry
+                matched += 1
+        return matched
+
+    def integrity_check(self, url):
+        expected = self.expected_checksums.get(url)
+        if expected:
+            return IntegrityCheck(*expected, address=self.cache is not None)
+        # The cache needs a content digest, so compute one while the file streams.
+        return IntegrityCheck('sha256') if self.cache is not None else None
+
+    def verify_download(self, check, part_path, size, state):
+        """
+        Finishes check over the completed .part file and returns its content address
+        ("sha256-<digest>" when a cache is used). A mismatch discards the data and raises IntegrityError.
+        """
+        if check is None:
+            return None
+        actual = check.finish(part_path, size)
+        if check.expected and actual != check.expected:
+            # Resuming from corrupt data would reproduce the mismatch, so the retry starts over.
+            state.reset()
+            raise IntegrityError(check.algorithm, check.expected, actual)
+        return check.content_address(part_path, size, actual)
+
+    def finalize_file(self, url, part_path, filepath):
+        """
+        Renames a completed .part file into place; with a sync policy that is the fsync phase.
+        Returns False if filepath was created meanwhile, which is then kept like any existing file.
+        """
+        if self.metrics is None or self.writer.sync_policy == 'none':
+            return self.writer.finalize(part_path, filepath)
+        began = time.perf_counter()
+        placed = self.writer.finalize(part_path, filepath)
+        self.metrics.phase('fsync', time.perf_counter() - began, self.host_label(url), url)
+        return placed
+
+    def fetch_from_cache(self, url, filename, filepath):
+        """
+        Serves url from the cache if its entry still matches the server, checked with a
+        conditional HEAD (If-None-Match / If-Modified-Since). Returns the completion info or None.
+        """
+        if self.cache is None:
+            return None
+        entry = self.cache.lookup(url)
+        if entry is None:
+            return None
+
+        start_time = time.time()
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            r = self.session.head(url, headers=headers, allow_redirects=True, timeout=self.PROBE_TIMEOUT)
+        except requests.exceptions.RequestException:
+            return None
+
+        fresh = r.status_code == 304
+        if r.status_code == 200:
+            # Some servers ignore conditional headers; compare the validators ourselves.
+            fresh = ((entry['etag'] or entry['last_modified']) is not None
+                     and r.headers.get('ETag') == entry['etag']
+                     and r.headers.get('Last-Modified') == entry['last_modified']
+                     and int(r.headers.get('Content-Length', entry['size']) or 0) == entry['size'])
+        if not fresh:
+            if r.status_code in (200, 404, 410):
+                self.cache.forget(url, stale=True)
+            return None
+
+        if not self.cache.materialize(entry, filepath):
+            return None
+        self.writer.add_existing(filepath)
+        return self.record_completed(url, filename, entry['size'], entry['size'], start_time, source='cache')
+
+    def store_in_cache(self, url, filepath, blob, state):
+        """Adds a finished download to the cache if it has a content address and validators to revalidate it by."""
+        if self.cache is None or blob is None or not (state.data['etag'] or state.data['last_modified']):
+            return
+        try:
+            self.cache.store(url, filepath, blob, state.data['etag'], state.data['last_modified'])
+        except (OSError, sqlite3.Error) as e:
+            print(f"Error adding {url} to the download cache: {e}")
+
+    @classmethod
+    def split_sources(cls, line):
+        """Splits a 'url | mirror | ...' line into the primary URL and its list of mirrors."""
+        sources = [source.strip() for source in cls.MIRROR_SEPARATOR.split(line.strip()) if source.strip()]
+        if not sources:
+            return '', []
+        return sources[0], list(dict.fromkeys(source for source in sources[1:] if source != sources[0]))
+
+    def set_mirrors(self, url, mirrors):
+        if mirrors:
+            self.mirrors[url] = list(mirrors)
+        else:
+            self.mirrors.pop(url, None)
+
+    def add_url_lines(self, lines):
+        """Registers the mirrors given on 'url | mirror' lines and returns the primary URLs in order."""
+        urls = []
+        for line in lines:
+            url, mirrors = self.split_sources(line)
+            if url:
+                if mirrors:
+                    self.set_mirrors(url, mirrors)
+                urls.append(url)
+        return urls
+
+    @classmethod
+    def parse_metalink(cls, path):
+        """
+        Reads a Metalink 4 (RFC 5854, .meta4) or Metalink 3 (.metalink) file. Returns one dict
+        per file with its name, URLs in order of preference, size and checksums {algorithm: digest}.
+        """
+        files = []
+        for element in ElementTree.parse(path).getroot().iter():
+            if element.tag.rpartition('}')[2] != 'file':
+                continue
+            name = os.path.basename(element.get('name', '').replace('\\', '/'))
+            urls, hashes, size = [], {}, 0
+            for child in element.iter():
+                tag = child.tag.rpartition('}')[2]
+                text = (child.text or '').strip()
+                if tag == 'url' and text:
+                    # Metalink 4 ranks by priority (1 first), Metalink 3 by preference (100 first).
+                    rank = int(child.get('priority', 0) or 0) or -int(child.get('preference', 0) or 0)
+                    urls.append((rank, len(urls), text))
+                elif tag == 'hash' and text and child.get('type', '').lower() in cls.METALINK_HASHES:
+                    hashes[cls.METALINK_HASHES[child.get('type').lower()]] = text.lower()
+                elif tag == 'size' and text.isdigit():
+                    size = int(text)
+            if urls:
+                files.append({'name': name, 'urls': [url for _, _, url in sorted(urls)], 'size': size, 'hashes': hashes})
+        return files
+
+    def load_metalink(self, path):
+        """
+        Registers the mirrors, checksums and file names of a metalink file. Returns a list of
+        (url, mirrors, filename) with the preferred URL first.
+        """
+        entries = []
+        for entry in self.parse_metalink(path):
+            url, mirrors = entry['urls'][0], entry['urls'][1:]
+            self.set_mirrors(url, mirrors)
+            for algorithm in IntegrityCheck.ALGORITHMS:
+                if algorithm in entry['hashes']:
+                    self.set_expected_checksum(url, algorithm, entry['hashes'][algorithm])
+                    break
+            if entry['name']:
+                self.set_custom_filename(url, entry['name'])
+            entries.append((url, mirrors, entry['name'] or self.default_filename(url)))
+        return entries
+
+    def job_key(self, url):
+        """Sort key of a waiting job; engines start the smallest key first."""
+        size = 0
+        if self.scheduling_policy == 'shortest':
+            # Files of unknown size go after every file whose size is known.
+            size = self.job_sizes.get(url) or float('inf')
+        return -self.priorities.get(url, 0), size, self.queue_positions.get(url, self.next_position)
+
+    def set_priority(self, urls, priority):
+        """Sets the priority of urls, as a number (higher starts sooner) or a PRIORITIES name."""
+        priority = self.PRIORITIES[priority] if isinstance(priority, str) else int(priority)
+        for url in urls:
+            if priority:
+                self.priorities[url] = priority
+            else:
+                self.priorities.pop(url, None)
+        self.engine.reprioritize()
+
+    def set_queue_order(self, urls):
+        """Renumbers queue positions to follow urls (e.g. the reordered download list); other jobs keep their order after them."""
+        listed = dict.fromkeys(urls)
+        others = sorted((position, url) for url, position in self.queue_positions.items() if url not in listed)
+        ordered = list(listed) + [url for _, url in others]
+        self.queue_positions = {url: position for position, url in enumerate(ordered)}
+        self.next_position = len(ordered)
+        self.engine.reprioritize()
+
+    def set_scheduling_policy(self, policy, progress=None, cancelled=None):
+        """
+        Switches between 'fifo' and 'shortest'. Probes the sizes of waiting jobs when needed, so it
+        may block; progress and cancelled are passed on to probe_urls.
+        """
+        if policy not in self.SCHEDULING_POLICIES:
+            raise ValueError(f"Unknown scheduling policy: {policy!r}")
+        self.scheduling_policy = policy
+        if policy == 'shortest':
+            self.probe_sizes([url for url, _, _ in list(self.download_queue.queue)] + self.engine.pending_urls(),
+                             progress, cancelled)
+        self.engine.reprioritize()
+
+    def probe_sizes(self, urls, progress=None, cancelled=None):
+        """Fills in job_sizes for urls whose size is not known yet, with concurrent HEAD requests."""
+        missing = [url for url in urls if url not in self.job_sizes]
+        if missing:
+            for url, metadata in self.probe_urls(missing, progress=progress, cancelled=cancelled).items():
+                self.job_sizes[url] = metadata['size'] if metadata['ok'] else 0
+
+    def add_job_source(self, jobs):
+        """
+        Queues an iterable of (url, filename, save_path) jobs without materializing it. A first
+        batch is queued at once and the rest as the downloads drain; every job taken from a
+        source is also published on telemetry.queued so a UI can add its row.
+        """
+        self.job_sources.append(iter(jobs))
+        self.feed_jobs()
+
+    def feed_jobs(self):
+        """Moves up to FEED_BATCH jobs from the job sources into the queue if the engine is running low."""
+        if not self.job_sources or not self.feed_lock.acquire(blocking=False):
+            return 0
+        try:
+            if self.download_queue.qsize() + self.engine.pending_count() >= self.FEED_BATCH // 2:
+                return 0
+            jobs = []
+            while self.job_sources and len(jobs) < self.FEED_BATCH:
+                wanted = self.FEED_BATCH - len(jobs)
+                batch = list(itertools.islice(self.job_sources[0], wanted))
+                if len(batch) < wanted:
+                    self.job_sources.popleft()
+                jobs += batch
+            self.add_to_queue(jobs)
+            self.telemetry.queued.extend(jobs)
+            return len(jobs)
+        finally:
+            self.feed_lock.release()
+
+    def add_to_queue(self, urls_with_assigned_filenames_and_paths):
+        for url, assigned_filename, save_path in urls_with_assigned_filenames_and_paths:
+            self.queued_renames.pop(url, None)
+            if url not in self.queue_positions:
+                self.queue_positions[url] = self.next_position
+                self.next_position += 1
+            self.download_queue.put((url, assigned_filename, save_path))
+        if self.metrics is not None:
+            now = time.time()
+            for url, _, _ in urls_with_assigned_filenames_and_paths:
+                self.queued_at[url] = now
+        if self.journal is not None:
+            self.journal.record_queued(urls_with_assigned_filenames_and_paths)
+            for url, _, _ in urls_with_assigned_filenames_and_paths:
+                if url in self.mirrors:
+                    self.journal.record_mirrors(url, self.mirrors[url])
+
+    def rename_queued(self, names):
+        """Renames waiting jobs ({url: filename}) in O(len(names)); jobs already started keep their names."""
+        self.queued_renames.update(names)
+        if self.journal is not None:
+            for url, filename in names.items():
+                self.journal.record_filename(url, filename)
+
+    def withdraw_queued(self, urls):
+        """Takes jobs that have not started yet out of the queue and the journal."""
+        urls = set(urls)
+        if not urls:
+            return
+        with self.download_queue.mutex:
+            queue = self.download_queue.queue
+            withdrawn = [job[0] for job in queue if job[0] in urls]
+            kept = [job for job in queue if job[0] not in urls]
+            queue.clear()
+            queue.extend(kept)
+        for url in withdrawn:
+            self.queued_renames.pop(url, None)
+            self.queued_at.pop(url, None)
+        if self.journal is not None:
+            self.journal.remove(withdrawn)
+
+    def get_proper_extension(self, url, check_online=False):
+        ext = self.extensions.from_url(url)
+        if ext is None and check_online:
+            ext = self.extensions.from_content_type(self.probe_url(url)['content_type'])
+        return ext or '.bin'
+
+    def probe_url(self, url):
+        """
+        Returns HEAD metadata for a URL (content type, size, range support and validators),
+        served from the probe cache when a recent result exists.
+        """
+        metadata = self.probe_cache.get(url)
+        if metadata is not None:
+            return metadata
+
+        metadata = {'ok': False, 'content_type': '', 'size': 0, 'accept_ranges': False, 'etag': None, 'last_modified': None}
+        try:
+            response = self.session.head(url, allow_redirects=True, timeout=self.PROBE_TIMEOUT)
+            response.raise_for_status()
+        except requests.exceptions.RequestException:
+            self.probe_cache.put(url, metadata)
+            return metadata
+
+        accept_ranges = response.headers.get('Accept-Ranges', '').lower()
+        content_encoding = response.headers.get('Content-Encoding', '').lower()
+        try:
+            total_size = int(response.headers.get('Content-Length', 0))
+        except ValueError:
+            total_size = 0
+
+        metadata.update({
+            'ok': True,
+            'content_type': response.headers.get('Content-Type', '').lower(),
+            'size': total_size,
+            'accept_ranges': accept_ranges == 'bytes' and content_encoding in ('', 'identity'),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified')
+        })
+        self.probe_cache.put(url, metadata)
+        return metadata
+
+    def probe_urls(self, urls, max_workers=8, progress=None, cancelled=None):
+        """
+        Probes many URLs concurrently with bounded parallelism. Returns {url: metadata}.
+        progress(done, total) is called as probes finish; once the cancelled Event is set,
+        probes not yet started are dropped and the results gathered so far are returned.
+        """
+        results = {}
+        missing = []
+        for url in dict.fromkeys(urls):
+            metadata = self.probe_cache.get(url)
+            if metadata is None:
+                missing.append(url)
+            else:
+                results[url] = metadata
+
+        if missing:
+            total = len(results) + len(missing)
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(missing)))) as probe_executor:
+                futures = {probe_executor.submit(self.probe_url, url): url for url in missing}
+                for future in as_completed(futures):
+                    results[futures[future]] = future.result()
+                    if progress is not None:
+                        progress(len(results), total)
+                    if cancelled is not None and cancelled.is_set():
+                        for pending in futures:
+                            pending.cancel()
+                        break
+        return results
+
+    def split_ranges(self, total_size):
+        segment_count = min(self.segments, max(1, total_size // self.min_segment_size))
+        segment_size = total_size // segment_count
+        ranges = []
+        for i in range(segment_count):
+            start = i * segment_size
+            end = total_size - 1 if i == segment_count - 1 else start + segment_size - 1
+            ranges.append((start, end))
+        return ranges
+
+    def begin_progress(self, url, filename):
+        record = ProgressRecord(url, filename)
+        self.active_downloads[url] = record
+        self.telemetry.publish(record)
+        if self.metrics is not None:
+            queued = self.queued_at.pop(url, None)
+            if queued is not None:
+                self.metrics.observe('download_queue_wait_seconds', time.time() - queued, host=self.host_label(url))
+            self.metrics.event('started', url=url, filename=filename)
+        if self.journal is not None:
+            self.journal.record_state(url, 'active')
+        return record
+
+    def _update_progress(self, url, downloaded_bytes, total_size, start_time):
+        record = self.active_downloads.get(url)
+        if record is None:
+            return
+        self.concurrency.observe(url, downloaded_bytes - record.downloaded_bytes)
+        if not record.window:
+            record.window = ((start_time, record.resumed_bytes),)
+        record.measure_speed(time.time(), downloaded_bytes)
+        record.progress = (downloaded_bytes / total_size) * 100 if total_size > 0 else 0
+        record.downloaded_bytes = downloaded_bytes
+        self.telemetry.publish(record)
+        if self.journal is not None:
+            self.journal.record_progress(url, downloaded_bytes, total_size)
+
+    def _wait_if_paused(self):
+        """Blocks while paused. Returns True if the download should stop."""
+        if not self.resume_event.is_set():
+            self.resume_event.wait()
+        return self.stop_flag
+
+    def _copy_body(self, url, r, f, report, abort=None, limit=None, integrity=None, offset=0, source=None):
+        """
+        Copies a streamed response body into the WriteStream f. Uncompressed bodies are read with
+        readinto straight into f's buffer, and the read size doubles up to READ_BUFFER_MAX while
+        reads keep filling it. report(written) runs every PROGRESS_STEP bytes instead of on every read.
+        Rate limits are applied by sleeping on url's token buckets after each read, and each
+        chunk is fed to the optional IntegrityCheck at its file offset (the body starts at offset).
+        limit may be a callable for ranges that can shrink while they stream (see StripePlan).
+        Returns (bytes_written, stopped).
+        """
+        written = 0
+        reported = 0
+        stopped = False
+        read_size = self.READ_BUFFER_MIN
+        spare = None
+        began = time.perf_counter()
+        content_encoding = r.headers.get('Content-Encoding', '').lower()
+        chunks = None if content_encoding in ('', 'identity') else r.iter_content(chunk_size=self.READ_BUFFER_MIN)
+
+        try:
+            while True:
+                remaining = None if limit is None else (limit() if callable(limit) else limit) - written
+                if remaining is not None and remaining <= 0:
+                    break
+                if not self.resume_event.is_set():
+                    # A paused transfer should not hold buffered data back from the disk.
+                    f.flush()
+                if self.stop_flag or (abort is not None and abort['flag']) or self._wait_if_paused():
+                    stopped = True
+                    break
+
+                wanted = read_size if remaining is None else min(read_size, remaining)
+                if chunks is None:
+                    # Reading straight into the stream's buffer saves copying every byte once more.
+                    view = f.buffer_view(wanted)
+                    if view is None:
+                        spare = spare or memoryview(bytearray(self.READ_BUFFER_MAX))
+                        target = spare[:wanted]
+                    else:
+                        target = view
+                    count = 0
+                    try:
+                        count = r.raw.readinto(target)
+                    finally:
+                        if view is not None:
+                            f.advance(count)
+                    if not count:
+                        break
+                    if view is None:
+                        f.write(target[:count])
+                    if integrity is not None:
+                        integrity.feed(offset + written, target[:count], start=offset)
+                    if count == read_size and read_size < self.READ_BUFFER_MAX:
+                        read_size *= 2
+                else:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    if remaining is not None:
+                        chunk = chunk[:remaining]
+                    count = len(chunk)
+                    f.write(chunk)
+                    if integrity is not None:
+                        integrity.feed(offset + written, chunk, start=offset)
+
+                written += count
+                delay = self.rate_limiter.consume(url, count, source)
+                if delay:
+                    # The stop event cuts a long throttling sleep short.
+                    self.stop_event.wait(delay)
+                if written - reported >= self.PROGRESS_STEP:
+                    reported = written
+                    report(written)
+        finally:
+            # The tail is flushed first so the last report can also count it as committed.
+            f.flush()
+            report(written)
+            if self.metrics is not None:
+                self.metrics.phase('transfer', time.perf_counter() - began, self.host_label(source or url), url)
+
+        return written, stopped
+
+    def _download_single(self, url, part_path, start_time, state):
+        """Fetches the file over one connection. Returns (total_size, downloaded_bytes, blob), or None if stopped."""
+        offset = 0
+        validator = state.validator()
+        if not state.data['segments'] and validator and os.path.exists(part_path):
+            offset = min(state.data['bytes_received'], os.path.getsize(part_path))
+
+        headers = {}
+        if offset:
+            headers['Range'] = f"bytes={offset}-"
+            headers['If-Range'] = validator
+
+        # A server that stalls mid-body raises a read timeout, which is retried, instead of
+        # holding the worker forever.
+        with self.session.get(url, stream=True, headers=headers,
+                              timeout=(self.PROBE_TIMEOUT, self.STALL_TIMEOUT)) as r:
+            if r.status_code == 416 and offset:
+                # The saved range is no longer valid for this resource; start over.
+                state.reset()
+                return self._download_single(url, part_path, start_time, state)
+            r.raise_for_status()
+
+            content_length = int(r.headers.get('content-length', 0))
+            if offset and r.status_code == 206:
+                total_size = offset + content_length if content_length else 0
+            else:
+                # Full response: either a fresh download or the validators no longer match.
+                offset = 0
+                total_size = content_length
+                state.reset()
+            state.set_validators(r.headers)
+            state.data['size'] = total_size
+            self.record_validators(url, state)
+
+            record = self.active_downloads[url]
+            record.size = total_size
+            record.resumed_bytes = offset
+            record.downloaded_bytes = offset
+            self.telemetry.publish(record)
+
+            check = self.integrity_check(url)
+            if check is not None and offset:
+                check.prime(part_path, offset)
+
+            def report(written):
+                # Resume state only claims what has reached the OS; progress shows what arrived.
+                state.data['bytes_received'] = offset + f.committed
+                state.save()
+                self._update_progress(url, offset + written, total_size, start_time)
+
+            with self.writer.open(part_path, offset, truncate=True, size=total_size) as f:
+                written, stopped = self._copy_body(url, r, f, report, integrity=check, offset=offset)
+
+            if stopped:
+                return None
+            downloaded_bytes = offset + written
+
+        blob = self.verify_download(check, part_path, downloaded_bytes, state)
+        return total_size, downloaded_bytes, blob
+
+    def _download_segmented(self, url, part_path, probe, start_time, state):
+        """
+        Fetches the file as parallel byte ranges, each written at its own offset
+        in a preallocated file. Returns (total_size, downloaded_bytes, blob), or None if stopped.
+        Raises SegmentedDownloadUnsupported if the server answers a range with a full response.
+        """
+        total_size = probe['size']
+        resuming = (state.data['segments'] and os.path.exists(part_path)
+                    and state.data['size'] == total_size and state.matches(probe))
+
+        if resuming:
+            segments = [list(segment) for segment in state.data['segments']]
+        else:
+            state.reset()
+            segments = [[start, end, 0] for start, end in self.split_ranges(total_size)]
+            self.writer.create(part_path, total_size)
+
+        state.data.update(size=total_size, etag=probe['etag'], last_modified=probe['last_modified'], segments=segments)
+        self.record_validators(url, state)
+        validator = state.validator()
+        abort = {'flag': False}
+
+        record = self.active_downloads[url]
+        record.size = total_size
+        record.segments = len(segments)
+        record.resumed_bytes = record.downloaded_bytes = sum(segment[2] for segment in segments)
+        self.telemetry.publish(record)
+
+        # Only the first range streams in file order; the others are merged or read back at the end.
+        check = self.integrity_check(url)
+        if check is not None and segments[0][2]:
+            check.prime(part_path, segments[0][2])
+
+        def fetch_segment(segment):
+            start, end, done = segment
+            length = end - start + 1
+            if done >= length:
+                return True
+
+            headers = {'Range': f"bytes={start + done}-{end}"}
+            if done and validator:
+                headers['If-Range'] = validator
+            with self.session.get(url, stream=True, headers=headers, timeout=30) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise SegmentedDownloadUnsupported(f"Server ignored range request (HTTP {r.status_code})")
+
+                def report(written):
+                    # Saved segment progress must not run ahead of what reached the OS.
+                    segment[2] = done + f.committed
+                    downloaded_bytes = sum(s[2] for s in segments)
+                    state.data['bytes_received'] = downloaded_bytes
+                    state.save()
+                    self._update_progress(url, downloaded_bytes, total_size, start_time)
+
+                with self.writer.open(part_path, start + done) as f:
+                    _, stopped = self._copy_body(url, r, f, report, abort=abort, limit=length - done,
+                                                 integrity=check, offset=start + done)
+                if stopped:
+                    return False
+
+            if segment[2] != length:
+                # A truncated body is transient; the retry resumes from the saved segment progress.
+                raise ConnectionError(f"Segment ended early ({segment[2]} of {length} bytes)")
+            return True
+
+        # A resumed mirrored download may have left many small pieces; fetch them a few at a time.
+        with ThreadPoolExecutor(max_workers=max(1, min(len(segments), self.segments))) as segment_executor:
+            futures = [segment_executor.submit(fetch_segment, segment) for segment in segments]
+            try:
+                for future in futures:
+                    future.result()
+            except Exception:
+                abort['flag'] = True
+                raise
+
+        if self.stop_flag:
+            return None
+
+        blob = self.verify_download(check, part_path, total_size, state)
+        return total_size, sum(segment[2] for segment in segments), blob
+
+    def mirror_sources(self, url):
+        """
+        Probes url and its mirrors and returns (sources, probe) for those that support ranges and
+        agree on the size, with url's own probe as the reference when it is usable. Returns
+        ([], None) when there is nothing to stripe across.
+        """
+        candidates = [url] + self.mirrors.get(url, [])
+        probes = self.probe_urls(candidates)
+        usable = [source for source in candidates
+                  if probes[source]['ok'] and probes[source]['accept_ranges'] and probes[source]['size'] > 0]
+        if not usable or usable == [url]:
+            return [], None
+        probe = probes[usable[0]]
+        return [source for source in usable if probes[source]['size'] == probe['size']], probe
+
+    def _download_mirrored(self, url, part_path, sources, probe, start_time, state):
+        """
+        Fetches the file from all sources at once, each over as many connections as a segmented
+        download would open to it, with the file handed out piece by piece through a StripePlan.
+        Returns (total_size, downloaded_bytes, blob), or None if stopped.
+        """
+        total_size = probe['size']
+        connections = max(1, self.segments)
+        resuming = (state.data['segments'] and os.path.exists(part_path)
+                    and state.data['size'] == total_size and state.matches(probe))
+
+        if resuming:
+            pieces = [list(piece) for piece in state.data['segments']]
+        else:
+            state.reset()
+            piece_size = max(self.min_segment_size,
+                             min(self.MIRROR_PIECE_MAX, total_size // (4 * connections * len(sources))))
+            pieces = [[start, min(start + piece_size, total_size) - 1, 0] for start in range(0, total_size, piece_size)]
+            self.writer.create(part_path, total_size)
+
+        state.data.update(size=total_size, etag=probe['etag'], last_modified=probe['last_modified'], segments=pieces)
+        self.record_validators(url, state)
+        plan = StripePlan(pieces, sources, state.lock, self.READ_BUFFER_MIN)
+        abort = {'flag': False}
+
+        record = self.active_downloads[url]
+        record.size = total_size
+        record.segments = connections * len(sources)
+        record.sources = len(sources)
+        record.resumed_bytes = record.downloaded_bytes = sum(piece[2] for piece in pieces)
+        self.telemetry.publish(record)
+
+        check = self.integrity_check(url)
+        if check is not None and pieces[0][2]:
+            check.prime(part_path, pieces[0][2])
+
+        def fetch_piece(source, index):
+            piece = pieces[index]
+            start, end, done = piece
+            began = time.time()
+            headers = {'Range': f"bytes={start + done}-{end}"}
+            with self.session.get(source, stream=True, headers=headers,
+                                  timeout=(self.PROBE_TIMEOUT, self.STALL_TIMEOUT)) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise SegmentedDownloadUnsupported(f"Mirror ignored range request (HTTP {r.status_code})")
+                if not r.headers.get('Content-Range', '').endswith(f"/{total_size}"):
+                    raise SegmentedDownloadUnsupported("Mirror serves a file of a different size")
+
+                def report(written):
+                    # Bytes past a moved end are counted by the piece that took over the tail.
+                    piece[2] = min(done + f.committed, piece[1] - start + 1)
+                    downloaded_bytes = sum(p[2] for p in pieces)
+                    state.data['bytes_received'] = downloaded_bytes
+                    state.save()
+                    self._update_progress(url, downloaded_bytes, total_size, start_time)
+
+                with self.writer.open(part_path, start + done) as f:
+                    # piece[1] moves down if another mirror takes over the tail of this piece.
+                    written, stopped = self._copy_body(url, r, f, report, abort=abort,
+                                                       limit=lambda: piece[1] - start + 1 - done,
+                                                       integrity=check, offset=start + done, source=source)
+            if stopped:
+                return False
+            if plan.remaining(piece) > 0:
+                raise ConnectionError(f"Piece ended early ({piece[2]} of {piece[1] - start + 1} bytes)")
+            plan.finish(index, source, written, time.time() - began)
+            return True
+
+        def work(source):
+            while True:
+                index = plan.claim(source, abort)
+                if index is None:
+                    return
+                try:
+                    if not fetch_piece(source, index):
+                        abort['flag'] = True
+                        return
+                except Exception as e:
+                    # Errors that would not be retried (404, no range support) rule the mirror out at once.
+                    if not plan.release(index, source, e, fatal=self.retry_policy.classify(e) is None):
+                        return
+
+        with ThreadPoolExecutor(max_workers=connections * len(sources)) as mirror_executor:
+            for future in [mirror_executor.submit(work, source) for source in sources for _ in range(connections)]:
+                future.result()
+
+        if self.stop_flag:
+            return None
+        if not plan.complete():
+            raise plan.last_error or IOError("No mirror could complete the download")
+
+        blob = self.verify_download(check, part_path, total_size, state)
+        return total_size, total_size, blob
+
+    def download_file(self, url, filename, save_path):
+        filepath = ""
+        state = None
+        try:
+            filepath = os.path.join(save_path, filename)
+            part_path = filepath + ResumeState.PART_SUFFIX
+
+            if self.writer.exists(filepath):
+                return self.record_exists(url, filename)
+
+            cached = self.fetch_from_cache(url, filename, filepath)
+            if cached is not None:
+                return cached
+
+            self.begin_progress(url, filename)
+
+            # Continue from a previous .part file if its sidecar belongs to this URL.
+            state = ResumeState.load(part_path, url)
+
+            start_time = time.time()
+            result = None
+            segmented = False
+
+            if url in self.mirrors:
+                sources, probe = self.mirror_sources(url)
+                if sources:
+                    segmented = True
+                    result = self._download_mirrored(url, part_path, sources, probe, start_time, state)
+
+            if self.segments > 1 and not segmented:
+                probe = self.probe_url(url)
+                if probe['accept_ranges'] and probe['size'] >= self.min_segment_size * 2:
+                    segmented = True
+                    try:
+                        result = self._download_segmented(url, part_path, probe, start_time, state)
+                    except SegmentedDownloadUnsupported:
+                        segmented = False
+                        self.active_downloads[url].segments = 0
+
+            if not segmented:
+                result = self._download_single(url, part_path, start_time, state)
+
+            if result is None:
+                state.keep_or_discard()
+                return self.record_stopped(url, filename)
+
+            total_size, downloaded_bytes, blob = result
+            placed = self.finalize_file(url, part_path, filepath)
+            state.discard()
+            if not placed:
+                self.active_downloads.pop(url, None)
+                return self.record_exists(url, filename)
+            self.store_in_cache(url, filepath, blob, state)
+
+            return self.record_completed(url, filename, total_size, downloaded_bytes, start_time)
+
+        except Exception as e:
+            # Keep whatever was transferred so the next attempt can resume from it.
+            if state is not None:
+                state.keep_or_discard()
+            return self.handle_failure(url, filename, save_path, e)
+
+    def handle_failure(self, url, filename, save_path, error):
+        """Schedules a retry for transient errors according to retry_policy, otherwise records the failure."""
+        attempt = self.retry_attempts.get(url, 0) + 1
+        delay = None if self.stop_flag else self.retry_policy.next_delay(error, attempt)
+        if delay is None:
+            self.retry_attempts.pop(url, None)
+            return self.record_failed(url, filename, error)
+
+        self.retry_attempts[url] = attempt
+        retry_info = {
+            'status': 'retrying', 'filename': filename, 'url': url, 'error': self.format_error(error),
+            'attempt': attempt, 'max_attempts': self.retry_policy.max_attempts(error), 'delay': delay
+        }
+        self.active_downloads.pop(url, None)
+        self.telemetry.retrying.append(retry_info)
+        self.concurrency.observe_error(url, error)
+        if self.journal is not None:
+            self.journal.record_state(url, 'retrying', error=retry_info['error'])
+        if self.metrics is not None:
+            reason = self.retry_policy.classify(error)
+            self.metrics.inc('download_retries_total', host=self.host_label(url), reason=reason)
+            self.metrics.event('retry', url=url, reason=reason, attempt=attempt, delay=round(delay, 3),
+                               error=retry_info['error'])
+        self.retry_queue.schedule(delay, (url, filename, save_path))
+        return retry_info
+
+    def _resubmit(self, job):
+        if self.stop_flag:
+            # Stopped while the timer was handing the job over, after stop_all_downloads
+            # cleared the retry queue; it is recorded like the jobs cleared there.
+            url, filename, _ = job
+            self.record_stopped(url, filename)
+            return
+        if self.metrics is not None:
+            self.queued_at[job[0]] = time.time()
+        self.engine.submit(*job)
+
+    def _resubmit_failed(self, job, error):
+        url, filename, _ = job
+        self.retry_attempts.pop(url, None)
+        self.record_failed(url, filename, error)
+
+    @staticmethod
+    def format_error(e):
+        status_code = None
+        if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+            status_code = e.response.status_code
+        elif isinstance(e, AsyncHttpError):
+            status_code = e.status_code
+
+        if status_code is None:
+            return str(e)
+        if status_code == 404:
+            return "File not found on server (404)"
+        if status_code == 403:
+            return "Access Forbidden (403)"
+        return f"Server Error ({status_code})"
+
+    def record_completed(self, url, filename, total_size, downloaded_bytes, start_time, source='network'):
+        download_info = {
+            'status': 'completed', 'filename': filename, 'url': url,
+            'size': total_size or downloaded_bytes, 'time': time.time() - start_time, 'source': source
+        }
+        if url in self.expected_checksums:
+            download_info['verified'] = self.expected_checksums[url][0]
+        self.active_downloads.pop(url, None)
+        self.retry_attempts.pop(url, None)
+        self.completed_downloads.append(download_info)
+        if self.journal is not None:
+            self.journal.record_state(url, 'completed', bytes_done=download_info['size'], size=download_info['size'])
+        if self.metrics is not None:
+            host = self.host_label(url)
+            self.metrics.inc('downloads_completed_total', host=host, source=source)
+            self.metrics.inc('download_bytes_total', downloaded_bytes, host=host, source=source)
+            self.metrics.observe('download_seconds', download_info['time'], host=host)
+            self.metrics.event('completed', url=url, size=download_info['size'], seconds=round(download_info['time'], 3),
+                               source=source)
+        self.job_finished()
+        return download_info
+
+    def record_failed(self, url, filename, error):
+        error_info = {
+            'status': 'failed', 'filename': filename, 'url': url, 'error': self.format_error(error)
+        }
+        self.active_downloads.pop(url, None)
+        self.failed_downloads.append(error_info)
+        self.concurrency.observe_error(url, error)
+        if self.journal is not None:
+            self.journal.record_state(url, 'failed', error=error_info['error'])
+        if self.metrics is not None:
+            self.metrics.inc('downloads_failed_total', host=self.host_label(url))
+            self.metrics.event('failed', url=url, error=error_info['error'])
+        self.job_finished()
+        return error_info
+
+    def record_stopped(self, url, filename):
+        self.active_downloads.pop(url, None)
+        self.retry_attempts.pop(url, None)
+        if self.journal is not None:
+            self.journal.record_state(url, 'stopped')
+        return {'status': 'stopped', 'filename': filename, 'url': url}
+
+    def record_exists(self, url, filename):
+        if self.journal is not None:
+            self.journal.record_state(url, 'completed')
+        self.job_finished()
+        return {'status': 'exists', 'filename': filename, 'url': url}
+
+    def record_validators(self, url, state):
+        if self.journal is not None:
+            self.journal.record_state(url, 'active', etag=state.data['etag'], last_modified=state.data['last_modified'])
+
+    def start_downloads(self):
+        self.stop_flag = False
+        self.pause_flag = False
+        self.submit_queued()
+
+    def submit_queued(self):
+        """Hands everything in the queue to the engine without touching the pause/stop state."""
+        self.feed_jobs()
+        if self.scheduling_policy == 'shortest':
+            self.probe_sizes([url for url, _, _ in list(self.download_queue.queue)])
+        jobs = []
+        while not self.download_queue.empty() and not self.stop_flag:
+            url, filename, save_path = self.download_queue.get()
+            jobs.append((url, self.queued_renames.pop(url, filename), save_path))
+        self.engine.submit_many(jobs)
+
+    def pause_downloads(self):
+        self.pause_flag = True
+
+    def resume_downloads(self):
+        self.pause_flag = False
+
+    def stop_all_downloads(self):
+        self.stop_flag = True
+        self.pause_flag = False
+        self.engine.stop()
+        # Jobs not taken from a source yet were never queued, so they are simply dropped.
+        self.job_sources.clear()
+        self.queued_at.clear()
+        for url, filename, _ in self.retry_queue.clear():
+            self.record_stopped(url, filename)
+
+    def job_finished(self):
+        """Called after every finished job; tops the queue up from the job sources."""
+        if self.job_sources and not self.stop_flag and self.feed_jobs():
+            self.submit_queued()
+
+    def has_pending_work(self):
+        return (bool(self.active_downloads) or not self.download_queue.empty() or self.engine.busy()
+                or len(self.retry_queue) > 0 or bool(self.job_sources))
+
+    @staticmethod
+    def get_filename_from_url(url):
+        path, _ = ExtensionResolver.split_url(url)
+        # As urlparse does, ';parameters' on the last segment are not part of the name.
+        head, slash, segment = path.rpartition('/')
+        filename = os.path.basename(unquote(head + slash + segment.partition(';')[0]))
+        if not filename:
+            filename = f"downloaded_file_{int(time.time())}"
+        return filename
+
+    def default_filename(self, url):
+        filename = self.get_filename_from_url(url)
+        ext = self.get_proper_extension(url, check_online=False)
+        if not filename.lower().endswith(ext) and '.' not in filename:
+            filename += ext
+        return filename
+
+    @staticmethod
+    def get_base_name_from_url(url):
+        filename = DownloadManager.get_filename_from_url(url)
+        filename = filename.split('?')[0].split('#')[0]
+        return os.path.splitext(filename)[0]
+
+    @staticmethod
+    def format_size(size_bytes):
+        if size_bytes == 0: return "0B"
+        size_name = ("B", "KB", "MB", "GB")
+        i = int(math.floor(math.log(size_bytes, 1024)))
+        p = math.pow(1024, i)
+        s = round(size_bytes / p, 1)
+        return f"{s}{size_name[i]}"
+
+    @staticmethod
+    def format_speed(speed_bytes):
+        return f"{DownloadManager.format_size(speed_bytes)}/s"
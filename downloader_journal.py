@@ -0,0 +1,195 @@
+import os
+import time
+import sqlite3
+from threading import Thread, Lock, Event
+
+class JobJournal:
+    """
+    Durable record of every job's state (queued, active, retrying, stopped, failed, completed),
+    assigned filename, save path, mirrors, bytes done and validators, kept in SQLite so the queue
+    survives crashes and restarts.
+
+    Writers never touch the database directly: updates are merged per URL in memory and a
+    background thread commits them in one transaction every flush_interval seconds, so
+    journaling costs a dict assignment on the download path.
+    """
+    RECOVERABLE_STATES = ('queued', 'active', 'retrying', 'stopped')
+
+    def __init__(self, path, flush_interval=0.5):
+        self.path = path
+        self.flush_interval = flush_interval
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.db_lock = Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                url TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                save_path TEXT NOT NULL,
+                state TEXT NOT NULL,
+                bytes_done INTEGER NOT NULL DEFAULT 0,
+                size INTEGER NOT NULL DEFAULT 0,
+                etag TEXT,
+                last_modified TEXT,
+                error TEXT,
+                mirrors TEXT,
+                seq INTEGER NOT NULL,
+                updated REAL NOT NULL
+            )""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_state_seq ON jobs (state, seq)")
+        # Journals from before mirror support lack the column that lists a job's mirrors.
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(jobs)")]
+        if 'mirrors' not in columns:
+            self.db.execute("ALTER TABLE jobs ADD COLUMN mirrors TEXT")
+        self.db.commit()
+        self.next_seq = (self.db.execute("SELECT MAX(seq) FROM jobs").fetchone()[0] or 0) + 1
+
+        self.pending_lock = Lock()
+        self.new_jobs = {}
+        self.updates = {}
+        self.removals = set()
+        self.closed = Event()
+        self.flusher = Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
+
+    @staticmethod
+    def default_path():
+        return os.path.join(os.path.expanduser("~"), ".advanced_downloader", "jobs.sqlite3")
+
+    def record_queued(self, jobs):
+        """Adds or re-queues (url, filename, save_path) jobs, keeping their order."""
+        with self.pending_lock:
+            for url, filename, save_path in jobs:
+                self.removals.discard(url)
+                self.updates.pop(url, None)
+                self.new_jobs[url] = (filename, save_path, self.next_seq)
+                self.next_seq += 1
+
+    def record_state(self, url, state, **fields):
+        with self.pending_lock:
+            update = self.updates.setdefault(url, {})
+            update['state'] = state
+            update.update(fields)
+
+    def record_progress(self, url, bytes_done, size):
+        with self.pending_lock:
+            update = self.updates.setdefault(url, {})
+            update['bytes_done'] = bytes_done
+            update['size'] = size
+
+    def record_filename(self, url, filename):
+        with self.pending_lock:
+            if url in self.new_jobs:
+                _, save_path, seq = self.new_jobs[url]
+                self.new_jobs[url] = (filename, save_path, seq)
+            else:
+                self.updates.setdefault(url, {})['filename'] = filename
+
+    def record_mirrors(self, url, mirrors):
+        with self.pending_lock:
+            self.updates.setdefault(url, {})['mirrors'] = "\n".join(mirrors) or None
+
+    def remove(self, urls):
+        with self.pending_lock:
+            for url in urls:
+                self.new_jobs.pop(url, None)
+                self.updates.pop(url, None)
+                self.removals.add(url)
+
+    def clear(self):
+        with self.pending_lock:
+            self.new_jobs.clear()
+            self.updates.clear()
+            self.removals.clear()
+        with self.db_lock:
+            self.db.execute("DELETE FROM jobs")
+            self.db.commit()
+
+    def load_pending(self):
+        """Returns unfinished jobs in queue order as dicts, for re-queueing on startup."""
+        self.flush()
+        placeholders = ",".join("?" * len(self.RECOVERABLE_STATES))
+        with self.db_lock:
+            rows = self.db.execute(
+                f"SELECT url, filename, save_path, state, bytes_done, size, mirrors FROM jobs "
+                f"WHERE state IN ({placeholders}) ORDER BY seq", self.RECOVERABLE_STATES).fetchall()
+        return [
+            {'url': url, 'filename': filename, 'save_path': save_path, 'state': state, 'bytes_done': bytes_done,
+             'size': size, 'mirrors': mirrors.split("\n") if mirrors else []}
+            for url, filename, save_path, state, bytes_done, size, mirrors in rows
+        ]
+
+    def prune_completed(self):
+        """Deletes finished jobs, which are never recovered; done on close so the table stays small."""
+        self.flush()
+        with self.db_lock:
+            self.db.execute("DELETE FROM jobs WHERE state = 'completed'")
+            self.db.commit()
+
+    def flush(self):
+        with self.pending_lock:
+            new_jobs, self.new_jobs = self.new_jobs, {}
+            updates, self.updates = self.updates, {}
+            removals, self.removals = self.removals, set()
+        if not (new_jobs or updates or removals):
+            return
+
+        try:
+            self._write(new_jobs, updates, removals)
+        except sqlite3.Error:
+            # Put the batch back so the next flush retries it; anything recorded meanwhile is newer.
+            with self.pending_lock:
+                self._merge_pending(new_jobs, updates, removals)
+            raise
+
+    def _merge_pending(self, new_jobs, updates, removals):
+        # Jobs re-queued or removed since the batch was taken start over; their old updates are dropped.
+        requeued = set(self.new_jobs)
+        for url in removals:
+            if url not in requeued:
+                self.removals.add(url)
+        for url, job in new_jobs.items():
+            if url not in requeued and url not in self.removals:
+                self.new_jobs[url] = job
+        for url, fields in updates.items():
+            if url not in requeued and url not in self.removals:
+                self.updates[url] = dict(fields, **self.updates.get(url, {}))
+
+    def _write(self, new_jobs, updates, removals):
+        now = time.time()
+        with self.db_lock:
+            with self.db:
+                if removals:
+                    self.db.executemany("DELETE FROM jobs WHERE url = ?", [(url,) for url in removals])
+                if new_jobs:
+                    self.db.executemany(
+                        "INSERT INTO jobs (url, filename, save_path, state, bytes_done, size, seq, updated) "
+                        "VALUES (?, ?, ?, 'queued', 0, 0, ?, ?) "
+                        "ON CONFLICT(url) DO UPDATE SET filename = excluded.filename, save_path = excluded.save_path, "
+                        "state = 'queued', error = NULL, seq = excluded.seq, updated = excluded.updated",
+                        [(url, filename, save_path, seq, now) for url, (filename, save_path, seq) in new_jobs.items()])
+                for url, fields in updates.items():
+                    columns = ", ".join(f"{name} = ?" for name in fields)
+                    self.db.execute(f"UPDATE jobs SET {columns}, updated = ? WHERE url = ?",
+                                    list(fields.values()) + [now, url])
+
+    def _flush_loop(self):
+        while not self.closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"Error writing job journal: {e}")
+
+    def close(self):
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        self.flusher.join(timeout=5)
+        self.prune_completed()
+        with self.db_lock:
+            self.db.close()
@@ -0,0 +1,267 @@
+"""
+Metrics and tracing for the download pipeline. A MetricsRegistry handed to DownloadManager
+(metrics=...) is fed by hooks along the download path: per-phase timings (connection setup,
+broken down into dns, connect and tls where the engine opens sockets itself, then ttfb,
+transfer and fsync) per host, retries, queue wait times and completions. Exporters publish
+it as Prometheus text over HTTP or as JSON lines in a file; without a registry the hooks are
+skipped entirely.
+"""
+import json
+import time
+import bisect
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock, Event
+
+class MetricsRegistry:
+    """
+    Counters and histograms keyed by metric name and label values. Collectors added with
+    add_collector() are called only when the registry is exported, so numbers that are kept
+    elsewhere anyway (write statistics, queue depth, current throughput) cost nothing in between.
+    Trace listeners receive every event() as a dict, for per-download timelines.
+
+    A sample is (name, kind, labels, value), where kind is 'counter', 'gauge' or 'histogram'
+    and a histogram's value is (bucket bounds, counts per bucket plus the overflow, sum, count).
+    """
+    # Seconds; spans DNS lookups on a LAN up to multi-minute transfers.
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+    HELP = {
+        'download_phase_seconds': "Time spent per download phase (setup, dns, connect, tls, ttfb, transfer, fsync)",
+        'download_queue_wait_seconds': "Time from being queued to starting",
+        'download_seconds': "Duration of completed downloads",
+        'download_bytes_total': "Bytes received by completed downloads",
+        'downloads_completed_total': "Completed downloads",
+        'downloads_failed_total': "Downloads that failed for good",
+        'download_retries_total': "Retries scheduled, by error class",
+    }
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(buckets or self.DEFAULT_BUCKETS)
+        self.lock = Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.help = dict(self.HELP)
+        self.collectors = []
+        self.listeners = []
+        self.exporters = []
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][bisect.bisect_left(self.buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def phase(self, phase, seconds, host, url=None):
+        """Records how long one phase of a request to host took."""
+        self.observe('download_phase_seconds', seconds, phase=phase, host=host)
+        if self.listeners:
+            self.event('phase', phase=phase, host=host, url=url, seconds=round(seconds, 6))
+
+    def event(self, event, **fields):
+        """Passes a trace event to the listeners. Costs one check when nobody listens."""
+        if not self.listeners:
+            return
+        fields['event'] = event
+        fields['time'] = round(time.time(), 6)
+        for listener in list(self.listeners):
+            listener(fields)
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def add_collector(self, collect):
+        """collect() returns samples to include whenever the registry is read."""
+        self.collectors.append(collect)
+
+    def remove_collector(self, collect):
+        if collect in self.collectors:
+            self.collectors.remove(collect)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def add_exporter(self, exporter):
+        """Starts an exporter; close() stops it again."""
+        exporter.start()
+        self.exporters.append(exporter)
+        return exporter
+
+    def close(self):
+        while self.exporters:
+            self.exporters.pop().close()
+
+    def samples(self):
+        with self.lock:
+            samples = [(name, 'counter', dict(labels), value) for (name, labels), value in self.counters.items()]
+            samples += [(name, 'histogram', dict(labels), (self.buckets, list(counts), total, count))
+                        for (name, labels), (counts, total, count) in self.histograms.items()]
+        for collect in list(self.collectors):
+            samples.extend(collect())
+        return samples
+
+    def snapshot(self):
+        """The registry as a JSON-friendly dict: one entry per sample, histograms with cumulative buckets."""
+        metrics = []
+        for name, kind, labels, value in self.samples():
+            entry = {'name': name, 'kind': kind, 'labels': labels}
+            if kind == 'histogram':
+                bounds, counts, total, count = value
+                entry.update(buckets=dict(zip([str(bound) for bound in bounds] + ['+Inf'], self._cumulative(counts))),
+                             sum=round(total, 6), count=count)
+            else:
+                entry['value'] = value
+            metrics.append(entry)
+        return {'time': round(time.time(), 3), 'metrics': metrics}
+
+    def render_prometheus(self):
+        """The registry in the Prometheus text exposition format (version 0.0.4)."""
+        families = {}
+        for name, kind, labels, value in self.samples():
+            families.setdefault(name, (kind, []))[1].append((labels, value))
+        lines = []
+        for name in sorted(families):
+            kind, entries = families[name]
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in entries:
+                if kind != 'histogram':
+                    lines.append(f"{name}{self._labels(labels)} {self._number(value)}")
+                    continue
+                bounds, counts, total, count = value
+                for bound, cumulative in zip(list(bounds) + ['+Inf'], self._cumulative(counts)):
+                    le = bound if bound == '+Inf' else self._number(bound)
+                    lines.append(f"{name}_bucket{self._labels(dict(labels, le=le))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {self._number(total)}")
+                lines.append(f"{name}_count{self._labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _cumulative(counts):
+        running = 0
+        totals = []
+        for count in counts:
+            running += count
+            totals.append(running)
+        return totals
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                   for value in labels.values())
+        return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+    @staticmethod
+    def _number(value):
+        return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsExporter:
+    """Interface for exporters added with MetricsRegistry.add_exporter."""
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+class PrometheusRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class PrometheusExporter(MetricsExporter):
+    """Serves the registry at http://address/metrics for a Prometheus scraper, from a daemon thread."""
+    def __init__(self, registry, address='127.0.0.1:9464'):
+        self.registry = registry
+        host, _, port = address.rpartition(':')
+        self.bind = (host or '127.0.0.1', int(port))
+        self.server = None
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        self.server = ThreadingHTTPServer(self.bind, PrometheusRequestHandler)
+        self.server.daemon_threads = True
+        self.server.registry = self.registry
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+class JsonLinesExporter(MetricsExporter):
+    """
+    Appends a snapshot of the registry to a file as one JSON line every interval seconds and
+    on close. With trace set, every trace event is written as its own line as it happens.
+    """
+    def __init__(self, registry, path, interval=10.0, trace=False):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.trace = trace
+        self.lock = Lock()
+        self.stopped = Event()
+        self.stream = None
+        self.thread = None
+
+    def start(self):
+        self.stream = open(self.path, 'a', encoding='utf-8')
+        if self.trace:
+            self.registry.add_listener(self.write)
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, record):
+        line = json.dumps(record)
+        with self.lock:
+            if self.stream is not None:
+                self.stream.write(line + '\n')
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.write(dict(self.registry.snapshot(), event='metrics'))
+            with self.lock:
+                self.stream.flush()
+
+    def close(self):
+        if self.stream is None:
+            return
+        self.registry.remove_listener(self.write)
+        self.stopped.set()
+        self.thread.join()
+        self.write(dict(self.registry.snapshot(), event='metrics'))
+        with self.lock:
+            self.stream.close()
+            self.stream = None
@@ -1,14 +1,17 @@
 import os
-import requests
 import time
-import math
-from concurrent.futures import ThreadPoolExecutor
-from urllib.parse import urlparse, unquote
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext, Menu
-from threading import Thread
-from queue import Queue
+from threading import Thread, Event
 from tkinter.font import Font
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+
+import sqlite3
+
+from downloader_core import DownloadManager, ThreadedEngine, AsyncioEngine, UrlTemplate, FilenamePlan
+from downloader_journal import JobJournal
+from downloader_cache import DownloadCache
 
 class CustomTheme:
     @staticmethod
@@ -201,7 +204,8 @@ class CustomFilenameDialog(tk.Toplevel):
 
 class BatchUrlGeneratorDialog(tk.Toplevel):
     """
-    Dialog window to generate batch URLs from a pattern.
+    Dialog window to generate batch URLs from a pattern. The result is a lazy UrlTemplate,
+    so huge series are never expanded here.
     """
     def __init__(self, parent, fonts, colors):
         super().__init__(parent)
@@ -218,7 +222,7 @@ class BatchUrlGeneratorDialog(tk.Toplevel):
         parent.update_idletasks()
         x = parent.winfo_x() + (parent.winfo_width() // 2) - (400 // 2)
         y = parent.winfo_y() + (parent.winfo_height() // 2) - (300 // 2)
-        self.geometry(f"400x250+{x}+{y}")
+        self.geometry(f"400x290+{x}+{y}")
 
         self.create_widgets()
         self.protocol("WM_DELETE_WINDOW", self.cancel)
@@ -232,7 +236,8 @@ class BatchUrlGeneratorDialog(tk.Toplevel):
         # Clarified the instructions for zero-padding.
         ttk.Label(main_frame, text="URL Template (use ## for 01, ### for 001, etc.):", font=self.fonts['default']).pack(anchor='w', pady=(5, 2))
         # ---- End of modified code ----
-        
+        ttk.Label(main_frame, text="More ranges: s{1-3}e{01-24}, every 5th: {0-100:5}", font=self.fonts['default']).pack(anchor='w', pady=(0, 2))
+
         self.url_template_var = tk.StringVar(value="")
         self.url_entry = ttk.Entry(main_frame, textvariable=self.url_template_var, font=self.fonts['default'])
         self.url_entry.pack(fill=tk.X, expand=True, pady=(0, 10))
@@ -249,7 +254,12 @@ class BatchUrlGeneratorDialog(tk.Toplevel):
         ttk.Label(range_frame, text="To:", font=self.fonts['default']).pack(side=tk.LEFT, padx=(0, 5))
         self.end_var = tk.StringVar(value="10")
         end_entry = ttk.Entry(range_frame, textvariable=self.end_var, font=self.fonts['default'], width=8)
-        end_entry.pack(side=tk.LEFT)
+        end_entry.pack(side=tk.LEFT, padx=(0, 20))
+
+        ttk.Label(range_frame, text="Step:", font=self.fonts['default']).pack(side=tk.LEFT, padx=(0, 5))
+        self.step_var = tk.StringVar(value="1")
+        step_entry = ttk.Entry(range_frame, textvariable=self.step_var, font=self.fonts['default'], width=5)
+        step_entry.pack(side=tk.LEFT)
 
         button_frame = ttk.Frame(main_frame, style='TFrame')
         button_frame.pack(pady=20)
@@ -264,242 +274,481 @@ class BatchUrlGeneratorDialog(tk.Toplevel):
         template = self.url_template_var.get().strip()
         start_str = self.start_var.get().strip()
         end_str = self.end_var.get().strip()
-
-        if '#' not in template:
-            messagebox.showerror("Error", "URL template must contain at least one '#' character.", parent=self)
-            return
+        step_str = self.step_var.get().strip() or "1"
 
         try:
-            start_num = int(start_str)
-            end_num = int(end_str)
+            start_num = int(start_str) if '#' in template else None
+            end_num = int(end_str) if '#' in template else None
+            step = int(step_str)
         except ValueError:
-            messagebox.showerror("Error", "Start and end numbers must be integers.", parent=self)
+            messagebox.showerror("Error", "Start, end and step must be integers.", parent=self)
             return
 
-        if start_num > end_num:
-            messagebox.showerror("Error", "Start number cannot be greater than the end number.", parent=self)
+        try:
+            self.result = UrlTemplate(template, start_num, end_num, step)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e), parent=self)
             return
-
-        # This logic correctly handles padding based on the number of '#' characters.
-        placeholder = '#' * template.count('#')
-        padding = len(placeholder)
-        generated_urls = []
-
-        for i in range(start_num, end_num + 1):
-            num_str = str(i).zfill(padding)
-            generated_urls.append(template.replace(placeholder, num_str))
-
-        self.result = generated_urls
         self.destroy()
 
     def cancel(self):
         self.result = None
         self.destroy()
 
-class DownloadManager:
-    def __init__(self):
-        self.download_queue = Queue()
-        self.active_downloads = {}
-        self.completed_downloads = []
-        self.failed_downloads = []
-        self.stop_flag = False
-        self.pause_flag = False
-        self.custom_filenames = {}
-        self.batch_filename_prefix = None
-        # Downloads are now sequential (one by one) to prevent server errors.
-        self.executor = ThreadPoolExecutor(max_workers=1)
-
-    def set_custom_filename(self, url, filename):
-        self.custom_filenames[url] = filename
-
-    def set_batch_filename_prefix(self, prefix):
-        self.batch_filename_prefix = prefix
-
-    def add_to_queue(self, urls_with_assigned_filenames_and_paths):
-        for url, assigned_filename, save_path in urls_with_assigned_filenames_and_paths:
-            self.download_queue.put((url, assigned_filename, save_path))
-
-    def get_proper_extension(self, url, check_online=False):
-        parsed_url = urlparse(url)
-        path = parsed_url.path
-
-        _, ext_from_path = os.path.splitext(path)
-        if ext_from_path and len(ext_from_path) <= 5 and '.' in ext_from_path:
-            return ext_from_path.lower()
-
-        url_lower = url.lower()
-
-        if 'mp4' in url_lower and not 'mp4.' in url_lower: return '.mp4'
-        if 'avi' in url_lower and not 'avi.' in url_lower: return '.avi'
-        if 'mov' in url_lower and not 'mov.' in url_lower: return '.mov'
-        if 'mkv' in url_lower and not 'mkv.' in url_lower: return '.mkv'
-        if 'webm' in url_lower and not 'webm.' in url_lower: return '.webm'
-        if 'mp3' in url_lower and not 'mp3.' in url_lower: return '.mp3'
-        if 'srt' in url_lower and not 'srt.' in url_lower: return '.srt'
-        if 'sub' in url_lower and not 'sub.' in url_lower: return '.sub'
-        if 'vtt' in url_lower and not 'vtt.' in url_lower: return '.vtt'
-        if 'pdf' in url_lower and not 'pdf.' in url_lower: return '.pdf'
-        if 'zip' in url_lower and not 'zip.' in url_lower: return '.zip'
-        if 'jpg' in url_lower or 'jpeg' in url_lower: return '.jpg'
-        if 'png' in url_lower and not 'png.' in url_lower: return '.png'
-        if 'gif' in url_lower and not 'gif.' in url_lower: return '.gif'
-
-        if check_online:
-            try:
-                response = requests.head(url, allow_redirects=True, timeout=3)
-                response.raise_for_status()
-                content_type = response.headers.get('Content-Type', '').lower()
-
-                if 'video/mp4' in content_type: return '.mp4'
-                elif 'video/webm' in content_type: return '.webm'
-                elif 'video/' in content_type: return '.mp4'
-                elif 'audio/mpeg' in content_type: return '.mp3'
-                elif 'audio/' in content_type: return '.mp3'
-                elif 'text/vtt' in content_type: return '.vtt'
-                elif 'application/x-subrip' in content_type or 'text/srt' in content_type: return '.srt'
-                elif 'image/jpeg' in content_type: return '.jpg'
-                elif 'image/png' in content_type: return '.png'
-                elif 'image/gif' in content_type: return '.gif'
-                elif 'application/pdf' in content_type: return '.pdf'
-                elif 'application/zip' in content_type or 'application/x-zip-compressed' in content_type: return '.zip'
-                elif 'application/json' in content_type: return '.json'
-                elif 'text/html' in content_type: return '.html'
-                elif 'text/csv' in content_type: return '.csv'
-
-            except requests.exceptions.RequestException:
-                pass
-
-        return '.bin'
-
-    def download_file(self, url, filename, save_path):
-        filepath = ""
-        try:
-            filepath = os.path.join(save_path, filename)
+class BandwidthLimitDialog(tk.Toplevel):
+    """
+    Dialog window to set the global, per-host and per-download rate limits in KB/s.
+    An empty field or 0 means unlimited.
+    """
+    def __init__(self, parent, limits, selected_count, fonts, colors):
+        super().__init__(parent)
+        self.transient(parent)
+        self.grab_set()
+        self.title("Bandwidth Limits")
+        self.parent = parent
+        self.result = None
+        self.fonts = fonts
+        self.colors = colors
 
-            if os.path.exists(filepath):
-                return {'status': 'exists', 'filename': filename, 'url': url}
+        self.configure(bg=self.colors['bg_color'], padx=10, pady=10)
 
-            self.active_downloads[url] = {'progress': 0, 'speed': 0, 'size': 0, 'filename': filename, 'downloaded_bytes': 0}
+        parent.update_idletasks()
+        x = parent.winfo_x() + (parent.winfo_width() // 2) - (400 // 2)
+        y = parent.winfo_y() + (parent.winfo_height() // 2) - (250 // 2)
+        self.geometry(f"+{x}+{y}")
 
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
+        self.create_widgets(limits, selected_count)
+        self.protocol("WM_DELETE_WINDOW", self.cancel)
+        self.wait_window(self)
 
-            start_time = time.time()
+    @staticmethod
+    def to_kb(rate):
+        return str(rate // 1024) if rate else ""
 
-            with requests.get(url, stream=True, headers=headers) as r:
-                r.raise_for_status()
-                total_size = int(r.headers.get('content-length', 0))
-                self.active_downloads[url]['size'] = total_size
+    def create_widgets(self, limits, selected_count):
+        main_frame = ttk.Frame(self, style='TFrame')
+        main_frame.pack(fill=tk.BOTH, expand=True)
 
-                downloaded_bytes = 0
-                self.active_downloads[url]['downloaded_bytes'] = downloaded_bytes
+        self.global_var = tk.StringVar(value=self.to_kb(limits['global']))
+        self.host_var = tk.StringVar(value=self.to_kb(limits['host']))
+        self.selected_var = tk.StringVar(value="")
+        fields = [("All downloads (KB/s):", self.global_var),
+                  ("Each server (KB/s):", self.host_var),
+                  (f"Selected downloads, {selected_count} (KB/s):", self.selected_var)]
 
-                with open(filepath, 'wb') as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        if self.stop_flag:
-                            if os.path.exists(filepath): os.remove(filepath)
-                            return {'status': 'stopped', 'filename': filename, 'url': url}
-                        if self.pause_flag:
-                            while self.pause_flag and not self.stop_flag:
-                                time.sleep(0.1)
-                            if self.stop_flag:
-                                if os.path.exists(filepath): os.remove(filepath)
-                                return {'status': 'stopped', 'filename': filename, 'url': url}
+        for row, (label, variable) in enumerate(fields):
+            ttk.Label(main_frame, text=label, font=self.fonts['default']).grid(row=row, column=0, sticky='w', pady=4)
+            entry = ttk.Entry(main_frame, textvariable=variable, font=self.fonts['default'], width=12)
+            entry.grid(row=row, column=1, sticky='w', padx=(10, 0), pady=4)
+            entry.bind("<Return>", lambda event: self.ok())
+            if row == 2 and not selected_count:
+                entry.config(state=tk.DISABLED)
 
-                        if chunk:
-                            f.write(chunk)
+        ttk.Label(main_frame, text="Leave empty or 0 for no limit.", font=self.fonts['default']).grid(
+            row=len(fields), column=0, columnspan=2, sticky='w', pady=(5, 0))
 
-                            downloaded_bytes = f.tell()
-                            elapsed_time = time.time() - start_time
-                            download_speed = downloaded_bytes / (elapsed_time + 0.0001) if elapsed_time > 0 else 0
-                            progress = (downloaded_bytes / total_size) * 100 if total_size > 0 else 0
+        button_frame = ttk.Frame(main_frame, style='TFrame')
+        button_frame.grid(row=len(fields) + 1, column=0, columnspan=2, pady=(15, 0))
 
-                            self.active_downloads[url]['progress'] = progress
-                            self.active_downloads[url]['speed'] = download_speed
-                            self.active_downloads[url]['downloaded_bytes'] = downloaded_bytes
+        ok_button = ttk.Button(button_frame, text="Apply", command=self.ok, width=10)
+        ok_button.pack(side=tk.LEFT, padx=5)
 
-            download_info = {
-                'status': 'completed', 'filename': filename, 'url': url,
-                'size': total_size, 'time': time.time() - start_time
-            }
-            self.completed_downloads.append(download_info)
-            self.active_downloads.pop(url, None)
+        cancel_button = ttk.Button(button_frame, text="Cancel", command=self.cancel, width=10)
+        cancel_button.pack(side=tk.LEFT, padx=5)
 
-            if download_info['size'] == 0:
-                download_info['size'] = downloaded_bytes
+    def ok(self):
+        rates = {}
+        for key, variable in (('global', self.global_var), ('host', self.host_var), ('selected', self.selected_var)):
+            text = variable.get().strip()
+            try:
+                kilobytes = float(text) if text else 0
+            except ValueError:
+                messagebox.showerror("Error", "Limits must be numbers in KB/s.", parent=self)
+                return
+            if kilobytes < 0:
+                messagebox.showerror("Error", "Limits cannot be negative.", parent=self)
+                return
+            rates[key] = int(kilobytes * 1024) or None
+        # An untouched selection field leaves the selected downloads' limits alone.
+        if not self.selected_var.get().strip():
+            rates.pop('selected')
+        self.result = rates
+        self.destroy()
 
-            return download_info
+    def cancel(self):
+        self.result = None
+        self.destroy()
 
-        except Exception as e:
-            error_message = str(e)
-            if isinstance(e, requests.exceptions.HTTPError):
-                if e.response.status_code == 404:
-                    error_message = "File not found on server (404)"
-                elif e.response.status_code == 403:
-                    error_message = "Access Forbidden (403)"
-                else:
-                    error_message = f"Server Error ({e.response.status_code})"
-            
-            error_info = {
-                'status': 'failed', 'filename': filename, 'url': url, 'error': error_message
-            }
-            
-            self.failed_downloads.append(error_info)
-            self.active_downloads.pop(url, None)
-            if os.path.exists(filepath):
-                try:
-                    os.remove(filepath)
-                except OSError:
-                    pass
-            return error_info
+class TaskCancelled(Exception):
+    """Raised inside a background job by BackgroundTask.check() once the task was cancelled."""
+
+class BackgroundTask:
+    """A job queued on BackgroundTasks. The worker reports progress on it and calls check() between steps."""
+    def __init__(self, label, work, on_done, on_error):
+        self.label = label
+        self.work = work
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cancelled = Event()
+        self.started = None
+        self.done = 0
+        self.total = 0
+
+    def report(self, done, total):
+        self.done = done
+        self.total = total
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise TaskCancelled()
 
-    def start_downloads(self):
-        self.stop_flag = False
-        self.pause_flag = False
-        while not self.download_queue.empty() and not self.stop_flag:
-            url, assigned_filename, save_path = self.download_queue.get()
-            self.executor.submit(self.download_file, url, assigned_filename, save_path)
+    def cancel(self):
+        self.cancelled.set()
 
-    def pause_downloads(self):
-        self.pause_flag = True
+class BackgroundTasks:
+    """
+    Runs blocking GUI work (probes, parsing, disk access, shutdowns) on one worker thread so
+    the Tk thread never waits on it. Jobs run one at a time in submission order, so a job
+    always sees the effects of the ones queued before it. Results are handed back through a
+    deque drained by a root.after poll, so the on_done/on_error callbacks run on the Tk thread.
+    A job running longer than SHOW_PROGRESS_AFTER seconds is passed to on_progress (None once
+    nothing is running) so the window can show a progress bar with a Cancel button. A cancelled
+    job that stops at check() has its callbacks dropped; one that finished anyway delivers them.
+    """
+    POLL_INTERVAL = 30
+    SHOW_PROGRESS_AFTER = 0.3
 
-    def resume_downloads(self):
-        self.pause_flag = False
+    def __init__(self, root, on_progress=None):
+        self.root = root
+        self.on_progress = on_progress
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='gui-task')
+        self.pending = []
+        self.results = deque()
+        self.idle_callbacks = []
+        self.poll_scheduled = False
+
+    def submit(self, label, work, on_done=None, on_error=None):
+        """Queues work(task) and returns the task; on_done(result) or on_error(exception) follow on the Tk thread."""
+        task = BackgroundTask(label, work, on_done, on_error)
+        self.pending.append(task)
+        self.executor.submit(self._run, task)
+        self._schedule_poll()
+        return task
+
+    def running(self, label=None):
+        return any(label is None or task.label == label for task in self.pending)
+
+    def cancel(self, label=None):
+        """Cancels the pending tasks with label (or all of them)."""
+        for task in self.pending:
+            if label is None or task.label == label:
+                task.cancel()
+
+    def when_idle(self, callback):
+        """Calls callback on the Tk thread once every queued task has finished."""
+        if self.pending:
+            self.idle_callbacks.append(callback)
+        else:
+            callback()
 
-    def stop_all_downloads(self):
-        self.stop_flag = True
-        self.pause_flag = False
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False)
 
-    @staticmethod
-    def get_filename_from_url(url):
-        parsed = urlparse(url)
-        path = parsed.path
-        filename = os.path.basename(unquote(path))
-        if not filename:
-            filename = f"downloaded_file_{int(time.time())}"
-        return filename
+    def _run(self, task):
+        if task.cancelled.is_set():
+            self.results.append((task, None, TaskCancelled()))
+            return
+        task.started = time.monotonic()
+        try:
+            self.results.append((task, task.work(task), None))
+        except Exception as e:
+            self.results.append((task, None, e))
+
+    def _schedule_poll(self):
+        if not self.poll_scheduled:
+            self.poll_scheduled = True
+            self.root.after(self.POLL_INTERVAL, self._poll)
+
+    def _poll(self):
+        self.poll_scheduled = False
+        while self.results:
+            task, result, error = self.results.popleft()
+            self.pending.remove(task)
+            if isinstance(error, TaskCancelled):
+                continue
+            if error is None:
+                if task.on_done is not None:
+                    task.on_done(result)
+            elif task.on_error is not None:
+                task.on_error(error)
+            else:
+                messagebox.showerror("Error", f"{task.label.capitalize()} failed: {error}", parent=self.root)
 
-    @staticmethod
-    def get_base_name_from_url(url):
-        filename = DownloadManager.get_filename_from_url(url)
-        filename = filename.split('?')[0].split('#')[0]
-        return os.path.splitext(filename)[0]
+        current = self.pending[0] if self.pending else None
+        if current is not None and (current.started is None
+                                    or time.monotonic() - current.started < self.SHOW_PROGRESS_AFTER):
+            current = None
+        if self.on_progress is not None:
+            self.on_progress(current)
 
-    @staticmethod
-    def format_size(size_bytes):
-        if size_bytes == 0: return "0B"
-        size_name = ("B", "KB", "MB", "GB")
-        i = int(math.floor(math.log(size_bytes, 1024)))
-        p = math.pow(1024, i)
-        s = round(size_bytes / p, 1)
-        return f"{s}{size_name[i]}"
+        if self.pending:
+            self._schedule_poll()
+        else:
+            callbacks, self.idle_callbacks = self.idle_callbacks, []
+            for callback in callbacks:
+                callback()
 
-    @staticmethod
-    def format_speed(speed_bytes):
-        return f"{DownloadManager.format_size(speed_bytes)}/s"
+class DownloadListView:
+    """
+    Keeps the download rows in a URL-indexed model and pushes only changed rows to the
+    Treeview. Above VIRTUAL_THRESHOLD rows it switches to a virtualized mode in which the
+    Treeview holds just the visible window of rows and the scrollbar drives the model,
+    so the cost of a refresh no longer depends on the length of the list. Rows can be
+    dragged to a new position; on_reorder(order) is called with the new order of URLs.
+    """
+    VIRTUAL_THRESHOLD = 2000
+    DEFAULT_ROW_HEIGHT = 20
+
+    def __init__(self, tree, y_scroll, on_reorder=None):
+        self.tree = tree
+        self.y_scroll = y_scroll
+        self.on_reorder = on_reorder
+        self.drag_source = None
+        self.order = []
+        self.index = {}
+        self.values = {}
+        self.dirty = set()
+        self.virtual = False
+        self.first = 0
+        self.slots = []
+        self.slot_values = []
+
+        self.y_scroll.config(command=self.yview)
+        self.tree.bind('<Configure>', lambda event: self.virtual and self._render_window())
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.tree.bind(sequence, self._on_mouse_wheel)
+        self.tree.bind('<ButtonPress-1>', self._on_drag_start, add='+')
+        self.tree.bind('<B1-Motion>', self._on_drag_motion, add='+')
+        self.tree.bind('<ButtonRelease-1>', self._on_drag_end, add='+')
+
+    def __len__(self):
+        return len(self.order)
+
+    def has_row(self, url):
+        return url in self.index
+
+    def get_values(self, url):
+        return self.values.get(url)
+
+    def selected_urls(self):
+        selection = self.tree.selection()
+        if not self.virtual:
+            return list(selection)
+        return [self.order[self.first + self.slots.index(iid)] for iid in selection if iid in self.slots]
+
+    def url_at(self, y):
+        iid = self.tree.identify_row(y)
+        if not iid:
+            return None
+        if not self.virtual:
+            return iid
+        return self.order[self.first + self.slots.index(iid)] if iid in self.slots else None
+
+    def move_rows(self, urls, before=None):
+        """Moves urls, keeping their relative order, in front of the row before (or to the end)."""
+        moving = [url for url in self.order if url in set(urls)]
+        if not moving:
+            return
+        remaining = [url for url in self.order if url not in set(moving)]
+        position = remaining.index(before) if before in remaining else len(remaining)
+        self.order = remaining[:position] + moving + remaining[position:]
+        self.index = {url: position for position, url in enumerate(self.order)}
+        if self.virtual:
+            self._render_window()
+        else:
+            for position, url in enumerate(self.order):
+                self.tree.move(url, '', position)
+        if self.on_reorder is not None:
+            self.on_reorder(list(self.order))
+
+    def _on_drag_start(self, event):
+        self.drag_source = self.url_at(event.y)
+
+    def _on_drag_motion(self, event):
+        if self.drag_source is not None:
+            self.tree.configure(cursor='sb_v_double_arrow')
+
+    def _on_drag_end(self, event):
+        source, self.drag_source = self.drag_source, None
+        self.tree.configure(cursor='')
+        target = self.url_at(event.y)
+        if source is None or target is None or target == source:
+            return
+        selected = self.selected_urls()
+        urls = selected if source in selected else [source]
+        if target in urls:
+            return
+        # Dropping on a lower row puts the rows after it, on a higher row before it.
+        if self.index[target] > self.index[source]:
+            following = self.index[target] + 1
+            target = self.order[following] if following < len(self.order) else None
+        self.move_rows(urls, target)
+
+    def set_rows(self, rows):
+        """Replaces the model with rows of (url, values). Appending rows only touches the new ones."""
+        old_order = self.order
+        old_values = self.values
+        self.order = []
+        self.values = {}
+        for url, values in rows:
+            if url not in self.values:
+                self.order.append(url)
+                self.values[url] = tuple(values)
+        self.index = {url: position for position, url in enumerate(self.order)}
+
+        virtual = len(self.order) > self.VIRTUAL_THRESHOLD
+        if virtual != self.virtual or (not virtual and self.order[:len(old_order)] != old_order):
+            self._rebuild(virtual)
+            return
+
+        if not virtual:
+            for url in self.order[len(old_order):]:
+                self.tree.insert('', 'end', iid=url, values=self.values[url])
+            self.dirty.update(url for url in old_order if self.values[url] != old_values[url])
+        self.flush(force_window=True)
+
+    def append_rows(self, rows):
+        """Adds rows of (url, values) to the end in time proportional to the new rows only."""
+        start = len(self.order)
+        for url, values in rows:
+            if url not in self.index:
+                self.index[url] = len(self.order)
+                self.order.append(url)
+                self.values[url] = tuple(values)
+        if len(self.order) > self.VIRTUAL_THRESHOLD and not self.virtual:
+            self._rebuild(True)
+        elif self.virtual:
+            self._render_window()
+        else:
+            for url in self.order[start:]:
+                self.tree.insert('', 'end', iid=url, values=self.values[url])
+
+    def remove_rows(self, urls):
+        urls = {url for url in urls if url in self.index}
+        if not urls:
+            return
+        self.order = [url for url in self.order if url not in urls]
+        self.index = {url: position for position, url in enumerate(self.order)}
+        for url in urls:
+            del self.values[url]
+            self.dirty.discard(url)
+        if self.virtual and len(self.order) <= self.VIRTUAL_THRESHOLD:
+            self._rebuild(False)
+        elif self.virtual:
+            self._render_window()
+        else:
+            self.tree.delete(*urls)
+
+    def update_row(self, url, values):
+        values = tuple(values)
+        if url in self.index and self.values[url] != values:
+            self.values[url] = values
+            self.dirty.add(url)
+
+    def clear(self):
+        self.order = []
+        self.index = {}
+        self.values = {}
+        self._rebuild(False)
+
+    def flush(self, force_window=False):
+        """Pushes dirty rows to Tk. In virtualized mode rows outside the window are drawn later from the model."""
+        if self.virtual:
+            if self.dirty or force_window:
+                self._render_window()
+        else:
+            for url in self.dirty:
+                self.tree.item(url, values=self.values[url])
+        self.dirty.clear()
+
+    def yview(self, *args):
+        if not self.virtual:
+            return self.tree.yview(*args)
+
+        visible = self._visible_count()
+        first = self.first
+        if args and args[0] == 'moveto':
+            first = int(float(args[1]) * len(self.order))
+        elif args and args[0] == 'scroll':
+            step = visible if args[2].startswith('page') else 1
+            first += int(args[1]) * step
+        self.first = max(0, min(first, len(self.order) - visible))
+        self._render_window()
+
+    def _on_mouse_wheel(self, event):
+        if not self.virtual:
+            return None
+        if event.num == 4 or getattr(event, 'delta', 0) > 0:
+            self.yview('scroll', -3, 'units')
+        else:
+            self.yview('scroll', 3, 'units')
+        return 'break'
+
+    def _visible_count(self):
+        try:
+            row_height = int(ttk.Style().lookup('Treeview', 'rowheight') or self.DEFAULT_ROW_HEIGHT)
+        except (tk.TclError, ValueError):
+            row_height = self.DEFAULT_ROW_HEIGHT
+        # One row's worth of height goes to the heading.
+        rows = self.tree.winfo_height() // row_height - 1
+        return max(int(self.tree.cget('height')), rows)
+
+    def _render_window(self):
+        visible = self._visible_count()
+        count = min(visible, len(self.order))
+        self.first = max(0, min(self.first, len(self.order) - visible))
+
+        while len(self.slots) < count:
+            self.slots.append(self.tree.insert('', 'end', values=()))
+            self.slot_values.append(None)
+        while len(self.slots) > count:
+            self.tree.delete(self.slots.pop())
+            self.slot_values.pop()
+
+        for slot, iid in enumerate(self.slots):
+            values = self.values[self.order[self.first + slot]]
+            if self.slot_values[slot] != values:
+                self.tree.item(iid, values=values)
+                self.slot_values[slot] = values
+
+        if self.order:
+            self.y_scroll.set(self.first / len(self.order), (self.first + count) / len(self.order))
+        else:
+            self.y_scroll.set(0, 1)
+
+    def _rebuild(self, virtual):
+        children = self.tree.get_children()
+        if children:
+            self.tree.delete(*children)
+        self.slots = []
+        self.slot_values = []
+        self.dirty.clear()
+        self.first = 0
+        self.virtual = virtual
+
+        if virtual:
+            self.tree.configure(yscrollcommand='')
+            self._render_window()
+        else:
+            self.tree.configure(yscrollcommand=self.y_scroll.set)
+            for url in self.order:
+                self.tree.insert('', 'end', iid=url, values=self.values[url])
 
 class DownloaderApp:
+    # Series longer than this skip the URL box and are fed to the queue lazily.
+    TEMPLATE_TEXT_LIMIT = 500
+
     def __init__(self, root):
         self.root = root
         self.root.title("Advanced Download Manager")
@@ -554,14 +803,65 @@ class DownloaderApp:
         except Exception as e:
             print(f"Error applying theme: {e}")
 
-        self.download_manager = DownloadManager()
+        self.journal = self.open_journal()
+        self.cache = None
+        self.download_manager = DownloadManager(journal=self.journal)
+        # Planned names of every listed job, kept up to date incrementally.
+        self.plan = FilenamePlan(self.download_manager)
+        # URLs taken from the URL box but not committed with Add URLs yet, so deleting one
+        # from the box drops its row again. Only the task worker touches it.
+        self.staged_urls = {}
+        self.tasks = BackgroundTasks(root, on_progress=self.show_task_progress)
         self.create_widgets()
         
         self.create_menu()
+        self.recover_jobs()
         
         self.update_interval = 500
+        self.last_pause_state = False
         self.root.after(self.update_interval, self.update_download_status)
 
+    def open_journal(self):
+        try:
+            return JobJournal(JobJournal.default_path())
+        except (sqlite3.Error, OSError) as e:
+            print(f"Error opening job journal: {e}")
+            return None
+
+    def recover_jobs(self):
+        if self.journal is not None:
+            self.tasks.submit("recovering unfinished downloads", self.load_recovered_jobs, on_done=self.restore_jobs)
+
+    def load_recovered_jobs(self, task):
+        """Runs on the task worker: lists and queues the journal's unfinished jobs under their recorded names."""
+        manager = self.download_manager
+        jobs = self.journal.load_pending()
+        for job in jobs:
+            manager.set_mirrors(job['url'], job['mirrors'])
+        self.plan.set_names({job['url']: job['filename'] for job in jobs})
+        self.plan.add(job['url'] for job in jobs)
+        manager.add_to_queue([(job['url'], job['filename'], job['save_path']) for job in jobs])
+        return jobs
+
+    def restore_jobs(self, jobs):
+        if not jobs:
+            return
+
+        save_paths = {job['save_path'] for job in jobs}
+        if len(save_paths) == 1:
+            self.save_path_var.set(save_paths.pop())
+
+        self.download_list.append_rows((job['url'], (job['filename'], '', '0%', 'Ready')) for job in jobs)
+        self.status_var.set(f"Recovered {len(jobs)} unfinished downloads from the last session.")
+
+    def close(self):
+        self.tasks.shutdown()
+        self.download_manager.shutdown()
+        if self.journal is not None:
+            self.journal.close()
+        if self.cache is not None:
+            self.cache.close()
+
     def create_menu(self):
         self.menu_bar = Menu(self.root,
             bg=self.color_bg_color,
@@ -580,9 +880,218 @@ class DownloaderApp:
         self.menu_bar.add_cascade(label="Tools", menu=tools_menu)
         tools_menu.add_command(label="Generate Batch URLs", command=self.open_batch_url_generator)
 
+        engine_menu = Menu(tools_menu, tearoff=0,
+            bg=self.color_bg_color,
+            fg=self.color_text_color,
+            activebackground=self.color_hover_color,
+            activeforeground=self.color_text_color
+        )
+        tools_menu.add_command(label="Connection Statistics", command=self.show_connection_stats)
+        tools_menu.add_command(label="Bandwidth Limits", command=self.open_bandwidth_limits)
+        tools_menu.add_command(label="Load Checksums", command=self.load_checksums)
+        tools_menu.add_command(label="Load Metalink", command=self.load_metalink)
+        self.cache_var = tk.BooleanVar(value=self.download_manager.cache is not None)
+        tools_menu.add_checkbutton(label="Use Download Cache", variable=self.cache_var,
+                                   command=self.toggle_download_cache)
+        self.adaptive_var = tk.BooleanVar(value=self.download_manager.concurrency.enabled)
+        tools_menu.add_checkbutton(label="Adaptive Concurrency", variable=self.adaptive_var,
+                                   command=self.toggle_adaptive_concurrency)
+        tools_menu.add_cascade(label="Download Engine", menu=engine_menu)
+
+        queue_menu = Menu(self.menu_bar, tearoff=0,
+            bg=self.color_bg_color,
+            fg=self.color_text_color,
+            activebackground=self.color_hover_color,
+            activeforeground=self.color_text_color
+        )
+        self.menu_bar.add_cascade(label="Queue", menu=queue_menu)
+        queue_menu.add_command(label="Move to Top", command=lambda: self.move_selected(top=True))
+        queue_menu.add_command(label="Move to Bottom", command=lambda: self.move_selected(top=False))
+        queue_menu.add_separator()
+        for label, priority in (("High Priority", 'high'), ("Normal Priority", 'normal'), ("Low Priority", 'low')):
+            queue_menu.add_command(label=label, command=lambda priority=priority: self.set_selected_priority(priority))
+        queue_menu.add_separator()
+        self.policy_var = tk.StringVar(value=self.download_manager.scheduling_policy)
+        queue_menu.add_radiobutton(label="Queue Order", value='fifo',
+                                   variable=self.policy_var, command=self.change_scheduling_policy)
+        queue_menu.add_radiobutton(label="Shortest First", value='shortest',
+                                   variable=self.policy_var, command=self.change_scheduling_policy)
+        self.engine_var = tk.StringVar(value=self.download_manager.engine.name)
+        engine_menu.add_radiobutton(label="Threaded (requests)", value=ThreadedEngine.name,
+                                    variable=self.engine_var, command=self.change_download_engine)
+        engine_menu.add_radiobutton(label="Asyncio (event loop)", value=AsyncioEngine.name,
+                                    variable=self.engine_var, command=self.change_download_engine)
+
+    def show_connection_stats(self):
+        stats = self.download_manager.get_pool_stats()
+        lines = [f"Requests: {stats['requests']}",
+                 f"New connections: {stats['new_connections']}",
+                 f"Reused connections: {stats['reused_connections']}"]
+        for host, host_stats in sorted(stats['hosts'].items()):
+            lines.append(f"  {host}: {host_stats['requests']} requests, {host_stats['reused_connections']} reused")
+
+        engine_stats = getattr(self.download_manager.engine, 'stats', None)
+        if engine_stats:
+            lines.append("")
+            lines.append(f"Asyncio engine: {engine_stats['connections_opened']} opened, "
+                         f"{engine_stats['connections_reused']} reused, "
+                         f"{engine_stats['pipelined_requests']} pipelined")
+
+        cache = self.download_manager.cache
+        if cache is not None:
+            lines.append("")
+            lines.append(f"Download cache: {cache.stats['hits']} hits, {cache.stats['misses']} misses, "
+                         f"{self.download_manager.format_size(cache.stats['bytes_saved'])} not downloaded")
+
+        writes = self.download_manager.get_write_stats()
+        if writes['writes']:
+            format_size = self.download_manager.format_size
+            lines.append("")
+            lines.append(f"Disk writes: {format_size(writes['bytes_written'])} in {writes['writes']} writes, "
+                         f"{writes['write_seconds'] / writes['writes'] * 1000:.1f} ms average, "
+                         f"{writes['max_write_seconds'] * 1000:.1f} ms slowest")
+            lines.append(f"Write buffers: {format_size(writes['dirty_bytes'])} of {format_size(writes['max_dirty'])} "
+                         f"in use, {format_size(writes['peak_dirty_bytes'])} peak, {writes['stalls']} stalls")
+
+        host_limits = self.download_manager.concurrency.limits()
+        if host_limits:
+            lines.append("")
+            lines.append("Adaptive concurrency:")
+            for host, limit in sorted(host_limits.items()):
+                lines.append(f"  {host}: {limit} at once")
+
+        messagebox.showinfo("Connection Statistics", "\n".join(lines), parent=self.root)
+
+    def toggle_adaptive_concurrency(self):
+        enabled = self.adaptive_var.get()
+        self.download_manager.set_adaptive_concurrency(enabled)
+        if enabled:
+            self.status_var.set("Adaptive concurrency on: per-server downloads follow measured throughput.")
+        else:
+            self.status_var.set(f"Adaptive concurrency off: {self.download_manager.per_host_limit} downloads per server.")
+
+    def open_bandwidth_limits(self):
+        limiter = self.download_manager.rate_limiter
+        selected = self.download_list.selected_urls()
+        dialog = BandwidthLimitDialog(self.root, limiter.limits(), len(selected), self.fonts_dict, self.colors_dict)
+        if not dialog.result:
+            return
+
+        limiter.set_global_limit(dialog.result['global'])
+        limiter.set_host_limit(dialog.result['host'])
+        if 'selected' in dialog.result:
+            for url in selected:
+                limiter.set_job_limit(url, dialog.result['selected'])
+
+        parts = []
+        for label, rate in (("all", dialog.result['global']), ("per server", dialog.result['host'])):
+            parts.append(f"{label} {DownloadManager.format_speed(rate) if rate else 'unlimited'}")
+        self.status_var.set("Bandwidth limits: " + ", ".join(parts) + ".")
+
+    def toggle_download_cache(self):
+        if not self.cache_var.get():
+            self.download_manager.cache = None
+            self.status_var.set("Download cache off.")
+            return
+
+        if self.cache is None:
+            try:
+                self.cache = DownloadCache(DownloadCache.default_path())
+            except (sqlite3.Error, OSError) as e:
+                self.cache_var.set(False)
+                messagebox.showerror("Error", f"Could not open the download cache: {e}", parent=self.root)
+                return
+        self.download_manager.cache = self.cache
+        self.status_var.set(f"Download cache on ({self.download_manager.format_size(self.cache.total_size())} stored).")
+
+    def load_checksums(self):
+        path = filedialog.askopenfilename(
+            parent=self.root, title="Select a checksum manifest",
+            filetypes=[("Checksum files", "*.sha256 *.md5 *.sfv *SUMS *.txt"), ("All files", "*.*")])
+        if not path:
+            return
+
+        urls_text = self.url_text.get("1.0", tk.END)
+        listed_urls = list(self.download_list.order)
+
+        def load(task):
+            text_urls = self.download_manager.add_url_lines(urls_text.split('\n'))
+            urls = list(dict.fromkeys(listed_urls + text_urls))
+            return self.download_manager.load_checksum_manifest(path, urls), len(urls)
+
+        def loaded(result):
+            matched, total = result
+            self.status_var.set(f"Checksums loaded for {matched} of {total} downloads; they are verified while downloading.")
+
+        self.tasks.submit("loading checksums", load, on_done=loaded,
+                          on_error=lambda e: messagebox.showerror("Error", f"Could not read checksum manifest: {e}", parent=self.root))
+
+    def load_metalink(self):
+        path = filedialog.askopenfilename(
+            parent=self.root, title="Select a metalink file",
+            filetypes=[("Metalink files", "*.meta4 *.metalink"), ("All files", "*.*")])
+        if not path:
+            return
+
+        self.tasks.submit("loading the metalink file", lambda task: self.download_manager.load_metalink(path),
+                          on_done=self.add_metalink_entries,
+                          on_error=lambda e: messagebox.showerror("Error", f"Could not read metalink file: {e}", parent=self.root))
+
+    def add_metalink_entries(self, entries):
+        if not entries:
+            messagebox.showwarning("Warning", "The metalink file lists no downloads.", parent=self.root)
+            return
+
+        lines = [" | ".join([url] + mirrors) for url, mirrors, _ in entries]
+        current_text = self.url_text.get("1.0", tk.END).strip()
+        self.url_text.delete("1.0", tk.END)
+        self.url_text.insert("1.0", "\n".join(([current_text] if current_text else []) + lines))
+        sources = sum(len(mirrors) + 1 for _, mirrors, _ in entries)
+        self.status_var.set(f"Loaded {len(entries)} downloads with {sources} sources from the metalink file.")
+
+    def reorder_queue(self, order):
+        self.download_manager.set_queue_order(order)
+
+    def move_selected(self, top):
+        selected = self.download_list.selected_urls()
+        if not selected:
+            messagebox.showinfo("Queue", "Select the downloads to move first.", parent=self.root)
+            return
+        before = self.download_list.order[0] if top and self.download_list.order else None
+        self.download_list.move_rows(selected, before)
+
+    def set_selected_priority(self, priority):
+        selected = self.download_list.selected_urls()
+        if not selected:
+            messagebox.showinfo("Queue", "Select the downloads to change first.", parent=self.root)
+            return
+        self.download_manager.set_priority(selected, priority)
+        self.status_var.set(f"{priority.capitalize()} priority set for {len(selected)} downloads.")
+
+    def change_scheduling_policy(self):
+        policy = self.policy_var.get()
+        # Shortest-first probes the sizes of waiting downloads, so it runs off the UI thread.
+        self.tasks.cancel("checking file sizes")
+        self.tasks.submit("checking file sizes",
+                          lambda task: self.download_manager.set_scheduling_policy(policy, task.report, task.cancelled))
+        if policy == 'shortest':
+            self.status_var.set("Smallest files start first; sizes are checked in the background.")
+        else:
+            self.status_var.set("Downloads start in queue order.")
+
+    def change_download_engine(self):
+        try:
+            self.download_manager.set_engine(self.engine_var.get())
+            self.status_var.set(f"Download engine set to '{self.engine_var.get()}'.")
+        except RuntimeError as e:
+            self.engine_var.set(self.download_manager.engine.name)
+            messagebox.showwarning("Warning", str(e), parent=self.root)
+
     def open_batch_url_generator(self):
         dialog = BatchUrlGeneratorDialog(self.root, self.fonts_dict, self.colors_dict)
-        if dialog.result:
+        if dialog.result and len(dialog.result) > self.TEMPLATE_TEXT_LIMIT:
+            self.enqueue_template(dialog.result)
+        elif dialog.result:
             urls_text = "\n".join(dialog.result)
             current_text = self.url_text.get("1.0", tk.END).strip()
 
@@ -595,6 +1104,17 @@ class DownloaderApp:
             self.url_text.insert("1.0", full_text)
             messagebox.showinfo("Success", f"{len(dialog.result)} URLs were successfully generated and added.", parent=self.root)
 
+    def enqueue_template(self, template):
+        """Queues a large URL series straight from the template; rows appear as the manager feeds them."""
+        save_path = self.current_save_path()
+
+        def enqueue(task):
+            manager = self.download_manager
+            manager.add_job_source((url, manager.default_filename(url), save_path) for url in template)
+
+        self.tasks.submit("queueing the series", enqueue)
+        self.status_var.set(f"Queued a series of {len(template):,} URLs; they are added as downloads finish.")
+
     def create_widgets(self):
         header_frame = ttk.Frame(self.root, style='TFrame')
         header_frame.pack(fill=tk.X, pady=(2, 2), padx=5)
@@ -701,6 +1221,7 @@ class DownloaderApp:
         self.tree.configure(yscrollcommand=y_scroll.set, xscrollcommand=x_scroll.set)
 
         self.tree.grid(row=0, column=0, sticky='nsew')
+        self.download_list = DownloadListView(self.tree, y_scroll, on_reorder=self.reorder_queue)
         y_scroll.grid(row=0, column=1, sticky='ns')
         x_scroll.grid(row=1, column=0, sticky='ew')
 
@@ -751,6 +1272,32 @@ class DownloaderApp:
         self.status_var.set("Ready")
         ttk.Label(self.root, textvariable=self.status_var, style='TStatus.TLabel').pack(fill=tk.X, pady=(0,0), padx=5)
 
+        # Shown only while a background task runs long enough to notice.
+        self.task_frame = ttk.Frame(self.root, style='TFrame')
+        self.task_var = tk.StringVar()
+        ttk.Label(self.task_frame, textvariable=self.task_var, style='TStatus.TLabel').pack(side=tk.LEFT)
+        ttk.Button(self.task_frame, text="Cancel", command=self.tasks.cancel, width=8).pack(side=tk.RIGHT)
+        self.task_progress = ttk.Progressbar(self.task_frame, mode='determinate', length=160)
+        self.task_progress.pack(side=tk.RIGHT, padx=5)
+
+    def show_task_progress(self, task):
+        if task is None:
+            self.task_frame.pack_forget()
+            return
+        if not self.task_frame.winfo_ismapped():
+            self.task_frame.pack(fill=tk.X, padx=5)
+        if task.cancelled.is_set():
+            self.task_var.set(f"Cancelling: {task.label}...")
+        elif task.total:
+            self.task_var.set(f"{task.label.capitalize()}: {task.done:,} of {task.total:,}")
+        else:
+            self.task_var.set(f"{task.label.capitalize()}...")
+        if task.total:
+            self.task_progress.config(mode='determinate', maximum=task.total, value=task.done)
+        else:
+            self.task_progress.config(mode='indeterminate')
+            self.task_progress.step(5)
+
     def toggle_subfolder_entry(self):
         if self.use_subfolder_var.get() == 1:
             self.subfolder_entry.config(state=tk.NORMAL)
@@ -788,7 +1335,7 @@ class DownloaderApp:
         if self.download_manager.active_downloads:
             self.exit_btn.config(bg=self.exit_red_hover, fg=self.exit_white_text,
                                  activebackground=self.exit_red_hover, activeforeground=self.exit_white_text)
-        elif not self.download_manager.download_queue.empty():
+        elif self.download_manager.has_pending_work():
             self.exit_btn.config(bg=self.exit_yellow_hover, fg=self.exit_dark_text_on_yellow,
                                  activebackground=self.exit_yellow_hover, activeforeground=self.exit_dark_text_on_yellow)
         else:
@@ -807,7 +1354,7 @@ class DownloaderApp:
             if response:
                 self.download_manager.stop_all_downloads()
                 self.root.quit()
-        elif not self.download_manager.download_queue.empty():
+        elif self.download_manager.has_pending_work():
             response = messagebox.askyesno("Confirm Exit",
                                            "There are pending downloads in the queue. Do you want to clear the queue and exit?",
                                            parent=self.root, icon='question')
@@ -821,12 +1368,12 @@ class DownloaderApp:
 
     def set_filenames(self):
         urls_text = self.url_text.get("1.0", tk.END).strip()
-        if not urls_text:
+        if not urls_text and not len(self.download_list):
             messagebox.showwarning("Warning", "Please enter URLs first to set filenames.", parent=self.root)
             return
 
-        urls = [url.strip() for url in urls_text.split('\n') if url.strip()]
-        if not urls:
+        # Stops at the first URL; the full parse happens on the task worker.
+        if not len(self.download_list) and not any(self.download_manager.split_sources(line)[0] for line in urls_text.split('\n')):
             messagebox.showwarning("Warning", "No valid URLs found to set filenames for.", parent=self.root)
             return
 
@@ -837,25 +1384,38 @@ class DownloaderApp:
         base_name = dialog.result
 
         if base_name:
-            self.download_manager.set_batch_filename_prefix(base_name)
-            self.download_manager.custom_filenames = {}
-            self.update_treeview_filenames()
+            self.update_treeview_filenames(rule=lambda plan: plan.set_prefix(base_name, keep_names=False))
         else:
-            self.download_manager.batch_filename_prefix = None
-            self.update_treeview_filenames()
+            self.update_treeview_filenames(rule=lambda plan: plan.set_prefix(None))
             messagebox.showinfo("Filename Setup", "No base name set. Filenames will revert to default URL names or individual custom names.", parent=self.root)
 
     def edit_filenames(self):
         urls_text = self.url_text.get("1.0", tk.END).strip()
-        if not urls_text:
-            messagebox.showwarning("Warning", "Please enter URLs first to set individual filenames.", parent=self.root)
+        selected = self.download_list.selected_urls()
+        if not urls_text and not selected:
+            messagebox.showwarning("Warning", "Please enter URLs or select downloads first to set individual filenames.", parent=self.root)
             return
 
-        urls = [url.strip() for url in urls_text.split('\n') if url.strip()]
-
+        def check_file_types(task):
+            manager = self.download_manager
+            urls = manager.add_url_lines(urls_text.split('\n')) if urls_text else selected
+            # Probe the URLs whose extension cannot be told from the URL itself in one concurrent batch.
+            unresolved = {url for url in urls if manager.get_proper_extension(url) == '.bin'}
+            if unresolved:
+                manager.probe_urls(unresolved, progress=task.report, cancelled=task.cancelled)
+                task.check()
+            return urls, unresolved
+
+        self.status_var.set("Checking file types...")
+        self.tasks.submit("checking file types", check_file_types, on_done=self.ask_filenames)
+
+    def ask_filenames(self, probed):
+        urls, unresolved = probed
+        self.status_var.set("Ready")
+        names = {}
         for url in urls:
             default_name = self.download_manager.get_filename_from_url(url)
-            ext = self.download_manager.get_proper_extension(url)
+            ext = self.download_manager.get_proper_extension(url, check_online=url in unresolved)
             if not default_name.lower().endswith(ext) and '.' not in default_name:
                 default_name += ext
 
@@ -867,65 +1427,76 @@ class DownloaderApp:
 
             if new_name:
                 if '.' not in new_name or new_name.endswith('.'):
-                    new_name += self.download_manager.get_proper_extension(url)
-                self.download_manager.set_custom_filename(url, new_name)
+                    new_name += ext
+                names[url] = new_name
 
-        self.update_treeview_filenames()
+        self.update_treeview_filenames(rule=lambda plan: plan.set_names(names))
 
     def reset_filenames(self):
-        self.download_manager.custom_filenames = {}
-        self.download_manager.batch_filename_prefix = None
         messagebox.showinfo("Reset", "Filenames reset to default (derived from URL).", parent=self.root)
-        self.update_treeview_filenames()
-
-    def update_treeview_filenames(self):
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-
-        urls_text = self.url_text.get("1.0", tk.END).strip()
-        urls = [url.strip() for url in urls_text.split('\n') if url.strip()]
-
-        processed_urls_for_queue = []
-
-        extension_counters = {}
-
+        self.update_treeview_filenames(rule=lambda plan: plan.set_prefix(None, keep_names=False))
+
+    def update_treeview_filenames(self, rule=None, on_done=None, commit=False):
+        """
+        Brings the list and the queue up to date with the URL box, then applies rule(plan), a
+        naming change returning the renamed rows. Only new, dropped and renamed rows are touched,
+        so adding 10 URLs to a long list costs 10 rows. on_done(count) gets the box's URL count.
+        """
+        urls_text = self.url_text.get("1.0", tk.END)
+        save_path = self.current_save_path()
+        self.tasks.submit("preparing the list",
+                          lambda task: self.sync_url_text(task, urls_text, save_path, rule, commit),
+                          on_done=lambda changes: self.apply_plan_changes(changes, on_done))
+
+    def sync_url_text(self, task, urls_text, save_path, rule, commit):
+        """
+        Runs on the task worker. Plans and queues the box's new URLs and drops staged URLs that
+        were deleted from the box; commit makes the box's URLs permanent. Returns the changes.
+        """
+        manager = self.download_manager
+        box_urls = dict.fromkeys(manager.add_url_lines(urls_text.strip().split('\n')))
+        dropped = [url for url in self.staged_urls if url not in box_urls]
+        renamed = self.plan.remove(dropped)
+        manager.withdraw_queued(dropped)
+
+        new_urls = [url for url in box_urls if url not in self.plan]
+        added = []
+        for start in range(0, len(new_urls), 1000):
+            task.report(start, len(new_urls))
+            added += self.plan.add(new_urls[start:start + 1000])
+        manager.add_to_queue([(url, filename, save_path) for url, filename in added])
+
+        if rule is not None:
+            renamed.update(rule(self.plan))
+        manager.rename_queued(renamed)
+
+        if commit:
+            self.staged_urls = {}
+        else:
+            self.staged_urls = {url: None for url in self.staged_urls if url in box_urls}
+            self.staged_urls.update(dict.fromkeys(new_urls))
+        return added, renamed, dropped, len(box_urls)
+
+    def apply_plan_changes(self, changes, on_done=None):
+        added, renamed, dropped, count = changes
+        view = self.download_list
+        view.remove_rows(dropped)
+        view.append_rows((url, (filename, '', '0%', 'Ready')) for url, filename in added)
+        for url, filename in renamed.items():
+            values = view.get_values(url)
+            if values is not None:
+                view.update_row(url, (filename,) + values[1:])
+        view.flush()
+        if on_done is not None:
+            on_done(count)
+
+    def current_save_path(self):
         base_save_path = self.save_path_var.get()
-        final_save_path = base_save_path
-
         if self.use_subfolder_var.get() == 1:
             subfolder_name = self.subfolder_var.get().strip()
             if subfolder_name:
-                final_save_path = os.path.join(base_save_path, subfolder_name)
-
-        for url in urls:
-            filename_to_display = ""
-            assigned_filename_for_queue = ""
-
-            if url in self.download_manager.custom_filenames:
-                filename_to_display = self.download_manager.custom_filenames[url]
-                assigned_filename_for_queue = filename_to_display
-            elif self.download_manager.batch_filename_prefix:
-                current_ext = self.download_manager.get_proper_extension(url, check_online=False)
-
-                current_counter = extension_counters.get(current_ext, 0)
-                current_counter += 1
-                extension_counters[current_ext] = current_counter
-
-                filename_to_display = f"{self.download_manager.batch_filename_prefix}_{current_counter:03d}{current_ext}"
-                assigned_filename_for_queue = filename_to_display
-            else:
-                filename_to_display = self.download_manager.get_filename_from_url(url)
-                ext = self.download_manager.get_proper_extension(url, check_online=False)
-                if not filename_to_display.lower().endswith(ext) and '.' not in filename_to_display:
-                    filename_to_display += ext
-                assigned_filename_for_queue = filename_to_display
-
-            self.tree.insert('', 'end', values=(filename_to_display, '', '0%', 'Ready'), iid=url)
-            processed_urls_for_queue.append((url, assigned_filename_for_queue, final_save_path))
-
-        with self.download_manager.download_queue.mutex:
-            self.download_manager.download_queue.queue.clear()
-        self.download_manager.add_to_queue(processed_urls_for_queue)
+                return os.path.join(base_save_path, subfolder_name)
+        return base_save_path
 
     def browse_path(self):
         path = filedialog.askdirectory(parent=self.root)
@@ -938,14 +1509,6 @@ class DownloaderApp:
             messagebox.showwarning("Warning", "Please enter at least one URL to add.", parent=self.root)
             return
 
-        urls = [url.strip() for url in urls_text.split('\n') if url.strip()]
-
-        urls = [url for url in urls if url]
-
-        if not urls:
-            messagebox.showwarning("Warning", "No valid URLs found to add.", parent=self.root)
-            return
-
         base_save_path = self.save_path_var.get()
 
         final_save_path = base_save_path
@@ -967,20 +1530,33 @@ class DownloaderApp:
 
             final_save_path = os.path.join(base_save_path, sanitized_name)
 
-        if not os.path.exists(final_save_path):
-            try:
-                os.makedirs(final_save_path, exist_ok=True)
-            except OSError as e:
-                messagebox.showerror("Error", f"Could not create save directory: {e}", parent=self.root)
-                return
-
-        self.update_treeview_filenames()
+        self.status_var.set("Adding URLs...")
+        self.tasks.submit("creating the save directory",
+                          lambda task: os.makedirs(final_save_path, exist_ok=True),
+                          on_done=lambda _: self.queue_url_text(),
+                          on_error=lambda e: messagebox.showerror("Error", f"Could not create save directory: {e}", parent=self.root))
 
+    def queue_url_text(self):
+        self.update_treeview_filenames(on_done=self.urls_added, commit=True)
         self.url_text.delete("1.0", tk.END)
-        self.status_var.set(f"Added {len(urls)} URLs to queue. Ready to start downloads.")
+
+    def urls_added(self, count):
+        if not count:
+            messagebox.showwarning("Warning", "No valid URLs found to add.", parent=self.root)
+            return
+        self.status_var.set(f"Added {count} URLs to queue. Ready to start downloads.")
 
     def start_downloads(self):
-        if self.download_manager.download_queue.empty() and not self.download_manager.active_downloads:
+        if self.tasks.running():
+            # The list may still be in preparation; start once it is queued.
+            self.start_btn.config(state=tk.DISABLED)
+            self.status_var.set("Preparing the list, downloads start in a moment...")
+            self.tasks.when_idle(self.start_downloads)
+            return
+
+        if (self.download_manager.download_queue.empty() and not self.download_manager.active_downloads
+                and not self.download_manager.job_sources):
+            self.start_btn.config(state=tk.NORMAL)
             messagebox.showwarning("Warning", "No files in queue or active downloads to start.", parent=self.root)
             return
 
@@ -1019,19 +1595,39 @@ class DownloaderApp:
         self.another_btn.config(state=tk.NORMAL)
         self.exit_btn.config(state=tk.NORMAL)
 
-        if not self.download_manager.active_downloads and self.download_manager.download_queue.empty():
+        if not self.download_manager.has_pending_work():
             self.subfolder_checkbox.config(state=tk.NORMAL)
             if self.use_subfolder_var.get() == 1:
                 self.subfolder_entry.config(state=tk.NORMAL)
                 self.confirm_subfolder_btn.config(state=tk.NORMAL)
 
     def clear_all_content(self):
-        self.download_manager.stop_all_downloads()
-        time.sleep(0.1)
-
+        old_manager = self.download_manager
+        rate_limiter = old_manager.rate_limiter
+        rate_limiter.clear_job_limits()
+        options = dict(journal=self.journal, rate_limiter=rate_limiter, adaptive=self.adaptive_var.get(),
+                       cache=self.cache if self.cache_var.get() else None, engine=old_manager.engine.name)
+        policy = self.policy_var.get()
+
+        def replace_manager(task):
+            old_manager.shutdown()
+            time.sleep(0.1)
+            if self.journal is not None:
+                self.journal.clear()
+            manager = DownloadManager(**options)
+            manager.scheduling_policy = policy
+            self.plan = FilenamePlan(manager)
+            self.staged_urls = {}
+            # Swapped on the worker, so tasks queued behind this one already use the new manager.
+            self.download_manager = manager
+
+        self.tasks.cancel()
         self.url_text.delete("1.0", tk.END)
-        self.tree.delete(*self.tree.get_children())
-        self.download_manager = DownloadManager()
+        self.download_list.clear()
+        self.status_var.set("Clearing...")
+        self.tasks.submit("clearing the downloads", replace_manager, on_done=self.reset_controls)
+
+    def reset_controls(self, _=None):
         self.status_var.set("Ready for new downloads.")
         self.start_btn.config(state=tk.NORMAL)
         self.pause_btn.config(state=tk.DISABLED, text="Pause / Resume")
@@ -1050,59 +1646,100 @@ class DownloaderApp:
             self.root.after(self.update_interval, self.update_download_status)
             return
 
-        for url, info in list(self.download_manager.active_downloads.items()):
-            item_id = url
-
-            if item_id in self.tree.get_children():
+        queued = self.download_manager.telemetry.queued
+        if queued:
+            jobs = []
+            while queued:
+                jobs.append(queued.popleft())
+            self.download_list.append_rows((url, (filename, '', '0%', 'Ready')) for url, filename, _ in jobs)
+            # The plan is locked while the worker renames, so the Tk thread never waits on it.
+            self.tasks.submit("listing the series", lambda task: self.plan.add_named(jobs))
+
+        records = self.download_manager.telemetry.drain_updates()
+        paused = self.download_manager.pause_flag
+        if paused != self.last_pause_state:
+            # The status column follows the pause flag, so repaint every active row once.
+            self.last_pause_state = paused
+            records = list(self.download_manager.active_downloads.values())
+
+        for record in records:
+            item_id = record.url
+
+            # Skip updates for downloads that finished after publishing them.
+            if self.download_manager.active_downloads.get(item_id) is not record:
+                continue
+
+            if self.download_list.has_row(item_id):
                 display_size = ""
                 display_progress_speed = ""
-                status_text = ""
+                status_text = "Downloading" if not paused else "Paused"
+                if record.sources > 1:
+                    status_text += f" ({record.sources} mirrors)"
 
-                if info['size'] > 0:
-                    display_size = self.download_manager.format_size(info['size'])
-                    display_progress_speed = f"{info['progress']:.1f}% ({self.download_manager.format_speed(info['speed'])})"
-                    status_text = "Downloading" if not self.download_manager.pause_flag else "Paused"
+                if record.size > 0:
+                    display_size = self.download_manager.format_size(record.size)
+                    display_progress_speed = f"{record.progress:.1f}% ({self.download_manager.format_speed(record.speed)})"
                 else:
-                    display_size = f"{self.download_manager.format_size(info['downloaded_bytes'])} / Unknown"
-                    display_progress_speed = f"N/A ({self.download_manager.format_speed(info['speed'])})"
-                    status_text = "Downloading" if not self.download_manager.pause_flag else "Paused"
+                    display_size = f"{self.download_manager.format_size(record.downloaded_bytes)} / Unknown"
+                    display_progress_speed = f"N/A ({self.download_manager.format_speed(record.speed)})"
 
-                self.tree.item(item_id, values=(
-                    info['filename'],
+                self.download_list.update_row(item_id, (
+                    record.filename,
                     display_size,
                     display_progress_speed,
                     status_text
                 ))
 
         while self.download_manager.completed_downloads:
-            info = self.download_manager.completed_downloads.pop(0)
+            info = self.download_manager.completed_downloads.popleft()
             completed_size_display = self.download_manager.format_size(info['size'])
 
             item_id = info['url']
 
-            if item_id in self.tree.get_children() and self.tree.item(item_id, 'values')[3] != "Completed":
-                self.tree.item(item_id, values=(
+            if 'verified' in info:
+                status_text = f"Verified ({info['verified']})"
+            elif info.get('source') == 'cache':
+                status_text = "Completed (cached)"
+            else:
+                status_text = "Completed"
+            values = self.download_list.get_values(item_id)
+            if values is not None and values[3] != status_text:
+                self.download_list.update_row(item_id, (
                     info['filename'],
                     completed_size_display,
                     "100%",
-                    "Completed"
+                    status_text
                 ))
 
         while self.download_manager.failed_downloads:
-            info = self.download_manager.failed_downloads.pop(0)
+            info = self.download_manager.failed_downloads.popleft()
             item_id = info['url']
             
             error_text = f"Error: {info['error']}"
 
-            if item_id in self.tree.get_children() and not self.tree.item(item_id, 'values')[3].startswith("Error"):
-                self.tree.item(item_id, values=(
+            values = self.download_list.get_values(item_id)
+            if values is not None and not values[3].startswith("Error"):
+                self.download_list.update_row(item_id, (
                     info['filename'],
                     "",
                     "0%",
                     error_text[:40]
                 ))
 
-        if not self.download_manager.active_downloads and self.download_manager.download_queue.empty():
+        while self.download_manager.telemetry.retrying:
+            info = self.download_manager.telemetry.retrying.popleft()
+            values = self.download_list.get_values(info['url'])
+            if values is not None:
+                self.download_list.update_row(info['url'], (
+                    info['filename'],
+                    values[1],
+                    values[2],
+                    f"Retry {info['attempt']}/{info['max_attempts']} in {info['delay']:.0f}s"
+                ))
+
+        self.download_list.flush()
+
+        if not self.download_manager.has_pending_work():
             if self.status_var.get() not in ["Ready", "All downloads finished.", "Stopping downloads.", "Ready for new downloads."]:
                 self.status_var.set("All downloads finished.")
             self.start_btn.config(state=tk.NORMAL)
@@ -1134,4 +1771,5 @@ class DownloaderApp:
 if __name__ == "__main__":
     root = tk.Tk()
     app = DownloaderApp(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
+    app.close()
\ No newline at end of file
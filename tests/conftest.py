@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository, next to main-downloader.py.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from downloader_core import DownloadManager
+
+@pytest.fixture
+def manager():
+    manager = DownloadManager()
+    yield manager
+    manager.shutdown()
@@ -0,0 +1,74 @@
+import os
+import stat
+
+import pytest
+
+from downloader_cache import DownloadCache
+
+BLOB = 'sha256-' + 'ab' * 32
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = DownloadCache(str(tmp_path / 'cache'), max_bytes=10000)
+    yield cache
+    cache.close()
+
+@pytest.fixture
+def download(tmp_path):
+    path = tmp_path / 'file.bin'
+    path.write_bytes(b'x' * 1000)
+    return str(path)
+
+def test_store_lookup_materialize(cache, download, tmp_path):
+    assert cache.store('u1', download, BLOB, etag='"1"')
+    entry = cache.lookup('u1')
+    assert entry['etag'] == '"1"' and entry['size'] == 1000
+    target = str(tmp_path / 'copy.bin')
+    assert cache.materialize(entry, target)
+    assert open(target, 'rb').read() == b'x' * 1000
+    assert cache.stats['hits'] == 1 and cache.stats['bytes_saved'] == 1000
+
+def test_materialized_file_is_independent_and_writable(cache, download, tmp_path):
+    cache.store('u1', download, BLOB)
+    target = str(tmp_path / 'copy.bin')
+    assert cache.materialize(cache.lookup('u1'), target)
+    st = os.stat(target)
+    assert st.st_mode & stat.S_IWUSR and st.st_nlink == 1
+    with open(target, 'r+b') as f:
+        f.write(b'y')
+    assert cache.lookup('u1') is not None
+    assert open(cache.blob_path(BLOB), 'rb').read() == b'x' * 1000
+
+def test_ingest_leaves_the_users_file_alone(cache, download):
+    mode = os.stat(download).st_mode
+    cache.store('u1', download, BLOB)
+    assert os.stat(download).st_mode == mode
+    assert os.stat(download).st_ino != os.stat(cache.blob_path(BLOB)).st_ino
+    assert not os.stat(cache.blob_path(BLOB)).st_mode & stat.S_IWUSR
+
+def test_changed_blob_is_not_served(cache, download):
+    cache.store('u1', download, BLOB)
+    path = cache.blob_path(BLOB)
+    os.chmod(path, stat.S_IRUSR | stat.S_IWUSR)
+    with open(path, 'r+b') as f:
+        f.write(b'y')
+    os.utime(path, ns=(0, 0))
+    assert cache.lookup('u1') is None
+    # Storing again re-ingests the blob.
+    cache.store('u2', download, BLOB)
+    assert open(cache.lookup('u2')['path'], 'rb').read() == b'x' * 1000
+
+def test_weak_content_addresses_are_not_served(cache, download):
+    cache.store('u1', download, 'crc32-12345678')
+    assert cache.lookup('u1') is None
+
+def test_identical_content_is_stored_once_and_evicted_lru(cache, tmp_path, download):
+    cache.store('u1', download, BLOB)
+    cache.store('u2', download, BLOB)
+    assert cache.total_size() == 1000
+    big = tmp_path / 'big.bin'
+    big.write_bytes(b'z' * 9500)
+    cache.store('u3', str(big), 'sha256-' + 'cd' * 32)
+    assert cache.lookup('u1') is None and cache.lookup('u2') is None
+    assert not os.path.exists(cache.blob_path(BLOB))
+    assert cache.lookup('u3') is not None
@@ -0,0 +1,86 @@
+import time
+
+import pytest
+import requests
+
+from downloader_core import ConcurrencyController
+
+HOST = 'example.com'
+
+@pytest.fixture
+def changes():
+    return []
+
+def make_controller(changes, initial_limit):
+    controller = ConcurrencyController(initial_limit=initial_limit, max_limit=8,
+                                       on_change=lambda host, limit: changes.append(limit))
+    controller.WINDOW = 1.0
+    return controller
+
+def window(controller, transfers):
+    """Reports bytes per URL for one window of WINDOW seconds, then ends it."""
+    state = controller._host(HOST)
+    for n, amount in enumerate(transfers[:-1]):
+        controller.observe(f"http://{HOST}/{n}", amount)
+    state.window_start = time.monotonic() - controller.WINDOW
+    controller.observe(f"http://{HOST}/{len(transfers) - 1}", transfers[-1])
+
+def test_probe_is_kept_on_gain_and_undone_without_one(changes):
+    controller = make_controller(changes, 2)
+    window(controller, [1000] * 2)
+    assert changes == [3]
+    window(controller, [3000] * 3)
+    assert changes == [3, 4]
+    window(controller, [2250] * 4)
+    assert changes == [3, 4, 3]
+    assert controller.hosts[HOST].hold == ConcurrencyController.HOLD
+
+def test_host_is_left_alone_while_holding(changes):
+    controller = make_controller(changes, 2)
+    window(controller, [1000] * 2)
+    # Three connections move no more than two did, so the probe is undone.
+    window(controller, [667] * 3)
+    assert changes == [3, 2]
+    for _ in range(ConcurrencyController.HOLD):
+        window(controller, [1000] * 2)
+    assert changes == [3, 2]
+    window(controller, [1000] * 2)
+    assert changes == [3, 2, 3]
+
+def test_unsaturated_host_is_not_probed(changes):
+    controller = make_controller(changes, 4)
+    window(controller, [5000] * 2)
+    assert changes == []
+
+def test_collapse_of_per_connection_speed_halves_the_limit(changes):
+    controller = make_controller(changes, 4)
+    window(controller, [1000] * 4)
+    window(controller, [100] * 5)
+    assert changes == [5, 2]
+
+def throttled():
+    response = requests.Response()
+    response.status_code = 429
+    return requests.exceptions.HTTPError(response=response)
+
+def test_errors_halve_once_per_window_and_block_the_next_probe(changes):
+    controller = make_controller(changes, 8)
+    for _ in range(5):
+        controller.observe_error(f"http://{HOST}/x", throttled())
+    assert changes == [4]
+    window(controller, [1000] * 4)
+    assert changes == [4]
+
+def test_errors_that_do_not_signal_overload_are_ignored(changes):
+    controller = make_controller(changes, 4)
+    response = requests.Response()
+    response.status_code = 404
+    controller.observe_error(f"http://{HOST}/x", requests.exceptions.HTTPError(response=response))
+    assert changes == []
+
+def test_disabled_controller_changes_nothing(changes):
+    controller = make_controller(changes, 2)
+    controller.enabled = False
+    window(controller, [1000] * 2)
+    controller.observe_error(f"http://{HOST}/x", throttled())
+    assert changes == []
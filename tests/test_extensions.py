@@ -0,0 +1,48 @@
+import pytest
+
+from downloader_core import ExtensionResolver
+
+@pytest.fixture
+def resolver():
+    return ExtensionResolver()
+
+@pytest.mark.parametrize('url, extension', [
+    ("https://cdn.example.com/videos/episode_1.MP4", '.mp4'),
+    ("https://example.com/files/Lecture%201.pdf?download=1", '.pdf'),
+    ("https://example.com/download/mkv/123", '.mkv'),
+    ("https://stream.example.net/watch?v=1&format=webm", '.webm'),
+    ("https://example.com/get.php?id=3&file=archive.zip", '.zip'),
+    ("https://example.com/video/mp4/webm/1", '.mp4'),
+    ("https://example.com/thumbs/1/large?type=jpeg", '.jpg'),
+    ("https://example.com/subscribe/newsletter/5", None),
+    ("https://example.com/page?sub=1", None),
+    ("https://example.com/.htaccess", None),
+    ("https://example.com/d/12345", None),
+])
+def test_from_url(resolver, url, extension):
+    assert resolver.from_url(url) == extension
+
+def test_script_extensions_fall_through_to_format_tokens(resolver):
+    assert resolver.from_url("https://example.com/index.php?format=csv") == '.csv'
+    assert resolver.from_url("https://example.com/index.php") is None
+
+@pytest.mark.parametrize('content_type, extension', [
+    ('video/mp4', '.mp4'),
+    ('Application/PDF; charset=binary', '.pdf'),
+    ('video/x-flv', '.mp4'),
+    ('application/octet-stream', None),
+])
+def test_from_content_type(resolver, content_type, extension):
+    assert resolver.from_content_type(content_type) == extension
+
+def test_register_extends_one_resolver_only(resolver):
+    resolver.register('flac', tokens=['flac'], mime_types=['audio/flac'])
+    assert resolver.from_url("https://example.com/music/flac/7") == '.flac'
+    assert resolver.from_content_type('audio/flac') == '.flac'
+    # Existing tokens keep their precedence over registered ones.
+    assert resolver.from_url("https://example.com/flac/mp3/7") == '.mp3'
+    assert ExtensionResolver().from_url("https://example.com/music/flac/7") is None
+
+def test_split_url():
+    assert ExtensionResolver.split_url("https://h/a/b?x=1#frag") == ('/a/b', 'x=1')
+    assert ExtensionResolver.split_url("https://h") == ('', '')
@@ -0,0 +1,58 @@
+import pytest
+
+from downloader_core import FilenamePlan
+
+URLS = [f"https://example.com/clips/{n}.mp4" for n in range(1, 5)]
+
+@pytest.fixture
+def plan(manager):
+    manager.batch_filename_prefix = 'clip'
+    return FilenamePlan(manager)
+
+def names(plan, urls=URLS):
+    return [plan.name(url) for url in urls]
+
+def test_add_numbers_per_extension(plan):
+    added = plan.add(URLS[:2] + ["https://example.com/a.pdf"] + URLS[2:])
+    assert [name for _, name in added] == ['clip_001.mp4', 'clip_002.mp4', 'clip_001.pdf',
+                                           'clip_003.mp4', 'clip_004.mp4']
+    # Re-adding is a no-op.
+    assert plan.add(URLS) == []
+    assert len(plan) == 5
+
+def test_remove_renumbers_only_later_rows(plan):
+    plan.add(URLS)
+    assert plan.remove([URLS[1]]) == {URLS[2]: 'clip_002.mp4', URLS[3]: 'clip_003.mp4'}
+    assert URLS[1] not in plan
+
+def test_custom_name_takes_a_row_out_of_the_numbering(plan, manager):
+    plan.add(URLS)
+    changes = plan.set_names({URLS[0]: 'intro.mp4'})
+    assert changes == {URLS[0]: 'intro.mp4', URLS[1]: 'clip_001.mp4', URLS[2]: 'clip_002.mp4',
+                       URLS[3]: 'clip_003.mp4'}
+    assert manager.custom_filenames[URLS[0]] == 'intro.mp4'
+    # Returning it to the rules restores the original numbering.
+    plan.set_names({URLS[0]: None})
+    assert names(plan) == ['clip_001.mp4', 'clip_002.mp4', 'clip_003.mp4', 'clip_004.mp4']
+    assert URLS[0] not in manager.custom_filenames
+
+def test_changing_the_last_row_touches_nothing_else(plan):
+    plan.add(URLS)
+    assert plan.set_names({URLS[3]: 'outro.mp4'}) == {URLS[3]: 'outro.mp4'}
+
+def test_prefix_changes(plan):
+    plan.add(URLS)
+    plan.set_names({URLS[0]: 'intro.mp4'})
+    assert plan.set_prefix('ep')[URLS[1]] == 'ep_001.mp4'
+    assert plan.name(URLS[0]) == 'intro.mp4'
+    plan.set_prefix(None)
+    assert names(plan) == ['intro.mp4', '2.mp4', '3.mp4', '4.mp4']
+    plan.set_prefix('ep', keep_names=False)
+    assert names(plan) == ['ep_001.mp4', 'ep_002.mp4', 'ep_003.mp4', 'ep_004.mp4']
+
+def test_fixed_names_are_never_renumbered(plan):
+    plan.add_named([("https://example.com/t/1.mp4", 'frame_1.mp4', '/tmp')])
+    plan.add(URLS[:1])
+    assert plan.name("https://example.com/t/1.mp4") == 'frame_1.mp4'
+    assert plan.set_names({"https://example.com/t/1.mp4": 'other.mp4'}) == {}
+    assert plan.name(URLS[0]) == 'clip_001.mp4'
@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pytest
+
+from downloader_core import HostScheduler
+
+class Recorder:
+    """Jobs that log their start and block until released, so tests can watch the slots."""
+    def __init__(self):
+        self.started = []
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+
+    def job(self, name):
+        with self.lock:
+            self.started.append(name)
+        self.release.wait(5)
+
+    def wait_for(self, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        while len(self.started) < count and time.monotonic() < deadline:
+            time.sleep(0.005)
+        return list(self.started)
+
+def drain(scheduler, timeout=5):
+    deadline = time.monotonic() + timeout
+    while scheduler.busy() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    scheduler.executor.shutdown(wait=True)
+
+@pytest.fixture
+def recorder():
+    recorder = Recorder()
+    yield recorder
+    recorder.release.set()
+
+def test_per_host_limit_lets_idle_hosts_overtake(recorder):
+    scheduler = HostScheduler(max_workers=4, per_host_limit=2)
+    jobs = [(f"https://a.test/{i}", recorder.job, (f"a{i}",)) for i in range(4)]
+    jobs.append(("https://b.test/0", recorder.job, ("b0",)))
+    scheduler.submit_many(jobs)
+    try:
+        assert sorted(recorder.wait_for(3)) == ['a0', 'a1', 'b0']
+        time.sleep(0.05)
+        assert len(recorder.started) == 3
+        assert scheduler.pending_urls() == ['https://a.test/2', 'https://a.test/3']
+    finally:
+        recorder.release.set()
+        drain(scheduler)
+    assert sorted(recorder.started) == ['a0', 'a1', 'a2', 'a3', 'b0']
+    assert not scheduler.busy()
+
+def test_host_key_ignores_case():
+    assert HostScheduler.host_key("https://Example.TEST:8443/x") == "example.test:8443"
+
+def test_host_override_and_global_limit(recorder):
+    scheduler = HostScheduler(max_workers=3, per_host_limit=1)
+    scheduler.set_host_limit("a.test", 3)
+    scheduler.submit_many([(f"https://a.test/{i}", recorder.job, (i,)) for i in range(5)])
+    try:
+        assert len(recorder.wait_for(3)) == 3
+        time.sleep(0.05)
+        assert len(recorder.started) == 3
+        assert scheduler.pending_count() == 2
+
+        scheduler.set_host_limit("a.test", None)
+    finally:
+        recorder.release.set()
+        drain(scheduler)
+    assert len(recorder.started) == 5
+
+def test_set_limits_is_clamped_to_the_pool():
+    scheduler = HostScheduler(max_workers=2, per_host_limit=2)
+    scheduler.set_limits(max_workers=10, per_host_limit=0)
+    assert scheduler.max_workers == 2
+    assert scheduler.per_host_limit == 1
+    scheduler.executor.shutdown()
+
+def test_clear_pending_drops_waiting_jobs_only(recorder):
+    scheduler = HostScheduler(max_workers=1, per_host_limit=1)
+    scheduler.submit_many([(f"https://a.test/{i}", recorder.job, (i,)) for i in range(3)])
+    try:
+        recorder.wait_for(1)
+        scheduler.clear_pending()
+        assert scheduler.pending_count() == 0
+        assert scheduler.busy()
+    finally:
+        recorder.release.set()
+        drain(scheduler)
+    assert recorder.started == [0]
+    assert not scheduler.busy()
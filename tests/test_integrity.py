@@ -0,0 +1,61 @@
+import os
+import zlib
+import hashlib
+
+import pytest
+
+from downloader_core import Crc32, IntegrityCheck
+
+@pytest.mark.parametrize('split', [0, 1, 7, 4096, 99999, 100000])
+def test_combine_matches_crc_of_concatenation(split):
+    data = os.urandom(100000)
+    first, second = data[:split], data[split:]
+    combined = Crc32.combine(zlib.crc32(first), zlib.crc32(second), len(second))
+    assert combined == zlib.crc32(data)
+
+def test_combine_of_empty_tail_is_identity():
+    assert Crc32.combine(0x12345678, 0, 0) == 0x12345678
+
+def test_update_accumulates_like_zlib():
+    crc = Crc32()
+    for chunk in (b'abc', b'', b'defgh'):
+        crc.update(chunk)
+    assert crc.hexdigest() == f"{zlib.crc32(b'abcdefgh'):08x}"
+    assert crc.length == 8
+
+def write(tmp_path, data):
+    path = tmp_path / 'file.part'
+    path.write_bytes(data)
+    return str(path)
+
+def test_crc32_merges_out_of_order_ranges(tmp_path):
+    data = os.urandom(300000)
+    path = write(tmp_path, data)
+    check = IntegrityCheck('crc32')
+    # Two segments arriving interleaved, the later one first.
+    check.feed(150000, data[150000:200000], start=150000)
+    check.feed(0, data[:100000])
+    check.feed(200000, data[200000:], start=150000)
+    check.feed(100000, data[100000:150000])
+    assert check.finish(path, len(data)) == f"{zlib.crc32(data):08x}"
+
+def test_sha256_reads_back_data_behind_the_frontier(tmp_path):
+    data = os.urandom(300000)
+    path = write(tmp_path, data)
+    check = IntegrityCheck('sha256')
+    check.feed(200000, data[200000:], start=200000)
+    check.feed(0, data[:200000])
+    assert check.finish(path, len(data)) == hashlib.sha256(data).hexdigest()
+
+def test_weak_checks_use_a_sha256_content_address(tmp_path):
+    data = os.urandom(50000)
+    path = write(tmp_path, data)
+    for algorithm in ('crc32', 'md5'):
+        check = IntegrityCheck(algorithm, address=True)
+        check.feed(0, data)
+        digest = check.finish(path, len(data))
+        assert check.content_address(path, len(data), digest) == 'sha256-' + hashlib.sha256(data).hexdigest()
+
+def test_unsupported_algorithm_is_rejected():
+    with pytest.raises(ValueError):
+        IntegrityCheck('sha1')
@@ -0,0 +1,100 @@
+import sqlite3
+
+import pytest
+
+from downloader_journal import JobJournal
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'jobs.sqlite3')
+
+@pytest.fixture
+def journal(path):
+    # A long interval keeps the background flusher out of the way; the tests flush explicitly.
+    journal = JobJournal(path, flush_interval=60)
+    yield journal
+    journal.close()
+
+def rows(path):
+    db = sqlite3.connect(path)
+    try:
+        return db.execute("SELECT url, filename, state, bytes_done FROM jobs ORDER BY seq").fetchall()
+    finally:
+        db.close()
+
+def test_recover_returns_unfinished_jobs_in_queue_order(journal):
+    journal.record_queued([('u1', 'a.bin', '/d'), ('u2', 'b.bin', '/d'), ('u3', 'c.bin', '/d')])
+    journal.record_progress('u1', 100, 1000)
+    journal.record_state('u2', 'completed')
+    journal.record_state('u3', 'failed', error='404')
+    journal.record_mirrors('u1', ['m1', 'm2'])
+    jobs = journal.load_pending()
+    assert [(job['url'], job['bytes_done'], job['size'], job['mirrors']) for job in jobs] == [
+        ('u1', 100, 1000, ['m1', 'm2'])]
+
+def test_recovery_survives_reopening(path):
+    journal = JobJournal(path, flush_interval=60)
+    journal.record_queued([('u1', 'a.bin', '/d'), ('u2', 'b.bin', '/d')])
+    journal.record_filename('u2', 'renamed.bin')
+    journal.close()
+
+    reopened = JobJournal(path, flush_interval=60)
+    try:
+        assert [(job['url'], job['filename']) for job in reopened.load_pending()] == [
+            ('u1', 'a.bin'), ('u2', 'renamed.bin')]
+        # New jobs are ordered after the recovered ones.
+        reopened.record_queued([('u0', 'z.bin', '/d')])
+        assert [job['url'] for job in reopened.load_pending()] == ['u1', 'u2', 'u0']
+    finally:
+        reopened.close()
+
+def test_requeue_resets_state_and_remove_deletes(journal, path):
+    journal.record_queued([('u1', 'a.bin', '/d'), ('u2', 'b.bin', '/d')])
+    journal.flush()
+    journal.record_state('u1', 'failed', error='boom')
+    journal.record_queued([('u1', 'a.bin', '/d')])
+    journal.remove(['u2'])
+    journal.flush()
+    assert rows(path) == [('u1', 'a.bin', 'queued', 0)]
+
+def test_close_prunes_completed_jobs(path):
+    journal = JobJournal(path, flush_interval=60)
+    journal.record_queued([('u1', 'a.bin', '/d'), ('u2', 'b.bin', '/d')])
+    journal.record_state('u1', 'completed')
+    journal.close()
+    assert rows(path) == [('u2', 'b.bin', 'queued', 0)]
+
+class FailingDatabase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, *args):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    executemany = execute
+
+def test_failed_flush_keeps_the_batch(journal, path):
+    journal.record_queued([('u1', 'a.bin', '/d'), ('u2', 'b.bin', '/d')])
+    journal.record_progress('u1', 10, 100)
+    database, journal.db = journal.db, FailingDatabase()
+    with pytest.raises(sqlite3.Error):
+        journal.flush()
+    journal.db = database
+
+    # Updates recorded after the failure win over the failed batch.
+    journal.record_progress('u1', 20, 100)
+    journal.flush()
+    assert rows(path) == [('u1', 'a.bin', 'queued', 20), ('u2', 'b.bin', 'queued', 0)]
+
+def test_failed_flush_does_not_resurrect_removed_jobs(journal, path):
+    journal.record_queued([('u1', 'a.bin', '/d')])
+    database, journal.db = journal.db, FailingDatabase()
+    with pytest.raises(sqlite3.Error):
+        journal.flush()
+    journal.db = database
+    journal.remove(['u1'])
+    journal.flush()
+    assert rows(path) == []
@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+from downloader_core import PooledHTTPAdapter
+from downloader_metrics import MetricsRegistry, JsonLinesExporter
+
+@pytest.fixture
+def registry():
+    registry = MetricsRegistry(buckets=(0.1, 1.0))
+    yield registry
+    registry.close()
+
+def test_counters_are_kept_per_label_set(registry):
+    registry.inc('downloads_completed_total', host='a')
+    registry.inc('downloads_completed_total', 2, host='a')
+    registry.inc('downloads_completed_total', host='b')
+    values = {tuple(labels.items()): value for name, kind, labels, value in registry.samples()}
+    assert values == {(('host', 'a'),): 3, (('host', 'b'),): 1}
+
+def test_snapshot_has_cumulative_buckets(registry):
+    for value in (0.05, 0.5, 0.7, 5.0):
+        registry.observe('download_seconds', value)
+    entry, = registry.snapshot()['metrics']
+    assert entry['kind'] == 'histogram'
+    assert entry['buckets'] == {'0.1': 1, '1.0': 3, '+Inf': 4}
+    assert entry['count'] == 4 and entry['sum'] == pytest.approx(6.25)
+
+def test_render_prometheus(registry):
+    registry.phase('ttfb', 0.5, 'example.com')
+    registry.inc('download_retries_total', host='example.com', reason='server')
+    registry.add_collector(lambda: [('downloads_active', 'gauge', {}, 2)])
+    lines = registry.render_prometheus().splitlines()
+    assert '# TYPE download_phase_seconds histogram' in lines
+    assert 'download_phase_seconds_bucket{host="example.com",phase="ttfb",le="0.1"} 0' in lines
+    assert 'download_phase_seconds_bucket{host="example.com",phase="ttfb",le="1.0"} 1' in lines
+    assert 'download_phase_seconds_bucket{host="example.com",phase="ttfb",le="+Inf"} 1' in lines
+    assert 'download_phase_seconds_count{host="example.com",phase="ttfb"} 1' in lines
+    assert 'download_retries_total{host="example.com",reason="server"} 1' in lines
+    assert '# TYPE downloads_active gauge' in lines and 'downloads_active 2' in lines
+    assert any(line.startswith('# HELP download_phase_seconds ') for line in lines)
+
+def test_label_values_are_escaped(registry):
+    registry.inc('x_total', host='a"b\\c\nd')
+    assert 'x_total{host="a\\"b\\\\c\\nd"} 1' in registry.render_prometheus().splitlines()
+
+def test_events_reach_listeners_only_when_present(registry):
+    registry.event('started', url='u')
+    events = []
+    registry.add_listener(events.append)
+    registry.phase('transfer', 0.25, 'h', url='u')
+    assert [(event['event'], event['phase'], event['seconds']) for event in events] == [('phase', 'transfer', 0.25)]
+    registry.remove_listener(events.append)
+    registry.event('completed', url='u')
+    assert len(events) == 1
+
+def test_json_lines_exporter_writes_traces_and_a_final_snapshot(registry, tmp_path):
+    path = tmp_path / 'metrics.jsonl'
+    registry.add_exporter(JsonLinesExporter(registry, str(path), interval=60, trace=True))
+    registry.event('retry', url='u', attempt=1)
+    registry.inc('downloads_failed_total')
+    registry.close()
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [record['event'] for record in records] == ['retry', 'metrics']
+    assert records[1]['metrics'][0]['value'] == 1
+
+def test_instrumented_pools_use_connection_subclasses():
+    adapter = PooledHTTPAdapter()
+    for scheme in ('http', 'https'):
+        connection_class = adapter.poolmanager.pool_classes_by_scheme[scheme].ConnectionCls
+        assert connection_class.adapter is adapter
+    assert PooledHTTPAdapter().poolmanager.pool_classes_by_scheme['http'].ConnectionCls.adapter is not adapter
@@ -0,0 +1,75 @@
+import itertools
+import threading
+
+from downloader_core import HostScheduler, PriorityJobQueue
+
+def test_smallest_key_first_and_fifo_among_ties():
+    priorities = {"u1": 2, "u2": 0, "u3": 2, "u4": 1}
+    queue = PriorityJobQueue(key=priorities.get)
+    for url in priorities:
+        queue.push(url, url.upper())
+    assert len(queue) == 4
+    assert queue.items() == ['U2', 'U4', 'U1', 'U3']
+    assert [queue.pop() for _ in range(4)] == ['U2', 'U4', 'U1', 'U3']
+
+def test_without_a_key_the_queue_is_fifo():
+    queue = PriorityJobQueue()
+    for i in range(5):
+        queue.push(f"u{i}", i)
+    assert [queue.pop() for _ in range(5)] == [0, 1, 2, 3, 4]
+
+def test_reorder_applies_changed_priorities():
+    priorities = {"a": 0, "b": 1, "c": 2}
+    queue = PriorityJobQueue(key=priorities.get)
+    for url in priorities:
+        queue.push(url, url)
+    priorities.update(a=5, c=-1)
+    assert queue.items() == ['a', 'b', 'c']
+    queue.reorder()
+    assert queue.items() == ['c', 'b', 'a']
+
+def test_shared_sequence_orders_ties_across_queues():
+    sequence = itertools.count()
+    first, second = PriorityJobQueue(sequence=sequence), PriorityJobQueue(sequence=sequence)
+    second.push("x", "x")
+    first.push("y", "y")
+    assert second.head() < first.head()
+
+def test_scheduler_dispatches_by_priority_across_hosts():
+    priorities = {"https://a.test/low": 3, "https://b.test/high": 0,
+                  "https://a.test/mid": 1, "https://c.test/mid": 1}
+    started, gate, done = [], threading.Event(), threading.Event()
+
+    def job(url):
+        gate.wait(5)
+        started.append(url)
+        if len(started) == len(priorities):
+            done.set()
+
+    scheduler = HostScheduler(max_workers=1, per_host_limit=1, key=priorities.get)
+    scheduler.submit_many([(url, job, (url,)) for url in priorities])
+    gate.set()
+    assert done.wait(5)
+    scheduler.executor.shutdown(wait=True)
+    # Equal keys keep their submission order, whichever host they are on.
+    assert started == ["https://b.test/high", "https://a.test/mid", "https://c.test/mid", "https://a.test/low"]
+
+def test_reprioritize_reorders_waiting_jobs():
+    priorities = {f"https://a.test/{i}": i for i in range(4)}
+    started, gate, done = [], threading.Event(), threading.Event()
+
+    def job(url):
+        gate.wait(5)
+        started.append(url)
+        if len(started) == len(priorities):
+            done.set()
+
+    scheduler = HostScheduler(max_workers=1, per_host_limit=1, key=priorities.get)
+    scheduler.submit_many([(url, job, (url,)) for url in priorities])
+    for url in priorities:
+        priorities[url] = -priorities[url]
+    scheduler.reprioritize()
+    gate.set()
+    assert done.wait(5)
+    scheduler.executor.shutdown(wait=True)
+    assert started == ["https://a.test/0", "https://a.test/3", "https://a.test/2", "https://a.test/1"]
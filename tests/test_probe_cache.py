@@ -0,0 +1,88 @@
+import pytest
+
+import downloader_core
+from downloader_core import ProbeCache
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(downloader_core.time, 'time', clock)
+    return clock
+
+def test_entries_expire_after_ttl(clock):
+    cache = ProbeCache(ttl=60)
+    cache.put("u", {'size': 1})
+    clock.now += 60
+    assert cache.get("u") == {'size': 1}
+    clock.now += 1
+    assert cache.get("u") is None
+    assert "u" not in cache.entries
+
+def test_put_refreshes_the_timestamp(clock):
+    cache = ProbeCache(ttl=60)
+    cache.put("u", {'size': 1})
+    clock.now += 50
+    cache.put("u", {'size': 2})
+    clock.now += 50
+    assert cache.get("u") == {'size': 2}
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = ProbeCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+def test_invalidate_one_or_all(clock):
+    cache = ProbeCache()
+    for url in "abc":
+        cache.put(url, url)
+    cache.invalidate("b")
+    cache.invalidate("missing")
+    assert [cache.get(url) for url in "abc"] == ['a', None, 'c']
+    cache.invalidate()
+    assert not cache.entries
+
+class FakeResponse:
+    headers = {'Content-Type': 'Video/MP4', 'Content-Length': '42', 'Accept-Ranges': 'bytes'}
+
+    def raise_for_status(self):
+        pass
+
+class CountingSession:
+    def __init__(self):
+        self.heads = []
+
+    def head(self, url, **kwargs):
+        self.heads.append(url)
+        return FakeResponse()
+
+def test_manager_probes_reuse_cached_results(manager, clock):
+    session = manager.session
+    manager.session = CountingSession()
+    try:
+        first = manager.probe_url("https://x.test/a")
+        assert first['ok'] and first['size'] == 42 and first['accept_ranges']
+        assert first['content_type'] == 'video/mp4'
+        assert manager.probe_url("https://x.test/a") is first
+
+        results = manager.probe_urls(["https://x.test/a", "https://x.test/b", "https://x.test/b"])
+        assert set(results) == {"https://x.test/a", "https://x.test/b"}
+        assert manager.session.heads == ["https://x.test/a", "https://x.test/b"]
+
+        clock.now += manager.probe_cache.ttl + 1
+        manager.probe_url("https://x.test/a")
+        assert manager.session.heads[-1] == "https://x.test/a"
+        assert len(manager.session.heads) == 3
+    finally:
+        manager.session = session
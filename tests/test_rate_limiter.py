@@ -0,0 +1,55 @@
+import pytest
+
+from downloader_core import TokenBucket, RateLimiter
+
+def test_bucket_starts_full_and_charges_debt_as_sleep_time():
+    bucket = TokenBucket(1000)
+    assert bucket.consume(1000) == 0.0
+    assert bucket.consume(500) == pytest.approx(0.5, abs=0.01)
+    # The debt carries over, so the next read waits for both.
+    assert bucket.consume(500) == pytest.approx(1.0, abs=0.01)
+
+def test_set_rate_caps_the_balance_at_the_new_burst():
+    bucket = TokenBucket(1000)
+    bucket.set_rate(100)
+    assert bucket.consume(100) == 0.0
+    assert bucket.consume(100) == pytest.approx(1.0, abs=0.02)
+
+def test_unlimited_limiter_never_sleeps():
+    limiter = RateLimiter()
+    assert not limiter.active
+    assert limiter.consume('http://a.example/f', 10 ** 9) == 0.0
+
+def test_the_tightest_bucket_decides():
+    limiter = RateLimiter(global_rate=10000, host_rate=1000)
+    limiter.consume('http://a.example/f', 1000)
+    assert limiter.consume('http://a.example/f', 500) == pytest.approx(0.5, abs=0.01)
+    # Another host has its own bucket; only the global one is shared.
+    assert limiter.consume('http://b.example/f', 1000) == 0.0
+
+def test_host_overrides_and_job_limits():
+    limiter = RateLimiter(host_rate=1000)
+    limiter.set_host_limit(100, host='slow.example')
+    limiter.set_job_limit('http://fast.example/f', 50)
+    assert limiter.limits() == {'global': None, 'host': 1000, 'hosts': {'slow.example': 100},
+                                'jobs': {'http://fast.example/f': 50}}
+    limiter.consume('http://slow.example/f', 100)
+    assert limiter.consume('http://slow.example/f', 100) == pytest.approx(1.0, abs=0.02)
+    limiter.consume('http://fast.example/f', 50)
+    assert limiter.consume('http://fast.example/f', 50) == pytest.approx(1.0, abs=0.02)
+
+def test_mirror_bytes_are_charged_to_the_mirror_host():
+    limiter = RateLimiter()
+    limiter.set_host_limit(100, host='mirror.example')
+    limiter.consume('http://origin.example/f', 100, source='http://mirror.example/f')
+    assert limiter.consume('http://origin.example/f', 100) == 0.0
+    assert limiter.consume('http://origin.example/f', 100, source='http://mirror.example/f') > 0.5
+
+def test_removing_every_limit_deactivates_the_limiter():
+    limiter = RateLimiter(global_rate=1000, host_rate=1000)
+    limiter.set_job_limit('http://a.example/f', 10)
+    limiter.set_global_limit(None)
+    limiter.set_host_limit(0)
+    limiter.clear_job_limits()
+    assert not limiter.active
+    assert limiter.limits() == {'global': None, 'host': None, 'hosts': {}, 'jobs': {}}
@@ -0,0 +1,125 @@
+import time
+from email.utils import formatdate
+
+import pytest
+import requests
+
+from downloader_core import (RetryPolicy, RetryQueue, ConcurrencyController, IntegrityError,
+                             AsyncHttpError)
+from downloader_journal import JobJournal
+
+def http_error(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return requests.exceptions.HTTPError(response=response)
+
+@pytest.mark.parametrize('error, kind', [
+    (http_error(429), 'throttled'),
+    (http_error(503), 'server'),
+    (AsyncHttpError(500), 'server'),
+    (http_error(404), None),
+    (AsyncHttpError(403), None),
+    (requests.exceptions.ReadTimeout(), 'timeout'),
+    (TimeoutError(), 'timeout'),
+    (requests.exceptions.ConnectionError(), 'connection'),
+    (ConnectionError("Segment ended early (10 of 20 bytes)"), 'connection'),
+    (IntegrityError('sha256', 'a' * 64, 'b' * 64), 'corrupt'),
+    (ValueError("bad"), None),
+])
+def test_classify(error, kind):
+    assert RetryPolicy.classify(error) == kind
+
+def test_retry_after_seconds_and_http_date():
+    assert RetryPolicy.retry_after(http_error(503, {'Retry-After': '120'})) == 120.0
+    assert RetryPolicy.retry_after(AsyncHttpError(429, headers={'retry-after': '7'})) == 7.0
+    date = formatdate(time.time() + 60, usegmt=True)
+    assert 50 < RetryPolicy.retry_after(http_error(503, {'Retry-After': date})) <= 60
+    past = formatdate(time.time() - 60, usegmt=True)
+    assert RetryPolicy.retry_after(http_error(503, {'Retry-After': past})) == 0.0
+
+@pytest.mark.parametrize('value', [None, '', 'soon'])
+def test_retry_after_missing_or_invalid(value):
+    headers = {'Retry-After': value} if value is not None else {}
+    assert RetryPolicy.retry_after(http_error(503, headers)) is None
+
+def test_next_delay_uses_full_jitter_within_the_cap():
+    policy = RetryPolicy({'connection': (5, 1.0, 3.0)})
+    error = ConnectionError()
+    for attempt in range(1, 6):
+        delay = policy.next_delay(error, attempt)
+        assert 0 <= delay <= min(3.0, 2 ** (attempt - 1))
+    assert policy.next_delay(error, 6) is None
+
+def test_next_delay_honours_retry_after():
+    policy = RetryPolicy()
+    assert policy.next_delay(http_error(429, {'Retry-After': '30'}), 1) >= 30
+    assert policy.next_delay(http_error(429, {'Retry-After': str(RetryPolicy.MAX_RETRY_AFTER + 1)}), 1) is None
+
+def test_permanent_errors_are_not_retried():
+    policy = RetryPolicy()
+    assert policy.next_delay(http_error(404), 1) is None
+    assert policy.max_attempts(http_error(404)) == 0
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def test_retry_queue_survives_a_failing_submit():
+    submitted, failed = [], []
+    def submit(job):
+        if job == 'bad':
+            raise RuntimeError("engine closed")
+        submitted.append(job)
+
+    queue = RetryQueue(submit, on_error=lambda job, error: failed.append(job))
+    try:
+        queue.schedule(0, 'bad')
+        assert wait_until(lambda: failed == ['bad'])
+        queue.schedule(0, 'good')
+        assert wait_until(lambda: submitted == ['good'])
+        assert wait_until(lambda: len(queue) == 0)
+    finally:
+        queue.close()
+
+def test_retry_queue_hands_out_jobs_in_due_order():
+    submitted = []
+    queue = RetryQueue(submitted.append)
+    try:
+        queue.schedule(0.2, 'late')
+        queue.schedule(0.05, 'early')
+        assert len(queue) == 2
+        assert wait_until(lambda: submitted == ['early', 'late'])
+        queue.schedule(60, 'never')
+        assert queue.clear() == ['never']
+    finally:
+        queue.close()
+
+def test_error_only_host_keeps_backing_off():
+    changes = []
+    controller = ConcurrencyController(initial_limit=8, max_limit=8, on_change=lambda host, limit: changes.append(limit))
+    controller.WINDOW = 0.02
+    for _ in range(4):
+        for _ in range(3):
+            controller.observe_error('http://example.com/file', http_error(503))
+        time.sleep(0.03)
+    assert changes == [4, 2, 1]
+
+def test_retry_due_after_stop_is_recorded_as_stopped(manager, tmp_path):
+    manager.journal = JobJournal(str(tmp_path / 'jobs.sqlite3'), flush_interval=60)
+    try:
+        manager.journal.record_queued([('https://example.com/a.bin', 'a.bin', str(tmp_path))])
+        manager.journal.record_state('https://example.com/a.bin', 'retrying')
+        manager.retry_attempts['https://example.com/a.bin'] = 2
+        manager.stop_flag = True
+        manager._resubmit(('https://example.com/a.bin', 'a.bin', str(tmp_path)))
+        assert 'https://example.com/a.bin' not in manager.retry_attempts
+        assert not manager.has_pending_work()
+        manager.journal.flush()
+        state = manager.journal.db.execute("SELECT state FROM jobs").fetchone()[0]
+        assert state == 'stopped'
+    finally:
+        manager.journal.close()
+        manager.journal = None
@@ -0,0 +1,64 @@
+from threading import Lock
+
+from downloader_core import StripePlan
+
+NOT_ABORTED = {'flag': False}
+
+def make_plan(pieces, sources=('a', 'b'), min_steal=100):
+    return StripePlan(pieces, list(sources), Lock(), min_steal)
+
+def test_pieces_are_claimed_in_order_and_plan_completes():
+    plan = make_plan([[0, 999, 0], [1000, 1999, 0]])
+    assert plan.claim('a', NOT_ABORTED) == 0
+    assert plan.claim('b', NOT_ABORTED) == 1
+    for index, source in ((0, 'a'), (1, 'b')):
+        plan.pieces[index][2] = 1000
+        plan.finish(index, source, 1000, 0.1)
+    assert plan.complete()
+    assert plan.claim('a', NOT_ABORTED) is None
+
+def test_resumed_pieces_that_are_done_are_not_handed_out():
+    plan = make_plan([[0, 999, 1000], [1000, 1999, 10]])
+    assert plan.claim('a', NOT_ABORTED) == 1
+
+def test_idle_fast_mirror_steals_the_tail_of_a_slow_piece():
+    plan = make_plan([[0, 999, 0], [1000, 1999, 0]])
+    plan.claim('a', NOT_ABORTED)
+    plan.claim('b', NOT_ABORTED)
+    plan.pieces[1][2] = 1000
+    plan.finish(1, 'b', 1000, 0.1)
+    plan.speeds['a'] = 1000.0
+    plan.pieces[0][2] = 100
+
+    index = plan.claim('b', NOT_ABORTED)
+    # b is ten times faster, so it takes that share of what the owner leaves over.
+    tail = int((900 - 100) * 10000 / 11000)
+    assert index == 2
+    assert plan.pieces[2] == [1000 - tail, 999, 0]
+    assert plan.pieces[0] == [0, 999 - tail, 100]
+    assert StripePlan.remaining(plan.pieces[0]) >= plan.min_steal
+
+def test_tail_below_min_steal_is_left_to_its_owner():
+    plan = make_plan([[0, 999, 0]], min_steal=500)
+    plan.claim('a', NOT_ABORTED)
+    plan.pieces[0][2] = 800
+    assert plan._steal('b') is None
+
+def test_release_requeues_the_piece_and_drops_a_failing_mirror():
+    plan = make_plan([[0, 999, 0]])
+    for attempt in range(1, StripePlan.MAX_FAILURES + 1):
+        index = plan.claim('a', NOT_ABORTED)
+        assert index == 0
+        plan.pieces[0][2] += 10
+        kept = plan.release(index, 'a', IOError("reset"))
+        assert kept == (attempt < StripePlan.MAX_FAILURES)
+    assert 'a' in plan.dropped
+    assert plan.claim('a', NOT_ABORTED) is None
+    # The piece keeps its progress and goes to the next mirror.
+    assert plan.claim('b', NOT_ABORTED) == 0
+    assert plan.pieces[0][2] == 30
+
+def test_fatal_release_drops_the_mirror_at_once():
+    plan = make_plan([[0, 999, 0]])
+    plan.release(plan.claim('a', NOT_ABORTED), 'a', IOError("404"), fatal=True)
+    assert plan.dropped == {'a'}
@@ -0,0 +1,39 @@
+import itertools
+
+import pytest
+
+from downloader_core import UrlTemplate
+
+def test_ranges_multiply_out_leftmost_outermost():
+    template = UrlTemplate("https://x/s{1-2}e{01-03}.mkv")
+    assert len(template) == 6
+    assert list(template) == [f"https://x/s{s}e0{e}.mkv" for s in (1, 2) for e in (1, 2, 3)]
+
+def test_steps_padding_and_descending_ranges():
+    assert list(UrlTemplate("f_{0000-0030:10}.png")) == ['f_0000.png', 'f_0010.png', 'f_0020.png', 'f_0030.png']
+    assert list(UrlTemplate("p{3-1}")) == ['p3', 'p2', 'p1']
+    # Only a start written with a leading zero pads.
+    assert list(UrlTemplate("n{9-10}")) == ['n9', 'n10']
+
+def test_hash_runs_share_one_counter():
+    template = UrlTemplate("https://x/###/img_##.jpg", start=8, end=10)
+    assert list(template) == ['https://x/008/img_08.jpg', 'https://x/009/img_09.jpg', 'https://x/010/img_10.jpg']
+
+@pytest.mark.parametrize('args', [("https://x/plain",), ("https://x/###",), ("f{1-5:0}",)])
+def test_invalid_templates(args):
+    with pytest.raises(ValueError):
+        UrlTemplate(*args)
+
+def test_huge_series_is_expanded_lazily():
+    template = UrlTemplate("https://x/{1-1000}/{1-1000}/{1-1000}.bin")
+    assert len(template) == 10 ** 9
+    assert list(itertools.islice(template, 2)) == ['https://x/1/1/1.bin', 'https://x/1/1/2.bin']
+
+def test_manager_feeds_a_source_in_bounded_batches(manager, tmp_path):
+    template = UrlTemplate("https://x/{1-100000}.bin")
+    manager.add_job_source((url, manager.default_filename(url), str(tmp_path)) for url in template)
+    assert manager.download_queue.qsize() == manager.FEED_BATCH
+    assert len(manager.telemetry.queued) == manager.FEED_BATCH
+    # Not running low yet, so nothing more is drawn.
+    assert manager.feed_jobs() == 0
+    assert manager.has_pending_work()
@@ -0,0 +1,113 @@
+import os
+import threading
+
+import pytest
+
+from downloader_core import WriteScheduler
+
+@pytest.fixture
+def scheduler():
+    scheduler = WriteScheduler(max_dirty=256 * 1024, flush_size=64 * 1024)
+    yield scheduler
+    scheduler.shutdown()
+
+def test_small_writes_are_coalesced_into_flush_size_blocks(scheduler, tmp_path):
+    path = str(tmp_path / 'file.part')
+    data = os.urandom(64 * 1024 * 4)
+    with scheduler.open(path, truncate=True) as stream:
+        for start in range(0, len(data), 1024):
+            stream.write(data[start:start + 1024])
+        assert stream.committed <= len(data)
+    assert stream.committed == len(data)
+    assert open(path, 'rb').read() == data
+    stats = scheduler.snapshot()
+    assert stats['writes'] == 4
+    assert stats['dirty_bytes'] == 0 and stats['open_streams'] == 0
+
+def test_ranges_of_one_file_are_written_at_their_offsets(scheduler, tmp_path):
+    path = str(tmp_path / 'file.part')
+    data = os.urandom(300000)
+    scheduler.create(path, len(data))
+
+    def write_range(start, end):
+        with scheduler.open(path, start) as stream:
+            for position in range(start, end, 7000):
+                stream.write(data[position:min(end, position + 7000)])
+
+    threads = [threading.Thread(target=write_range, args=(start, min(len(data), start + 100000)))
+               for start in range(0, len(data), 100000)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert open(path, 'rb').read() == data
+
+def test_dirty_bytes_stay_under_the_cap(tmp_path):
+    scheduler = WriteScheduler(max_dirty=128 * 1024, flush_size=32 * 1024)
+    try:
+        def write_file(n):
+            with scheduler.open(str(tmp_path / f"{n}.part"), truncate=True) as stream:
+                for _ in range(64):
+                    stream.write(b'x' * 10000)
+
+        threads = [threading.Thread(target=write_file, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = scheduler.snapshot()
+        assert stats['peak_dirty_bytes'] <= 128 * 1024
+        assert stats['dirty_bytes'] == 0
+        assert all(os.path.getsize(tmp_path / f"{n}.part") == 640000 for n in range(8))
+    finally:
+        scheduler.shutdown()
+
+def test_flush_commits_the_tail(scheduler, tmp_path):
+    path = str(tmp_path / 'file.part')
+    stream = scheduler.open(path, truncate=True)
+    stream.write(b'abc')
+    assert stream.committed == 0
+    stream.flush()
+    assert stream.committed == 3
+    stream.close()
+
+@pytest.mark.parametrize('sync_policy', WriteScheduler.SYNC_POLICIES)
+def test_finalize_moves_the_part_file_into_place(tmp_path, sync_policy):
+    scheduler = WriteScheduler(sync_policy=sync_policy)
+    try:
+        part, target = str(tmp_path / 'f.bin.part'), str(tmp_path / 'f.bin')
+        with scheduler.open(part, truncate=True) as stream:
+            stream.write(b'data')
+        assert scheduler.finalize(part, target)
+        assert open(target, 'rb').read() == b'data'
+        assert not os.path.exists(part)
+        # The file and its directory around the rename, and with 'always' the block as well.
+        assert scheduler.snapshot()['syncs'] == {'none': 0, 'finish': 2, 'always': 3}[sync_policy]
+    finally:
+        scheduler.shutdown()
+
+def test_finalize_never_replaces_a_file_created_meanwhile(scheduler, tmp_path):
+    part, target = str(tmp_path / 'f.bin.part'), str(tmp_path / 'f.bin')
+    assert not scheduler.exists(target)
+    with open(target, 'wb') as f:
+        f.write(b'theirs')
+    with scheduler.open(part, truncate=True) as stream:
+        stream.write(b'ours')
+    assert not scheduler.finalize(part, target)
+    assert open(target, 'rb').read() == b'theirs'
+    assert scheduler.exists(target)
+
+def test_exists_uses_the_listing_and_confirms_hits(scheduler, tmp_path):
+    target = str(tmp_path / 'f.bin')
+    assert not scheduler.exists(target)
+    open(target, 'wb').close()
+    # Still answered from the listing taken above.
+    assert not scheduler.exists(target)
+    scheduler.add_existing(target)
+    assert scheduler.exists(target)
+    os.remove(target)
+    assert not scheduler.exists(target)
+
+def test_unknown_sync_policy_is_rejected():
+    with pytest.raises(ValueError):
+        WriteScheduler(sync_policy='sometimes')